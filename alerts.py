@@ -0,0 +1,258 @@
+"""Alert rules evaluated against incoming readings, with deduplicated notifications.
+
+Functions take the SQLAlchemy session explicitly so both the Flask app
+(``db.session``) and the async tier (through ``AsyncSession.run_sync``)
+share the same rules. Evaluation happens inside the caller's transaction;
+notifications are sent after the caller commits.
+"""
+import json
+import logging
+import threading
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import AlertRule, Alert, Sensor, SensorLatest, DataVersion
+
+logger = logging.getLogger(__name__)
+
+RuleRef = namedtuple('RuleRef', 'rule_id name rule_kind type_id location_id min_value max_value '
+                                'max_rate no_data_minutes severity cooldown')
+Trigger = namedtuple('Trigger', 'rule sensor_id value message')
+
+
+def _rule_ref(rule):
+    def number(value):
+        return float(value) if value is not None else None
+    return RuleRef(rule.rule_id, rule.name, rule.rule_kind, rule.type_id, rule.location_id,
+                   number(rule.min_value), number(rule.max_value), number(rule.max_rate_per_hour),
+                   rule.no_data_minutes, rule.severity, timedelta(minutes=rule.cooldown_minutes or 0))
+
+
+def versions(session):
+    """{table name: version} for callers without Flask's per-request cache"""
+    return dict(session.execute(select(DataVersion.name, DataVersion.version)).all())
+
+
+# =====================================================
+# RULE INDEX
+# =====================================================
+
+class RuleIndex:
+    """Active rules resolved per sensor, rebuilt when AlertRule or Sensor changes.
+
+    ``by_sensor`` maps a sensor id to its (threshold rules, rate rules).
+    Sensors without rules are absent, so for most readings evaluation is
+    a single failed dict lookup.
+    """
+
+    def __init__(self):
+        self.by_sensor = {}
+        self.no_data = ()
+        self.sensors = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def refresh(self, session, current_versions):
+        stamp = (current_versions.get('AlertRule', 0), current_versions.get('Sensor', 0))
+        if stamp == self._stamp:
+            return self
+        rules = [_rule_ref(rule) for rule in session.execute(
+            select(AlertRule).where(AlertRule.is_active.is_(True))
+        ).scalars()]
+        sensors = {row.sensor_id: row for row in session.execute(
+            select(Sensor.sensor_id, Sensor.type_id, Sensor.location_id, Sensor.status)
+        ).all()}
+
+        by_sensor = {}
+        for sensor in sensors.values():
+            applicable = [rule for rule in rules
+                          if rule.type_id in (None, sensor.type_id)
+                          and rule.location_id in (None, sensor.location_id)]
+            thresholds = tuple(r for r in applicable if r.rule_kind == 'THRESHOLD')
+            rates = tuple(r for r in applicable if r.rule_kind == 'RATE')
+            if thresholds or rates:
+                by_sensor[sensor.sensor_id] = (thresholds, rates)
+
+        with self._lock:
+            self.by_sensor = by_sensor
+            self.no_data = tuple(r for r in rules if r.rule_kind == 'NO_DATA')
+            self.sensors = sensors
+            self._stamp = stamp
+        return self
+
+    def invalidate(self):
+        with self._lock:
+            self._stamp = None
+
+
+index = RuleIndex()
+
+
+# =====================================================
+# EVALUATION
+# =====================================================
+
+def check_readings(session, rows, current_versions=None):
+    """Evaluate validated ingest rows; records alerts and returns the new ones.
+
+    Call before inserting ``rows`` so rate rules compare against the
+    previous latest reading: SensorLatest as committed, then the batch's
+    own earlier rows.
+    """
+    if current_versions is None:
+        current_versions = versions(session)
+    by_sensor = index.refresh(session, current_versions).by_sensor
+    if not by_sensor:
+        return []
+    matched = [(row, by_sensor[row['sensor_id']]) for row in rows if row['sensor_id'] in by_sensor]
+    if not matched:
+        return []
+
+    # (timestamp, value) of each rate-checked sensor's latest reading
+    last_values = {}
+    rated = {row['sensor_id'] for row, (_, rates) in matched if rates}
+    if rated:
+        for sensor_id, timestamp, value in session.execute(
+            select(SensorLatest.sensor_id, SensorLatest.reading_timestamp, SensorLatest.reading_value)
+            .where(SensorLatest.sensor_id.in_(rated))
+        ).all():
+            last_values[sensor_id] = (timestamp, float(value))
+
+    triggers = []
+    matched.sort(key=lambda item: item[0]['reading_timestamp'])
+    for row, (thresholds, rates) in matched:
+        sensor_id, value = row['sensor_id'], float(row['reading_value'])
+        timestamp = row['reading_timestamp']
+        for rule in thresholds:
+            if rule.max_value is not None and value > rule.max_value:
+                triggers.append(Trigger(rule, sensor_id, value,
+                                        f'{rule.name}: {value:g} is above {rule.max_value:g}'))
+            elif rule.min_value is not None and value < rule.min_value:
+                triggers.append(Trigger(rule, sensor_id, value,
+                                        f'{rule.name}: {value:g} is below {rule.min_value:g}'))
+        if rates:
+            previous = last_values.get(sensor_id)
+            if previous is None or timestamp > previous[0]:
+                if previous is not None:
+                    hours = (timestamp - previous[0]).total_seconds() / 3600
+                    rate = abs(value - previous[1]) / hours
+                    for rule in rates:
+                        if rule.max_rate is not None and rate > rule.max_rate:
+                            triggers.append(Trigger(rule, sensor_id, value,
+                                                    f'{rule.name}: changing {rate:.2f}/h, '
+                                                    f'limit {rule.max_rate:g}/h'))
+                last_values[sensor_id] = (timestamp, value)
+
+    return record(session, triggers) if triggers else []
+
+
+def check_no_data(session, current_versions, now=None):
+    """Raise NO_DATA alerts for active sensors that have gone quiet"""
+    now = now or datetime.utcnow()
+    rule_index = index.refresh(session, current_versions)
+    if not rule_index.no_data:
+        return []
+    latest = dict(session.execute(select(SensorLatest.sensor_id, SensorLatest.reading_timestamp)).all())
+
+    triggers = []
+    for rule in rule_index.no_data:
+        limit = now - timedelta(minutes=rule.no_data_minutes or 0)
+        for sensor in rule_index.sensors.values():
+            if (sensor.status != 'ACTIVE' or rule.type_id not in (None, sensor.type_id)
+                    or rule.location_id not in (None, sensor.location_id)):
+                continue
+            seen = latest.get(sensor.sensor_id)
+            if seen is None or seen < limit:
+                since = f'since {seen:%Y-%m-%d %H:%M}' if seen else 'ever'
+                triggers.append(Trigger(rule, sensor.sensor_id, None, f'{rule.name}: no readings {since}'))
+    return record(session, triggers, now) if triggers else []
+
+
+def record(session, triggers, now=None):
+    """Store triggers, folding repeats into open alerts still inside their cooldown"""
+    now = now or datetime.utcnow()
+    open_alerts = {}
+    for alert in session.execute(
+        select(Alert).where(
+            Alert.rule_id.in_({t.rule.rule_id for t in triggers}),
+            Alert.sensor_id.in_({t.sensor_id for t in triggers}),
+            Alert.acknowledged_at.is_(None)
+        ).order_by(Alert.triggered_at)
+    ).scalars():
+        open_alerts[(alert.rule_id, alert.sensor_id)] = alert
+
+    created = []
+    for trigger in triggers:
+        key = (trigger.rule.rule_id, trigger.sensor_id)
+        alert = open_alerts.get(key)
+        if alert is not None and now - alert.triggered_at < trigger.rule.cooldown:
+            alert.occurrences += 1
+            alert.last_seen_at = now
+            alert.reading_value = trigger.value
+            continue
+        alert = Alert(rule_id=trigger.rule.rule_id, sensor_id=trigger.sensor_id,
+                      severity=trigger.rule.severity, message=trigger.message[:255],
+                      reading_value=trigger.value, triggered_at=now, last_seen_at=now)
+        session.add(alert)
+        open_alerts[key] = alert
+        created.append(alert)
+
+    session.flush()
+    return [alert.to_dict() for alert in created]
+
+
+# =====================================================
+# NOTIFIERS
+# =====================================================
+
+_notifiers = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def notifier(name):
+    """Register ``func(alert, config)`` as the notifier called ``name``"""
+    def decorator(func):
+        _notifiers[name] = func
+        return func
+    return decorator
+
+
+@notifier('log')
+def _log_notifier(alert, config):
+    logger.warning('[%s] sensor %s: %s', alert['severity'], alert['sensor_id'], alert['message'])
+
+
+@notifier('webhook')
+def _webhook_notifier(alert, config):
+    url = config.get('ALERT_WEBHOOK_URL')
+    if not url:
+        return
+    request = urllib.request.Request(url, data=json.dumps(alert).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    urllib.request.urlopen(request, timeout=5).close()
+
+
+def _deliver(names, alert, config):
+    for name in names:
+        try:
+            _notifiers[name](alert, config)
+        except Exception:
+            logger.exception('Alert notifier %s failed', name)
+
+
+def notify(alerts, config):
+    """Send newly created alerts to the configured notifiers, off the request thread"""
+    global _pool
+    if not alerts:
+        return
+    names = [name for name in config['ALERT_NOTIFIERS'] if name in _notifiers]
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='notify')
+    for alert in alerts:
+        _pool.submit(_deliver, names, alert, config)
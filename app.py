@@ -1,20 +1,55 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, g, stream_with_context
+from flask.sessions import SecureCookieSessionInterface
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user, user_loaded_from_request
 from config import config
-from models import db, User, SensorType, Location, Sensor, Reading, Technician, MaintenanceEvent, SensorStatusLog
-from sqlalchemy import func, text
-from datetime import datetime
+from models import db, User, ApiToken, SensorType, Location, Sensor, Reading, SensorLatest, Technician, MaintenanceEvent, AlertRule, Alert, ReportSnapshot
+from sqlalchemy import func
+from datetime import datetime, timedelta
+import alerts
+import auth
+import availability
+import cache
+import chunkstore
+import compress
+import edge
+import fastjson
+import fieldsets
+import heatmap
+import ingest
+import jobs
+import latest
+import listing
+import metrics
+import purge
+import scoring
+import search_index
+import series
+import shards
+import snapshots
+import click
 import os
 import csv
+import heapq
 from io import StringIO
+from itertools import islice
+
+class ApiSessionInterface(SecureCookieSessionInterface):
+    """Skip the session cookie for requests authenticated by API token"""
+    
+    def save_session(self, app, session, response):
+        if g.get('login_via_token'):
+            return
+        return super().save_session(app, session, response)
 
 def create_app(config_name='development'):
     """Application factory function"""
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.session_interface = ApiSessionInterface()
     
     # Initialize extensions
     db.init_app(app)
+    edge.init_app(app)
     
     # Initialize Flask-Login
     login_manager = LoginManager()
@@ -25,7 +60,24 @@ def create_app(config_name='development'):
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return auth.user_cache.get(int(user_id), app.config['USER_CACHE_TTL'])
+    
+    @login_manager.request_loader
+    def load_user_from_token(request):
+        token = auth.token_from_request(request)
+        if token is None:
+            return None
+        return auth.token_table.lookup(token, app.config['API_TOKEN_REFRESH_INTERVAL'])
+    
+    @user_loaded_from_request.connect_via(app)
+    def mark_token_login(sender, user=None):
+        g.login_via_token = True
+    
+    # Request, query and cache metrics; registered first so it sees compressed sizes
+    metrics.init_app(app)
+    
+    # Negotiated gzip/br/zstd compression, streamed responses included
+    compress.init_app(app)
     
     return app
 
@@ -46,16 +98,45 @@ def login():
         password = request.form.get('password')
         remember = request.form.get('remember', False)
         
+        # Throttle before doing any hashing work
+        window = app.config['LOGIN_RATE_WINDOW']
+        ip_key = f'ip:{request.remote_addr}'
+        user_key = f'user:{username}'
+        if (auth.login_attempts.exceeded(ip_key, app.config['LOGIN_MAX_ATTEMPTS_PER_IP'], window) or
+                auth.login_attempts.exceeded(user_key, app.config['LOGIN_MAX_FAILURES_PER_USER'], window)):
+            flash('Too many login attempts. Please wait a few minutes and try again.', 'danger')
+            return render_template('auth/login.html'), 429
+        auth.login_attempts.hit(ip_key, window)
+        
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        # Always hash, so the response time doesn't reveal whether the username exists
+        password_hash = user.password_hash if user else auth.dummy_hash(app.config['PASSWORD_HASH_METHOD'])
+        try:
+            valid = auth.password_hasher.verify(password_hash, password or '') and bool(user and password)
+        except auth.HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('auth/login.html'), 503
+        
+        if valid:
             if not user.is_active:
                 flash('Your account has been deactivated. Please contact administrator.', 'danger')
                 return redirect(url_for('login'))
             
+            auth.login_attempts.reset(user_key)
             login_user(user, remember=remember)
             user.last_login = datetime.utcnow()
+            
+            # Upgrade the stored hash when the configured parameters have changed
+            method = app.config['PASSWORD_HASH_METHOD']
+            if user.password_needs_rehash(auth.hash_prefix(method)):
+                try:
+                    user.password_hash = auth.password_hasher.hash(password, method)
+                except auth.HasherBusy:
+                    pass  # retried on the next login
+            
             db.session.commit()
+            auth.invalidate_user(user.user_id)
             
             flash(f'Welcome back, {user.full_name or user.username}!', 'success')
             
@@ -63,6 +144,7 @@ def login():
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
+            auth.login_attempts.hit(user_key, window)
             flash('Invalid username or password. Please try again.', 'danger')
     
     return render_template('auth/login.html')
@@ -108,7 +190,11 @@ def signup():
             email=email,
             full_name=full_name
         )
-        user.set_password(password)
+        try:
+            user.password_hash = auth.password_hasher.hash(password)
+        except auth.HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return redirect(url_for('signup'))
         
         db.session.add(user)
         db.session.commit()
@@ -134,25 +220,29 @@ def logout():
 @login_required
 def index():
     """Dashboard with statistics"""
+    # Reading shards are queried in parallel with the primary database
+    shard_counts = shards.scatter(shards.READING_COUNT)
+    
     # Get statistics
     total_sensors = Sensor.query.count()
     active_sensors = Sensor.query.filter_by(status='ACTIVE').count()
-    total_readings = Reading.query.count()
+    total_readings = db.session.query(func.count(Reading.reading_id)).scalar() + chunkstore.reading_count(db.session)
+    total_readings += sum(row[0] for row in shard_counts.rows())
     total_locations = Location.query.count()
     total_technicians = Technician.query.count()
     total_maintenance = MaintenanceEvent.query.count()
     
-    # Recent readings
+    # Recent readings (latest per sensor, independent of history size)
     recent_readings = db.session.query(
-        Reading, Sensor, SensorType, Location
+        SensorLatest, Sensor, SensorType, Location
     ).join(
-        Sensor, Reading.sensor_id == Sensor.sensor_id
+        Sensor, SensorLatest.sensor_id == Sensor.sensor_id
     ).join(
         SensorType, Sensor.type_id == SensorType.type_id
     ).join(
         Location, Sensor.location_id == Location.location_id
     ).order_by(
-        Reading.reading_timestamp.desc()
+        SensorLatest.reading_timestamp.desc()
     ).limit(10).all()
     
     # Maintenance events count by type
@@ -161,16 +251,12 @@ def index():
         func.count(MaintenanceEvent.maintenance_id).label('count')
     ).group_by(MaintenanceEvent.event_type).all()
     
-    # Average readings by sensor type
-    avg_readings = db.session.query(
-        SensorType.name,
-        func.avg(Reading.reading_value).label('avg_value'),
-        func.count(Reading.reading_id).label('reading_count')
-    ).join(
-        Sensor, SensorType.type_id == Sensor.type_id
-    ).join(
-        Reading, Sensor.sensor_id == Reading.sensor_id
-    ).group_by(SensorType.name).all()
+    # Average readings by sensor type read every reading; take them from the
+    # reports snapshot of averages by area and type instead
+    areas = snapshots.newest('areas')
+    if areas is None or not snapshots.is_current(areas, app.config):
+        _submit_snapshots(['areas'])
+    avg_readings = snapshots.type_averages(areas) if areas is not None else None
     
     return render_template('index.html',
                          total_sensors=total_sensors,
@@ -195,7 +281,7 @@ def sensor_types_list():
     
     query = SensorType.query
     if search:
-        query = query.filter(SensorType.name.like(f'%{search}%'))
+        query = query.filter(search_index.clause('sensor_type', search))
     
     sensor_types = query.order_by(SensorType.name).all()
     return render_template('sensor_types/list.html', sensor_types=sensor_types, search=search)
@@ -210,6 +296,7 @@ def sensor_type_create():
         
         sensor_type = SensorType(name=name, description=description)
         db.session.add(sensor_type)
+        cache.bump_version('SensorType')
         db.session.commit()
         
         flash(f'Sensor type "{name}" created successfully!', 'success')
@@ -227,6 +314,7 @@ def sensor_type_edit(type_id):
         sensor_type.name = request.form.get('name')
         sensor_type.description = request.form.get('description')
         
+        cache.bump_version('SensorType')
         db.session.commit()
         flash(f'Sensor type "{sensor_type.name}" updated successfully!', 'success')
         return redirect(url_for('sensor_types_list'))
@@ -241,6 +329,7 @@ def sensor_type_delete(type_id):
     
     try:
         db.session.delete(sensor_type)
+        cache.bump_version('SensorType')
         db.session.commit()
         flash(f'Sensor type "{sensor_type.name}" deleted successfully!', 'success')
     except Exception as e:
@@ -261,7 +350,7 @@ def locations_list():
     
     query = Location.query
     if search:
-        query = query.filter(Location.area_name.like(f'%{search}%'))
+        query = query.filter(search_index.clause('location', search))
     
     locations = query.order_by(Location.area_name).all()
     return render_template('locations/list.html', locations=locations, search=search)
@@ -285,6 +374,7 @@ def location_create():
         
         try:
             db.session.add(location)
+            cache.bump_version('Location')
             db.session.commit()
             flash(f'Location "{area_name}" created successfully!', 'success')
             return redirect(url_for('locations_list'))
@@ -307,6 +397,7 @@ def location_edit(location_id):
         location.elevation = request.form.get('elevation', 0.0)
         
         try:
+            cache.bump_version('Location')
             db.session.commit()
             flash(f'Location "{location.area_name}" updated successfully!', 'success')
             return redirect(url_for('locations_list'))
@@ -324,6 +415,7 @@ def location_delete(location_id):
     
     try:
         db.session.delete(location)
+        cache.bump_version('Location')
         db.session.commit()
         flash(f'Location "{location.area_name}" deleted successfully!', 'success')
     except Exception as e:
@@ -344,11 +436,13 @@ def sensors_list():
     status_filter = request.args.get('status', '')
     type_filter = request.args.get('type', '')
     location_filter = request.args.get('location', '')
+    page = request.args.get('page', 1, type=int)
     
-    query = Sensor.query
+    query = Sensor.query.options(db.joinedload(Sensor.sensor_type), db.joinedload(Sensor.location))
+    search_clause = search_index.clause('sensor', search) if search else None
     
-    if search:
-        query = query.filter(Sensor.model.like(f'%{search}%'))
+    if search_clause is not None:
+        query = query.filter(search_clause)
     
     if status_filter:
         query = query.filter(Sensor.status == status_filter)
@@ -359,14 +453,21 @@ def sensors_list():
     if location_filter:
         query = query.filter(Sensor.location_id == location_filter)
     
-    sensors = query.order_by(Sensor.sensor_id.desc()).all()
+    # Filter counts and the page total from one grouped query
+    facets = listing.sensor_facets(search_clause, status_filter, type_filter, location_filter)
+    pagination = listing.paginate(query.order_by(Sensor.sensor_id.desc()), page,
+                                  app.config['ITEMS_PER_PAGE'], facets.total)
     
     # Get filter options
-    sensor_types = SensorType.query.order_by(SensorType.name).all()
-    locations = Location.query.order_by(Location.area_name).all()
+    sensor_types = cache.sensor_types()
+    locations = cache.locations()
     
     return render_template('sensors/list.html',
-                         sensors=sensors,
+                         sensors=pagination.items,
+                         pagination=pagination,
+                         facets=facets,
+                         filter_args={k: v for k, v in request.args.items() if v and k != 'page'},
+                         purge_jobs=jobs.runner.active('purge-sensor:'),
                          sensor_types=sensor_types,
                          locations=locations,
                          search=search,
@@ -394,13 +495,14 @@ def sensor_create():
         )
         
         db.session.add(sensor)
+        cache.bump_version('Sensor')
         db.session.commit()
         
         flash(f'Sensor "{model}" created successfully!', 'success')
         return redirect(url_for('sensors_list'))
     
-    sensor_types = SensorType.query.order_by(SensorType.name).all()
-    locations = Location.query.order_by(Location.area_name).all()
+    sensor_types = cache.sensor_types()
+    locations = cache.locations()
     
     return render_template('sensors/form.html',
                          sensor_types=sensor_types,
@@ -419,12 +521,13 @@ def sensor_edit(sensor_id):
         sensor.type_id = request.form.get('type_id')
         sensor.location_id = request.form.get('location_id')
         
+        cache.bump_version('Sensor')
         db.session.commit()
         flash(f'Sensor "{sensor.model}" updated successfully!', 'success')
         return redirect(url_for('sensors_list'))
     
-    sensor_types = SensorType.query.order_by(SensorType.name).all()
-    locations = Location.query.order_by(Location.area_name).all()
+    sensor_types = cache.sensor_types()
+    locations = cache.locations()
     
     return render_template('sensors/form.html',
                          sensor=sensor,
@@ -436,9 +539,20 @@ def sensor_edit(sensor_id):
 def sensor_delete(sensor_id):
     """Delete a sensor"""
     sensor = Sensor.query.get_or_404(sensor_id)
+    chunk_size = app.config['SENSOR_PURGE_CHUNK_SIZE']
+    
+    # Large histories are purged in chunks by a background job
+    if purge.history_exceeds(sensor_id, chunk_size):
+        job = jobs.runner.submit(app, f'Delete sensor {sensor.model}', purge.purge_sensor,
+                                 sensor_id, chunk_size, key=f'purge-sensor:{sensor_id}')
+        flash(f'Sensor "{sensor.model}" has a large history and is being deleted in the background (job {job.job_id}).', 'info')
+        return redirect(url_for('sensors_list'))
     
     try:
+        # Readings on other shards have no foreign key to cascade from
+        shards.delete_readings(sensor_id, chunk_size)
         db.session.delete(sensor)
+        cache.bump_version('Sensor', 'MaintenanceEvent')
         db.session.commit()
         flash(f'Sensor "{sensor.model}" deleted successfully!', 'success')
     except Exception as e:
@@ -447,22 +561,39 @@ def sensor_delete(sensor_id):
     
     return redirect(url_for('sensors_list'))
 
+def _series_request(sensor_id):
+    """Parse window and cursor arguments shared by the readings page and API"""
+    days, end, cursor, limit = series.parse_args(request.args, app.config)
+    start, end = series.resolve_window(sensor_id, days, end)
+    return days, start, end, cursor, limit
+
 @app.route('/sensors/<int:sensor_id>/readings')
 @login_required
 def sensor_readings(sensor_id):
-    """View all readings for a specific sensor"""
+    """View a time window of readings for a specific sensor"""
     sensor = Sensor.query.get_or_404(sensor_id)
     
-    # Call stored procedure
-    result = db.session.execute(
-        text('CALL GetSensorReadings(:sensor_id)'),
-        {'sensor_id': sensor_id}
+    try:
+        days, start, end, cursor, _ = _series_request(sensor_id)
+    except ValueError:
+        flash('Invalid date or page cursor.', 'danger')
+        return redirect(url_for('sensor_readings', sensor_id=sensor_id))
+    
+    versions = cache.current_versions()
+    readings, next_cursor = series.readings_page(
+        sensor_id, start, end, cursor, app.config['READINGS_PAGE_SIZE'], versions
     )
-    readings = result.fetchall()
+    stats = series.window_stats(sensor_id, start, end, versions)
     
     return render_template('sensors/readings.html',
                          sensor=sensor,
-                         readings=readings)
+                         readings=readings,
+                         stats=stats,
+                         days=days,
+                         window_start=start,
+                         window_end=end,
+                         paged=cursor is not None,
+                         next_cursor=next_cursor)
 
 # =====================================================
 # READING ROUTES
@@ -486,23 +617,55 @@ def readings_list():
         Location, Sensor.location_id == Location.location_id
     )
     
+    # Every reading has its sensor, type and location, so the total needs no joins
+    total = db.session.query(func.count(Reading.reading_id))
+    
     if sensor_filter:
         query = query.filter(Reading.sensor_id == sensor_filter)
+        total = total.filter(Reading.sensor_id == sensor_filter)
     
     query = query.order_by(Reading.reading_timestamp.desc())
     
     # Pagination
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    remote_ids = set()
+    if shards.remote():
+        pagination, remote_ids = _readings_with_shards(query, total, sensor_filter or None, page, per_page)
+    else:
+        pagination = listing.paginate(query, page, per_page, total.scalar())
     readings = pagination.items
     
-    sensors = Sensor.query.order_by(Sensor.model).all()
+    sensors = cache.sensors()
     
     return render_template('readings/list.html',
                          readings=readings,
+                         remote_ids=remote_ids,
+                         compacted=bool(chunkstore.index.refresh(db.session)),
                          sensors=sensors,
                          sensor_filter=sensor_filter,
                          pagination=pagination)
 
+def _readings_with_shards(query, total, sensor_id, page, per_page):
+    """A page of the readings list merged with the other shards' readings.
+
+    Every shard returns its newest rows up to the end of the page, so deep
+    pages cost more than on a single database. Returns (pagination, ids
+    of the rows from other shards); those are read-only here.
+    """
+    wanted = page * per_page
+    remote = shards.scatter(shards.recent_query(wanted, sensor_id))
+    remote_count = shards.scatter(shards.READING_COUNT if sensor_id is None else
+                                  shards.READING_COUNT.where(Reading.sensor_id == sensor_id))
+    rows = query.limit(wanted).all()
+    sensors = {sensor.sensor_id: sensor for sensor in cache.sensors()}
+    remote_rows = [(row, sensors[row.sensor_id], sensors[row.sensor_id].sensor_type,
+                    sensors[row.sensor_id].location)
+                   for row in remote.rows() if row.sensor_id in sensors]
+    rows = sorted(rows + remote_rows, key=lambda row: (row[0].reading_timestamp, row[0].reading_id),
+                  reverse=True)
+    count = total.scalar() + sum(row[0] for row in remote_count.rows())
+    pagination = listing.paginate_merged(rows, page, per_page, count)
+    return pagination, {row[0].reading_id for row in remote_rows}
+
 @app.route('/readings/create', methods=['GET', 'POST'])
 @login_required
 def reading_create():
@@ -518,13 +681,21 @@ def reading_create():
             reading_timestamp=datetime.strptime(reading_timestamp, '%Y-%m-%dT%H:%M')
         )
         
+        row = {'sensor_id': int(sensor_id), 'reading_value': reading_value,
+               'reading_timestamp': reading.reading_timestamp}
+        if ingest.is_backfill([row]):
+            cache.bump_version('Reading')
+        raised = alerts.check_readings(db.session, [row], cache.current_versions())
         db.session.add(reading)
         db.session.commit()
+        alerts.notify(raised, app.config)
         
         flash('Reading recorded successfully!', 'success')
+        for alert in raised:
+            flash(f'Alert: {alert["message"]}', 'warning')
         return redirect(url_for('readings_list'))
     
-    sensors = Sensor.query.filter_by(status='ACTIVE').order_by(Sensor.model).all()
+    sensors = cache.sensors(status='ACTIVE')
     
     return render_template('readings/form.html', sensors=sensors)
 
@@ -541,11 +712,12 @@ def reading_edit(reading_id):
             request.form.get('reading_timestamp'), '%Y-%m-%dT%H:%M'
         )
         
+        cache.bump_version('Reading')
         db.session.commit()
         flash('Reading updated successfully!', 'success')
         return redirect(url_for('readings_list'))
     
-    sensors = Sensor.query.order_by(Sensor.model).all()
+    sensors = cache.sensors()
     
     return render_template('readings/form.html',
                          reading=reading,
@@ -558,6 +730,7 @@ def reading_delete(reading_id):
     reading = Reading.query.get_or_404(reading_id)
     
     db.session.delete(reading)
+    cache.bump_version('Reading')
     db.session.commit()
     
     flash('Reading deleted successfully!', 'success')
@@ -575,7 +748,7 @@ def technicians_list():
     
     query = Technician.query
     if search:
-        query = query.filter(Technician.name.like(f'%{search}%'))
+        query = query.filter(search_index.clause('technician', search))
     
     technicians = query.order_by(Technician.name).all()
     
@@ -605,6 +778,7 @@ def technician_create():
         )
         
         db.session.add(technician)
+        cache.bump_version('Technician')
         db.session.commit()
         
         flash(f'Technician "{name}" created successfully!', 'success')
@@ -623,6 +797,7 @@ def technician_edit(tech_id):
         technician.contact_no = request.form.get('contact_no')
         technician.specialization = request.form.get('specialization')
         
+        cache.bump_version('Technician')
         db.session.commit()
         flash(f'Technician "{technician.name}" updated successfully!', 'success')
         return redirect(url_for('technicians_list'))
@@ -637,6 +812,7 @@ def technician_delete(tech_id):
     
     try:
         db.session.delete(technician)
+        cache.bump_version('Technician')
         db.session.commit()
         flash(f'Technician "{technician.name}" deleted successfully!', 'success')
     except Exception as e:
@@ -656,8 +832,10 @@ def maintenance_list():
     sensor_filter = request.args.get('sensor', '')
     tech_filter = request.args.get('tech', '')
     event_filter = request.args.get('event_type', '')
+    page = request.args.get('page', 1, type=int)
     
-    query = MaintenanceEvent.query
+    query = MaintenanceEvent.query.options(db.joinedload(MaintenanceEvent.sensor),
+                                           db.joinedload(MaintenanceEvent.technician))
     
     if sensor_filter:
         query = query.filter(MaintenanceEvent.sensor_id == sensor_filter)
@@ -668,19 +846,47 @@ def maintenance_list():
     if event_filter:
         query = query.filter(MaintenanceEvent.event_type == event_filter)
     
-    maintenance_events = query.order_by(MaintenanceEvent.event_date.desc()).all()
+    # Filter counts and the page total from one grouped query
+    facets = listing.maintenance_facets(sensor_filter, tech_filter, event_filter)
+    pagination = listing.paginate(
+        query.order_by(MaintenanceEvent.event_date.desc(), MaintenanceEvent.maintenance_id.desc()),
+        page, app.config['ITEMS_PER_PAGE'], facets.total
+    )
+    
+    sensors = cache.sensors()
+    technicians = cache.technicians()
     
-    sensors = Sensor.query.order_by(Sensor.model).all()
-    technicians = Technician.query.order_by(Technician.name).all()
+    # Rescoring is left to cron (score-maintenance --stale) and the Rescore button
+    scored_at = scoring.last_run()
     
     return render_template('maintenance/list.html',
-                         maintenance_events=maintenance_events,
+                         attention=scoring.needs_attention(app.config['MAINTENANCE_ATTENTION_LIMIT'],
+                                                           app.config['MAINTENANCE_ATTENTION_THRESHOLD']),
+                         scored_at=scored_at,
+                         scores_stale=scoring.is_stale(scored_at, app.config['MAINTENANCE_SCORE_MAX_AGE']),
+                         scoring_jobs=jobs.runner.active('maintenance-score'),
+                         maintenance_events=pagination.items,
+                         pagination=pagination,
+                         facets=facets,
+                         filter_args={k: v for k, v in request.args.items() if v and k != 'page'},
                          sensors=sensors,
                          technicians=technicians,
                          sensor_filter=sensor_filter,
                          tech_filter=tech_filter,
                          event_filter=event_filter)
 
+def _submit_scoring():
+    return jobs.runner.submit(app, 'Maintenance scoring', scoring.score_fleet, app.config,
+                              key='maintenance-score')
+
+@app.route('/maintenance/scores/refresh', methods=['POST'])
+@login_required
+def maintenance_scores_refresh():
+    """Recompute the needs-attention ranking now"""
+    _submit_scoring()
+    flash('Maintenance scores are being recomputed.', 'info')
+    return redirect(url_for('maintenance_list'))
+
 @app.route('/maintenance/create', methods=['GET', 'POST'])
 @login_required
 def maintenance_create():
@@ -701,13 +907,15 @@ def maintenance_create():
         )
         
         db.session.add(maintenance)
+        # after_maintenance_insert may move the sensor into MAINTENANCE
+        cache.bump_version('MaintenanceEvent', 'Sensor')
         db.session.commit()
         
         flash('Maintenance event created successfully!', 'success')
         return redirect(url_for('maintenance_list'))
     
-    sensors = Sensor.query.order_by(Sensor.model).all()
-    technicians = Technician.query.order_by(Technician.name).all()
+    sensors = cache.sensors()
+    technicians = cache.technicians()
     
     return render_template('maintenance/form.html',
                          sensors=sensors,
@@ -728,12 +936,13 @@ def maintenance_edit(maintenance_id):
         )
         maintenance.notes = request.form.get('notes')
         
+        cache.bump_version('MaintenanceEvent')
         db.session.commit()
         flash('Maintenance event updated successfully!', 'success')
         return redirect(url_for('maintenance_list'))
     
-    sensors = Sensor.query.order_by(Sensor.model).all()
-    technicians = Technician.query.order_by(Technician.name).all()
+    sensors = cache.sensors()
+    technicians = cache.technicians()
     
     return render_template('maintenance/form.html',
                          maintenance=maintenance,
@@ -747,11 +956,140 @@ def maintenance_delete(maintenance_id):
     maintenance = MaintenanceEvent.query.get_or_404(maintenance_id)
     
     db.session.delete(maintenance)
+    cache.bump_version('MaintenanceEvent')
     db.session.commit()
     
     flash('Maintenance event deleted successfully!', 'success')
     return redirect(url_for('maintenance_list'))
 
+# =====================================================
+# ALERT ROUTES
+# =====================================================
+
+@app.route('/alerts')
+@login_required
+def alerts_list():
+    """Open (or all recent) alerts and the rules that raise them"""
+    show = request.args.get('show', 'open')
+    
+    query = db.session.query(Alert, Sensor, AlertRule).join(
+        Sensor, Alert.sensor_id == Sensor.sensor_id
+    ).join(
+        AlertRule, Alert.rule_id == AlertRule.rule_id
+    )
+    if show == 'open':
+        query = query.filter(Alert.acknowledged_at.is_(None))
+    alert_rows = query.order_by(Alert.triggered_at.desc()).limit(200).all()
+    
+    rules = AlertRule.query.order_by(AlertRule.name).all()
+    
+    return render_template('alerts/list.html',
+                         alerts=alert_rows,
+                         rules=rules,
+                         show=show)
+
+@app.route('/alerts/<int:alert_id>/acknowledge', methods=['POST'])
+@login_required
+def alert_acknowledge(alert_id):
+    """Acknowledge an alert; the next trigger opens a new one"""
+    alert = Alert.query.get_or_404(alert_id)
+    alert.acknowledged_at = datetime.utcnow()
+    alert.acknowledged_by = current_user.user_id
+    db.session.commit()
+    flash('Alert acknowledged.', 'success')
+    return redirect(url_for('alerts_list', show=request.args.get('show', 'open')))
+
+def _decimal_field(name):
+    value = request.form.get(name, '').strip()
+    return value or None
+
+def _apply_rule_form(rule):
+    rule.name = request.form.get('name')
+    rule.rule_kind = request.form.get('rule_kind')
+    rule.type_id = request.form.get('type_id') or None
+    rule.location_id = request.form.get('location_id') or None
+    rule.min_value = _decimal_field('min_value')
+    rule.max_value = _decimal_field('max_value')
+    rule.max_rate_per_hour = _decimal_field('max_rate_per_hour')
+    rule.no_data_minutes = request.form.get('no_data_minutes', type=int)
+    rule.severity = request.form.get('severity', 'WARNING')
+    rule.cooldown_minutes = request.form.get('cooldown_minutes', 30, type=int)
+    rule.is_active = bool(request.form.get('is_active'))
+
+    if not rule.name:
+        return 'Rule name is required.'
+    if rule.rule_kind == 'THRESHOLD' and rule.min_value is None and rule.max_value is None:
+        return 'A threshold rule needs a minimum or maximum value.'
+    if rule.rule_kind == 'RATE' and not rule.max_rate_per_hour:
+        return 'A rate rule needs a maximum change per hour.'
+    if rule.rule_kind == 'NO_DATA' and not rule.no_data_minutes:
+        return 'A no-data rule needs a number of minutes.'
+    return None
+
+@app.route('/alerts/rules/create', methods=['GET', 'POST'])
+@login_required
+def alert_rule_create():
+    """Create a new alert rule"""
+    if request.method == 'POST':
+        rule = AlertRule()
+        error = _apply_rule_form(rule)
+        if error:
+            flash(error, 'danger')
+            return render_template('alerts/rule_form.html',
+                                 sensor_types=cache.sensor_types(),
+                                 locations=cache.locations())
+        
+        db.session.add(rule)
+        cache.bump_version('AlertRule')
+        db.session.commit()
+        
+        flash(f'Alert rule "{rule.name}" created successfully!', 'success')
+        return redirect(url_for('alerts_list'))
+    
+    return render_template('alerts/rule_form.html',
+                         sensor_types=cache.sensor_types(),
+                         locations=cache.locations())
+
+@app.route('/alerts/rules/<int:rule_id>/edit', methods=['GET', 'POST'])
+@login_required
+def alert_rule_edit(rule_id):
+    """Edit an alert rule"""
+    rule = AlertRule.query.get_or_404(rule_id)
+    
+    if request.method == 'POST':
+        error = _apply_rule_form(rule)
+        if error:
+            db.session.rollback()
+            flash(error, 'danger')
+            return redirect(url_for('alert_rule_edit', rule_id=rule_id))
+        
+        cache.bump_version('AlertRule')
+        db.session.commit()
+        flash(f'Alert rule "{rule.name}" updated successfully!', 'success')
+        return redirect(url_for('alerts_list'))
+    
+    return render_template('alerts/rule_form.html',
+                         rule=rule,
+                         sensor_types=cache.sensor_types(),
+                         locations=cache.locations())
+
+@app.route('/alerts/rules/<int:rule_id>/delete', methods=['POST'])
+@login_required
+def alert_rule_delete(rule_id):
+    """Delete an alert rule and its alerts"""
+    rule = AlertRule.query.get_or_404(rule_id)
+    
+    try:
+        db.session.delete(rule)
+        cache.bump_version('AlertRule')
+        db.session.commit()
+        flash(f'Alert rule "{rule.name}" deleted successfully!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error deleting alert rule: {str(e)}', 'danger')
+    
+    return redirect(url_for('alerts_list'))
+
 # =====================================================
 # REPORTS & ANALYTICS ROUTES
 # =====================================================
@@ -759,84 +1097,371 @@ def maintenance_delete(maintenance_id):
 @app.route('/reports')
 @login_required
 def reports():
-    """Reports and analytics page"""
-    # Average readings by area
-    area_stats = db.session.query(
-        Location.area_name,
-        SensorType.name.label('sensor_type'),
-        func.avg(Reading.reading_value).label('avg_value'),
-        func.count(Reading.reading_id).label('reading_count')
-    ).join(
-        Sensor, Location.location_id == Sensor.location_id
-    ).join(
-        SensorType, Sensor.type_id == SensorType.type_id
-    ).join(
-        Reading, Sensor.sensor_id == Reading.sensor_id
-    ).group_by(
-        Location.area_name, SensorType.name
-    ).all()
-    
-    # Top technicians by maintenance count
-    result = db.session.execute(text('CALL GetTopTechnicians(10)'))
-    top_technicians = result.fetchall()
-    
-    # Maintenance summary
-    result2 = db.session.execute(text('CALL GetMaintenanceSummary()'))
-    maintenance_summary = result2.fetchall()
-    
-    # Sensor status distribution
-    status_dist = db.session.query(
-        Sensor.status,
-        func.count(Sensor.sensor_id).label('count')
-    ).group_by(Sensor.status).all()
-    
-    # Recent status changes
-    status_logs = db.session.query(
-        SensorStatusLog, Sensor
-    ).join(
-        Sensor, SensorStatusLog.sensor_id == Sensor.sensor_id
-    ).order_by(
-        SensorStatusLog.change_timestamp.desc()
-    ).limit(20).all()
+    """Reports and analytics page, served from per-section snapshots"""
+    latest = snapshots.latest()
+    
+    # Out-of-date sections are shown as they are while a job recomputes them,
+    # sections never snapshotted yet as placeholders
+    stale = snapshots.stale(latest, app.config)
+    if stale:
+        _submit_snapshots(stale)
+    
+    comparing, comparison = None, None
+    compare_id = request.args.get('compare', type=int)
+    if compare_id:
+        comparing = ReportSnapshot.query.filter(
+            ReportSnapshot.snapshot_id == compare_id, ReportSnapshot.section.in_(snapshots.COMPARABLE)
+        ).first_or_404()
+        comparison = snapshots.compare(comparing, latest[comparing.section])
     
     return render_template('reports/index.html',
-                         area_stats=area_stats,
-                         top_technicians=top_technicians,
-                         maintenance_summary=maintenance_summary,
-                         status_dist=status_dist,
-                         status_logs=status_logs)
+                         fragments={section: snapshots.fragments.render(latest[section]) if section in latest
+                                    else snapshots.fragments.pending(section)
+                                    for section in snapshots.SECTIONS},
+                         sections=snapshots.SECTIONS,
+                         snapshots=latest,
+                         stale=stale,
+                         snapshot_jobs=jobs.runner.active('report-snapshots'),
+                         history=snapshots.history(app.config['REPORT_HISTORY_LIMIT']),
+                         comparing=comparing,
+                         comparison=comparison)
+
+def _submit_snapshots(sections):
+    return jobs.runner.submit(app, 'Report snapshots', snapshots.refresh, list(sections), app.config,
+                              key=f'report-snapshots:{",".join(sections)}')
+
+@app.route('/reports/refresh', methods=['POST'])
+@login_required
+def reports_refresh():
+    """Recompute every report section now"""
+    _submit_snapshots(list(snapshots.SECTIONS))
+    flash('Reports are being recomputed.', 'info')
+    return redirect(url_for('reports'))
 
 # =====================================================
 # API ROUTES (Optional - for AJAX)
 # =====================================================
 
+def _latest_reading_key(sensor_id):
+    """Per-sensor validator: changes whenever the sensor gets a newer reading"""
+    row = db.session.execute(series.latest_key_query(sensor_id)).first()
+    return (row.reading_id, row.reading_timestamp) if row else (None, None)
+
+def _max_reading_key():
+    """Global validator for reading inserts (MAX on the primary key is a single seek).
+
+    Inserts don't bump the Reading version and carry no write time, so
+    routes using this key are served with ``dated=False``.
+    """
+    return db.session.query(func.max(Reading.reading_id)).scalar(), None
+
+@app.route('/api/sensors')
+@login_required
+@cache.conditional('Sensor', 'SensorType', 'Location')
+def api_sensors():
+    """Sensors matching ids/filters, limited to the requested fields; filtered lists are paginated"""
+    try:
+        fields = fieldsets.parse_fields(request.args.get('fields'))
+        ids = fieldsets.parse_ids(request.args.get('ids'))
+        page, per_page = fieldsets.parse_page(request.args, app.config, fields)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filters = dict(
+        status=request.args.get('status'),
+        type_id=request.args.get('type_id', type=int),
+        location_id=request.args.get('location_id', type=int),
+        search=request.args.get('search')
+    )
+    if ids is not None:
+        # An explicit id list is its own bound
+        query = fieldsets.sensor_query(fields, ids, **filters)
+        sensors = fieldsets.to_dicts(fields, db.session.execute(query).all())
+        return fastjson.response({'count': len(sensors), 'sensors': sensors})
+    
+    query = fieldsets.sensor_query(fields, page=page, per_page=per_page, **filters)
+    sensors = fieldsets.to_dicts(fields, db.session.execute(query).all())
+    total = db.session.execute(fieldsets.sensor_count_query(**filters)).scalar()
+    return fastjson.response({'count': len(sensors), **fieldsets.page_info(page, per_page, total),
+                              'sensors': sensors})
+
 @app.route('/api/sensors/<int:sensor_id>')
 @login_required
+@cache.conditional('Sensor', 'SensorType', 'Location')
 def api_sensor(sensor_id):
     """Get sensor details as JSON"""
-    sensor = Sensor.query.get_or_404(sensor_id)
-    return jsonify(sensor.to_dict())
+    try:
+        fields = fieldsets.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows = db.session.execute(fieldsets.sensor_query(fields, [sensor_id])).all()
+    if not rows:
+        return jsonify({'error': 'Sensor not found'}), 404
+    return fastjson.response(fieldsets.to_dicts(fields, rows)[0])
+
+@app.route('/api/search')
+@login_required
+@cache.conditional('Sensor', 'SensorType', 'Location', 'Technician')
+def api_search():
+    """Ranked autocomplete over sensors, locations, technicians and sensor types"""
+    query = request.args.get('q', '').strip()
+    try:
+        kinds = search_index.parse_kinds(request.args.get('types'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(max(request.args.get('limit', app.config['SEARCH_RESULT_LIMIT'], type=int), 1),
+                app.config['SEARCH_MAX_RESULTS'])
+    
+    results = [search_index.to_dict(result) for result in search_index.suggest(query, kinds, limit)]
+    return fastjson.response({'query': query, 'count': len(results), 'results': results})
 
 @app.route('/api/sensors/<int:sensor_id>/latest-reading')
 @login_required
+@cache.conditional('Reading', 'Sensor', key=_latest_reading_key)
 def api_latest_reading(sensor_id):
     """Get latest reading for a sensor"""
-    reading = Reading.query.filter_by(
-        sensor_id=sensor_id
-    ).order_by(
-        Reading.reading_timestamp.desc()
-    ).first()
+    reading = SensorLatest.query.get(sensor_id)
     
     if reading:
         return jsonify(reading.to_dict())
     return jsonify({'error': 'No readings found'}), 404
 
+@app.route('/api/sensors/<int:sensor_id>/readings')
+@login_required
+@cache.conditional('Reading', key=_latest_reading_key)
+def api_sensor_series(sensor_id):
+    """Windowed, cursor-paginated reading series for a sensor"""
+    Sensor.query.get_or_404(sensor_id)
+    try:
+        days, start, end, cursor, limit = _series_request(sensor_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid days, end, before or limit parameter'}), 400
+    
+    versions = cache.current_versions()
+    rows, next_cursor = series.readings_page(sensor_id, start, end, cursor, limit, versions)
+    stats = series.window_stats(sensor_id, start, end, versions) if cursor is None else None
+    return jsonify(series.payload(sensor_id, start, end, rows, next_cursor, stats))
+
+@app.route('/api/readings', methods=['POST'])
+@login_required
+def api_ingest_readings():
+    """Ingest one reading or a batch of readings posted as JSON"""
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'error': 'Request body must be JSON'}), 400
+    
+    known_sensor_ids = {s.sensor_id for s in cache.sensors()}
+    try:
+        rows = ingest.parse_readings(payload, known_sensor_ids)
+        backfill = ingest.is_backfill(rows)
+        raised = alerts.check_readings(db.session, rows, cache.current_versions())
+        inserted = ingest.insert_readings(rows)
+        if backfill:
+            cache.bump_version('Reading')
+        db.session.commit()
+    except ingest.IngestError as e:
+        return jsonify({'error': 'Invalid readings', 'details': e.errors}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error storing readings: {str(e)}'}), 500
+    
+    metrics.inc('ingest_readings_total', inserted)
+    alerts.notify(raised, app.config)
+    return jsonify({'inserted': inserted, 'alerts': len(raised)}), 201
+
+@app.route('/api/edge/batches', methods=['POST'])
+@login_required
+def api_edge_batch():
+    """Store a batch of readings shipped by an edge node; retries are applied once"""
+    try:
+        payload = edge.read_request(request, app.config['EDGE_MAX_BATCH_BYTES'])
+        known_sensor_ids = {s.sensor_id for s in cache.sensors()}
+        result = edge.apply_batch(payload, known_sensor_ids, cache.current_versions())
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except ingest.IngestError as e:
+        db.session.rollback()
+        return jsonify({'error': 'Invalid readings', 'details': e.errors}), 400
+    except edge.WatermarkMismatch as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'watermark': e.watermark}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error storing batch: {str(e)}'}), 500
+    
+    metrics.inc('ingest_readings_total', result['accepted'])
+    alerts.notify(result.pop('alerts'), app.config)
+    return jsonify(result)
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job(job_id):
+    """Progress of a background job"""
+    job = jobs.runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/maintenance')
+@login_required
+@cache.conditional('MaintenanceEvent', 'Sensor', 'Technician')
+def api_maintenance():
+    """Maintenance events matching the filters, newest first, one page at a time"""
+    try:
+        page, per_page = fieldsets.parse_page(request.args, app.config)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sensor_id = request.args.get('sensor_id', type=int)
+    tech_id = request.args.get('tech_id', type=int)
+    event_type = request.args.get('event_type')
+    
+    query = MaintenanceEvent.query.options(db.joinedload(MaintenanceEvent.sensor),
+                                           db.joinedload(MaintenanceEvent.technician))
+    if sensor_id:
+        query = query.filter(MaintenanceEvent.sensor_id == sensor_id)
+    if tech_id:
+        query = query.filter(MaintenanceEvent.tech_id == tech_id)
+    if event_type:
+        query = query.filter(MaintenanceEvent.event_type == event_type)
+    
+    total = listing.maintenance_facets(sensor_id, tech_id, event_type).total
+    events = query.order_by(MaintenanceEvent.event_date.desc(), MaintenanceEvent.maintenance_id.desc()).limit(
+        per_page).offset((page - 1) * per_page).all()
+    return fastjson.response({'count': len(events), **fieldsets.page_info(page, per_page, total),
+                              'events': [event.to_dict() for event in events]})
+
+@app.route('/api/maintenance/scores')
+@login_required
+def api_maintenance_scores():
+    """Sensors ranked by predictive maintenance score"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 1000))
+    threshold = request.args.get('min_score', 0.0, type=float)
+    ranked = scoring.needs_attention(limit, threshold)
+    return jsonify({
+        'computed_at': scoring.last_run().isoformat() if ranked else None,
+        'scores': [dict(score.to_dict(), model=sensor.model) for score, sensor in ranked]
+    })
+
+@app.route('/api/availability')
+@login_required
+def api_availability():
+    """Uptime, MTBF and maintenance time per sensor, type or location"""
+    group_by = request.args.get('group', 'sensor')
+    if group_by not in ('sensor', 'type', 'location'):
+        return jsonify({'error': 'group must be sensor, type or location'}), 400
+    try:
+        start, end = heatmap.parse_window(request.args, app.config['AVAILABILITY_REPORT_DAYS'] * 24)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid time window: {str(e)}'}), 400
+    
+    groups, fleet = availability.index.report(start, end, group_by)
+    return jsonify({
+        'window': {'start': start.isoformat(), 'end': end.isoformat()},
+        'group': group_by,
+        'fleet': fleet,
+        'groups': groups
+    })
+
+@app.route('/api/availability/status-at')
+@login_required
+def api_status_at():
+    """Status of every sensor at a point in time"""
+    try:
+        at = datetime.strptime(request.args['at'], '%Y-%m-%dT%H:%M')
+    except (KeyError, ValueError):
+        return jsonify({'error': 'at is required as YYYY-MM-DDTHH:MM'}), 400
+    
+    statuses = availability.index.status_at(at)
+    counts = dict.fromkeys(availability.STATUSES, 0)
+    for status in statuses.values():
+        counts[status] += 1
+    return jsonify({'at': at.isoformat(), 'counts': counts, 'sensors': statuses})
+
+@app.route('/api/heatmap')
+@login_required
+def api_heatmap():
+    """Interpolated raster of a sensor type over the grid"""
+    type_id = request.args.get('type_id', type=int)
+    if type_id is None or SensorType.query.get(type_id) is None:
+        return jsonify({'error': 'A valid type_id is required'}), 400
+    
+    resolution = request.args.get('resolution', app.config['HEATMAP_DEFAULT_RESOLUTION'], type=int)
+    if not 2 <= resolution <= app.config['HEATMAP_MAX_RESOLUTION']:
+        return jsonify({'error': f"resolution must be between 2 and {app.config['HEATMAP_MAX_RESOLUTION']}"}), 400
+    
+    method = request.args.get('method', 'idw')
+    aggregate = request.args.get('aggregate', 'avg')
+    power = request.args.get('power', 2.0, type=float)
+    if method not in ('idw', 'kriging') or aggregate not in ('avg', 'latest'):
+        return jsonify({'error': 'method must be idw or kriging, aggregate must be avg or latest'}), 400
+    # Also rejects nan and inf, which would overflow or poison the raster
+    if not 0 < power <= app.config['HEATMAP_MAX_POWER']:
+        return jsonify({'error': f"power must be greater than 0 and at most {app.config['HEATMAP_MAX_POWER']}"}), 400
+    
+    try:
+        start, end = heatmap.parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid time window: {str(e)}'}), 400
+    
+    # Relative windows are keyed by their length so repeated polls share a raster
+    window_key = (request.args.get('start'), request.args.get('end'),
+                  request.args.get('hours', 24, type=int))
+    key = (type_id, window_key, resolution, method, aggregate, power)
+    payload = heatmap.cached_raster(
+        key,
+        app.config['HEATMAP_CACHE_TTL'],
+        lambda: heatmap.build_raster(type_id, start, end, resolution, method, aggregate, power,
+                                     app.config['HEATMAP_MAX_POINTS'], app.config['HEATMAP_KRIGING_MAX_POINTS'],
+                                     app.config['HEATMAP_IDW_NEIGHBOURS'])
+    )
+    return jsonify(payload)
+
 # =====================================================
 # CSV EXPORT ROUTES
 # =====================================================
 
+def _fmt_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+def csv_response(filename, header, rows):
+    """Stream ``rows`` as a CSV attachment, a batch of rows per chunk.
+
+    The query behind ``rows`` runs while the body is sent, so memory stays
+    bounded by one batch and compression starts on the first chunk.
+    """
+    batch = app.config['EXPORT_STREAM_BATCH']
+    # The view's session was torn down with its context; iterating ``rows``
+    # reopens it, so it is closed again once the body is sent
+    session = db.session()
+    
+    def generate():
+        try:
+            si = StringIO()
+            writer = csv.writer(si)
+            writer.writerow(header)
+            for i, row in enumerate(rows, 1):
+                writer.writerow(row)
+                if i % batch == 0:
+                    yield si.getvalue()
+                    si.seek(0)
+                    si.truncate(0)
+            yield si.getvalue()
+        finally:
+            session.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @app.route('/export/sensors/csv')
 @login_required
+@cache.conditional('Sensor', 'SensorType', 'Location')
+@compress.artifact
 def export_sensors_csv():
     """Export all sensors to CSV"""
     # Get all sensors with related data
@@ -846,154 +1471,117 @@ def export_sensors_csv():
         SensorType, Sensor.type_id == SensorType.type_id
     ).join(
         Location, Sensor.location_id == Location.location_id
-    ).all()
-    
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write header
-    writer.writerow(['ID', 'Model', 'Type', 'Location', 'Latitude', 'Longitude', 
-                     'Install Date', 'Status', 'Created At'])
-    
-    # Write data
-    for sensor, sensor_type, location in sensors:
-        writer.writerow([
-            sensor.sensor_id,
-            sensor.model,
-            sensor_type.name,
-            location.area_name,
-            float(location.latitude),
-            float(location.longitude),
-            sensor.install_date.strftime('%Y-%m-%d'),
-            sensor.status,
-            sensor.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        ])
-    
-    # Create response
-    output = si.getvalue()
-    si.close()
-    
-    return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=sensors_export.csv'}
-    )
+    ).yield_per(app.config['EXPORT_STREAM_BATCH'])
+    
+    rows = ([
+        sensor.sensor_id,
+        sensor.model,
+        sensor_type.name,
+        location.area_name,
+        float(location.latitude),
+        float(location.longitude),
+        sensor.install_date.strftime('%Y-%m-%d'),
+        sensor.status,
+        _fmt_datetime(sensor.created_at)
+    ] for sensor, sensor_type, location in sensors)
+    
+    return csv_response('sensors_export.csv',
+                        ['ID', 'Model', 'Type', 'Location', 'Latitude', 'Longitude',
+                         'Install Date', 'Status', 'Created At'], rows)
 
 @app.route('/export/readings/csv')
 @login_required
+@cache.conditional('Reading', 'Sensor', 'SensorType', 'Location', key=_max_reading_key, dated=False)
+@compress.artifact
 def export_readings_csv():
     """Export all readings to CSV"""
-    # Get all readings with related data
+    # Column projection: readings are the bulk of the export
     readings = db.session.query(
-        Reading, Sensor, SensorType, Location
+        Reading.reading_id, Sensor.sensor_id, Sensor.model, SensorType.name,
+        Location.area_name, Reading.reading_value, Reading.reading_timestamp
     ).join(
         Sensor, Reading.sensor_id == Sensor.sensor_id
     ).join(
         SensorType, Sensor.type_id == SensorType.type_id
     ).join(
         Location, Sensor.location_id == Location.location_id
-    ).order_by(Reading.reading_timestamp.desc()).limit(10000).all()
-    
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write header
-    writer.writerow(['Reading ID', 'Sensor ID', 'Sensor Model', 'Sensor Type', 
-                     'Location', 'Reading Value', 'Timestamp'])
-    
-    # Write data
-    for reading, sensor, sensor_type, location in readings:
-        writer.writerow([
-            reading.reading_id,
-            sensor.sensor_id,
-            sensor.model,
-            sensor_type.name,
-            location.area_name,
-            float(reading.reading_value),
-            reading.reading_timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        ])
-    
-    # Create response
-    output = si.getvalue()
-    si.close()
-    
-    return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=readings_export.csv'}
+    ).order_by(Reading.reading_timestamp.desc()).limit(10000).yield_per(
+        app.config['EXPORT_STREAM_BATCH']
     )
+    
+    rows = ([
+        reading_id, sensor_id, model, type_name, area_name,
+        float(value), _fmt_datetime(timestamp)
+    ] for reading_id, sensor_id, model, type_name, area_name, value, timestamp in readings)
+    
+    # Readings compacted into chunks or stored on other shards continue the same newest-first order
+    others = []
+    if chunkstore.index.refresh(db.session):
+        others.append(chunkstore.export_rows(db.session, app.config['EXPORT_STREAM_BATCH']))
+    if shards.remote():
+        others.append(shards.export_rows(10000, app.config['EXPORT_STREAM_BATCH']))
+    if others:
+        names = {sensor_id: (model, type_name, area_name) for sensor_id, model, type_name, area_name in
+                 db.session.query(Sensor.sensor_id, Sensor.model, SensorType.name, Location.area_name).join(
+                     SensorType, Sensor.type_id == SensorType.type_id
+                 ).join(
+                     Location, Sensor.location_id == Location.location_id
+                 )}
+        merged = ([
+            reading_id, sensor_id, *names[sensor_id], float(value), _fmt_datetime(timestamp)
+        ] for reading_id, sensor_id, value, timestamp in heapq.merge(
+            *others, key=lambda row: (row[3], row[0]), reverse=True
+        ) if sensor_id in names)
+        rows = islice(heapq.merge(rows, merged, key=lambda row: (row[6], row[0]), reverse=True), 10000)
+    
+    return csv_response('readings_export.csv',
+                        ['Reading ID', 'Sensor ID', 'Sensor Model', 'Sensor Type',
+                         'Location', 'Reading Value', 'Timestamp'], rows)
 
 @app.route('/export/locations/csv')
 @login_required
+@cache.conditional('Location')
+@compress.artifact
 def export_locations_csv():
     """Export all locations to CSV"""
-    locations = Location.query.all()
-    
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write header
-    writer.writerow(['ID', 'Area Name', 'Latitude', 'Longitude', 'Elevation (m)', 'Created At'])
-    
-    # Write data
-    for location in locations:
-        writer.writerow([
-            location.location_id,
-            location.area_name,
-            float(location.latitude),
-            float(location.longitude),
-            float(location.elevation) if location.elevation else 0.0,
-            location.created_at.strftime('%Y-%m-%d %H:%M:%S') if location.created_at else ''
-        ])
-    
-    # Create response
-    output = si.getvalue()
-    si.close()
-    
-    return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=locations_export.csv'}
-    )
+    locations = Location.query.yield_per(app.config['EXPORT_STREAM_BATCH'])
+    
+    rows = ([
+        location.location_id,
+        location.area_name,
+        float(location.latitude),
+        float(location.longitude),
+        float(location.elevation) if location.elevation else 0.0,
+        _fmt_datetime(location.created_at)
+    ] for location in locations)
+    
+    return csv_response('locations_export.csv',
+                        ['ID', 'Area Name', 'Latitude', 'Longitude', 'Elevation (m)', 'Created At'],
+                        rows)
 
 @app.route('/export/technicians/csv')
 @login_required
+@cache.conditional('Technician')
+@compress.artifact
 def export_technicians_csv():
     """Export all technicians to CSV"""
-    technicians = Technician.query.all()
-    
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write header
-    writer.writerow(['ID', 'Name', 'Contact Number', 'Specialization', 'Created At'])
-    
-    # Write data
-    for tech in technicians:
-        writer.writerow([
-            tech.tech_id,
-            tech.name,
-            tech.contact_no or '',
-            tech.specialization or '',
-            tech.created_at.strftime('%Y-%m-%d %H:%M:%S') if tech.created_at else ''
-        ])
-    
-    # Create response
-    output = si.getvalue()
-    si.close()
-    
-    return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=technicians_export.csv'}
-    )
+    technicians = Technician.query.yield_per(app.config['EXPORT_STREAM_BATCH'])
+    
+    rows = ([
+        tech.tech_id,
+        tech.name,
+        tech.contact_no or '',
+        tech.specialization or '',
+        _fmt_datetime(tech.created_at)
+    ] for tech in technicians)
+    
+    return csv_response('technicians_export.csv',
+                        ['ID', 'Name', 'Contact Number', 'Specialization', 'Created At'], rows)
 
 @app.route('/export/maintenance/csv')
 @login_required
+@cache.conditional('MaintenanceEvent', 'Sensor', 'Technician')
+@compress.artifact
 def export_maintenance_csv():
     """Export all maintenance events to CSV"""
     maintenance_events = db.session.query(
@@ -1002,69 +1590,39 @@ def export_maintenance_csv():
         Sensor, MaintenanceEvent.sensor_id == Sensor.sensor_id
     ).join(
         Technician, MaintenanceEvent.tech_id == Technician.tech_id
-    ).order_by(MaintenanceEvent.event_date.desc()).all()
-    
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write header
-    writer.writerow(['ID', 'Sensor Model', 'Technician', 'Event Type', 
-                     'Event Date', 'Notes', 'Created At'])
-    
-    # Write data
-    for event, sensor, tech in maintenance_events:
-        writer.writerow([
-            event.maintenance_id,
-            sensor.model,
-            tech.name,
-            event.event_type,
-            event.event_date.strftime('%Y-%m-%d %H:%M:%S'),
-            event.notes or '',
-            event.created_at.strftime('%Y-%m-%d %H:%M:%S') if event.created_at else ''
-        ])
-    
-    # Create response
-    output = si.getvalue()
-    si.close()
-    
-    return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=maintenance_export.csv'}
-    )
+    ).order_by(MaintenanceEvent.event_date.desc()).yield_per(app.config['EXPORT_STREAM_BATCH'])
+    
+    rows = ([
+        event.maintenance_id,
+        sensor.model,
+        tech.name,
+        event.event_type,
+        _fmt_datetime(event.event_date),
+        event.notes or '',
+        _fmt_datetime(event.created_at)
+    ] for event, sensor, tech in maintenance_events)
+    
+    return csv_response('maintenance_export.csv',
+                        ['ID', 'Sensor Model', 'Technician', 'Event Type',
+                         'Event Date', 'Notes', 'Created At'], rows)
 
 @app.route('/export/sensor-types/csv')
 @login_required
+@cache.conditional('SensorType')
+@compress.artifact
 def export_sensor_types_csv():
     """Export all sensor types to CSV"""
-    sensor_types = SensorType.query.all()
-    
-    # Create CSV
-    si = StringIO()
-    writer = csv.writer(si)
+    sensor_types = SensorType.query.yield_per(app.config['EXPORT_STREAM_BATCH'])
     
-    # Write header
-    writer.writerow(['ID', 'Name', 'Description', 'Created At'])
+    rows = ([
+        st.type_id,
+        st.name,
+        st.description or '',
+        _fmt_datetime(st.created_at)
+    ] for st in sensor_types)
     
-    # Write data
-    for st in sensor_types:
-        writer.writerow([
-            st.type_id,
-            st.name,
-            st.description or '',
-            st.created_at.strftime('%Y-%m-%d %H:%M:%S') if st.created_at else ''
-        ])
-    
-    # Create response
-    output = si.getvalue()
-    si.close()
-    
-    return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=sensor_types_export.csv'}
-    )
+    return csv_response('sensor_types_export.csv',
+                        ['ID', 'Name', 'Description', 'Created At'], rows)
 
 # =====================================================
 # TEMPLATE FILTERS
@@ -1103,6 +1661,144 @@ def format_date(value):
         return ''
     return value.strftime('%Y-%m-%d')
 
+# =====================================================
+# CLI COMMANDS
+# =====================================================
+
+@app.cli.command('create-api-token')
+@click.argument('username')
+@click.argument('name')
+def create_api_token(username, name):
+    """Issue an API token for USERNAME labelled NAME"""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named "{username}"')
+    token = auth.create_token(user, name)
+    click.echo(f'Token for {username} ({name}): {token}')
+    click.echo('Store it now; only its hash is kept.')
+
+@app.cli.command('revoke-api-token')
+@click.argument('token_id', type=int)
+def revoke_api_token(token_id):
+    """Deactivate the API token with TOKEN_ID"""
+    api_token = ApiToken.query.get(token_id)
+    if api_token is None:
+        raise click.ClickException(f'No token with id {token_id}')
+    api_token.is_active = False
+    db.session.commit()
+    auth.token_table.invalidate()
+    click.echo(f'Revoked token "{api_token.name}".')
+
+@app.cli.command('rebuild-sensor-latest')
+@click.option('--check', is_flag=True, help='Only report sensors whose row is stale.')
+def rebuild_sensor_latest(check):
+    """Verify and repair the SensorLatest table"""
+    changed = latest.rebuild(check_only=check)
+    verb = 'Stale' if check else 'Repaired'
+    click.echo(f'{verb}: {len(changed)} sensor(s)' + (f' {changed}' if changed else ''))
+
+@app.cli.command('score-maintenance')
+@click.option('--stale', is_flag=True, help='Only rescore when the ranking is older than MAINTENANCE_SCORE_MAX_AGE.')
+def score_maintenance(stale):
+    """Recompute predictive maintenance scores for every sensor (run from cron)"""
+    if stale and not scoring.is_stale(scoring.last_run(), app.config['MAINTENANCE_SCORE_MAX_AGE']):
+        click.echo('Scores are up to date')
+        return
+    job = jobs.Job('Maintenance scoring')
+    scoring.score_fleet(job, app.config)
+    click.echo(job.message)
+    for score, sensor in scoring.needs_attention(app.config['MAINTENANCE_ATTENTION_LIMIT'],
+                                                 app.config['MAINTENANCE_ATTENTION_THRESHOLD']):
+        click.echo(f'{score.rank:>4}  {score.score:.2f}  {sensor.model}  {score.reasons or ""}')
+
+@app.cli.command('snapshot-reports')
+@click.option('--section', 'sections', multiple=True, type=click.Choice(list(snapshots.SECTIONS)),
+              help='Section to recompute (repeatable; default: every section).')
+@click.option('--stale', is_flag=True, help='Only recompute sections whose snapshot is out of date.')
+def snapshot_reports(sections, stale):
+    """Recompute report snapshots (run from cron)"""
+    sections = list(sections or snapshots.SECTIONS)
+    if stale:
+        outdated = snapshots.stale(snapshots.latest(), app.config)
+        sections = [section for section in sections if section in outdated]
+    job = jobs.Job('Report snapshots')
+    result = snapshots.refresh(job, sections, app.config)
+    click.echo(job.message + (f', pruned {result["pruned"]} old snapshot(s)' if result['pruned'] else ''))
+
+@app.cli.command('check-alerts')
+def check_alerts():
+    """Raise no-data alerts for sensors that have stopped reporting (run from cron)"""
+    raised = alerts.check_no_data(db.session, cache.current_versions())
+    db.session.commit()
+    alerts.notify(raised, app.config)
+    click.echo(f'Raised {len(raised)} alert(s)')
+    for alert in raised:
+        click.echo(f'  [{alert["severity"]}] sensor {alert["sensor_id"]}: {alert["message"]}')
+
+@app.cli.command('compact-readings')
+@click.option('--days', type=int, default=None, help='Compact readings older than this many days.')
+def compact_readings(days):
+    """Move old readings into compressed per-sensor chunks"""
+    days = days if days is not None else app.config['CHUNK_COMPACT_AFTER_DAYS']
+    job = jobs.Job('Reading compaction')
+    result = chunkstore.compact(job, db.session, datetime.utcnow() - timedelta(days=days),
+                                app.config['CHUNK_HOURS'])
+    click.echo(f'Compacted {result["readings"]} readings into {result["chunks"]} chunks')
+    summary = chunkstore.storage_summary(db.session)
+    if summary['readings']:
+        click.echo(f'Chunk storage: {summary["readings"]} readings in {summary["chunks"]} chunks, '
+                   f'{summary["bytes"] / summary["readings"]:.2f} bytes per reading')
+
+@app.cli.command('create-shard-tables')
+def create_shard_tables():
+    """Create the Reading table on every shard other than the primary database"""
+    if not shards.remote():
+        raise click.ClickException('No shards besides the primary database in READING_SHARD_URLS')
+    for key in shards.create_tables():
+        click.echo(f'Reading table ready on {key}')
+
+@app.cli.command('list-shards')
+def list_shards():
+    """Show locations and readings per reading shard"""
+    if not shards.enabled():
+        raise click.ClickException('Sharding is off; set READING_SHARD_URLS')
+    for key, locations, readings in shards.summary():
+        click.echo(f'{key:<12}{locations:>8} locations{readings:>14} readings')
+
+@app.cli.command('assign-location-shard')
+@click.argument('location_id', type=int)
+@click.argument('shard')
+def assign_location_shard(location_id, shard):
+    """Store future readings of LOCATION_ID on SHARD (existing readings stay put)"""
+    if db.session.get(Location, location_id) is None:
+        raise click.ClickException(f'No location with id {location_id}')
+    try:
+        shards.assign(location_id, shard)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Location {location_id} now stores new readings on {shard}')
+
+@app.cli.command('edge-init')
+def edge_init():
+    """Create the local SQLite schema and triggers of an edge node"""
+    if not app.config['EDGE_MODE'] or not app.config['EDGE_SITE_ID']:
+        raise click.ClickException('Run with FLASK_ENV=edge and EDGE_SITE_ID set')
+    edge.install(app.config['EDGE_SITE_ID'])
+    click.echo(f'Edge database ready for site {app.config["EDGE_SITE_ID"]}')
+
+@app.cli.command('edge-sync')
+@click.option('--loop', is_flag=True, help='Keep syncing every EDGE_SYNC_INTERVAL seconds.')
+@click.option('--prune/--no-prune', default=True, help='Delete shipped readings older than EDGE_RETENTION_DAYS.')
+def edge_sync(loop, prune):
+    """Ship buffered readings to the central server"""
+    if not app.config['EDGE_MODE']:
+        raise click.ClickException('Run with FLASK_ENV=edge')
+    keep_days = app.config['EDGE_RETENTION_DAYS'] if prune else None
+    try:
+        edge.run(app.config, loop, keep_days, echo=click.echo)
+    except edge.SyncError as e:
+        raise click.ClickException(str(e))
+
 # =====================================================
 # MAIN
 # =====================================================
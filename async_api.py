@@ -0,0 +1,418 @@
+"""Asyncio API tier for polling clients and gateways.
+
+Serves the sensor list, sensor, latest-reading, series and ingest endpoints of
+``app.py`` on an async MySQL driver, so open long-polls and slow uploads
+wait on the event loop instead of holding a worker thread each. Models,
+validation, series queries, token authentication and HTTP validators
+are shared with the Flask app; the HTML views stay on Flask.
+
+Run with ``uvicorn async_api:app`` and route ``/api/sensors/*`` and
+``POST /api/readings`` to it. Requires the ``async`` extra.
+
+Readings are read and written in the main database only, so the tier
+refuses to start when ``READING_SHARD_URLS`` lists other shards; serve
+those routes from the Flask app instead (see shards.py).
+"""
+import asyncio
+import os
+from functools import wraps
+from urllib.parse import urlencode
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import joinedload
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+import alerts
+import auth
+import cache
+import compress
+import fastjson
+import fieldsets
+import ingest
+import metrics
+import series
+import shards
+from config import config
+from models import Sensor, SensorLatest, Reading, DataVersion
+
+
+def _settings(config_name):
+    settings = config[config_name]
+    return {name: getattr(settings, name) for name in dir(settings) if name.isupper()}
+
+
+# =====================================================
+# LONG-POLL WATCHER
+# =====================================================
+
+class LatestWatcher:
+    """Wakes long-polls when their sensor gets a new latest reading.
+
+    A single loop per process checks SensorLatest for all watched sensors
+    in one query per interval, so the database load does not grow with
+    the number of waiting clients.
+    """
+
+    def __init__(self, sessions, interval):
+        self._sessions = sessions
+        self._interval = interval
+        self._waiters = {}  # sensor_id -> {event: reading_id seen by the client}
+        self._task = None
+
+    async def wait(self, sensor_id, reading_id, timeout):
+        """Wait until the sensor's latest reading differs from ``reading_id``"""
+        event = asyncio.Event()
+        self._waiters.setdefault(sensor_id, {})[event] = reading_id
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(sensor_id, {})
+            waiters.pop(event, None)
+            if not waiters:
+                self._waiters.pop(sensor_id, None)
+
+    async def _run(self):
+        while self._waiters:
+            await asyncio.sleep(self._interval)
+            sensor_ids = list(self._waiters)
+            if not sensor_ids:
+                break
+            async with self._sessions() as session:
+                current = dict((await session.execute(
+                    select(SensorLatest.sensor_id, SensorLatest.reading_id).where(
+                        SensorLatest.sensor_id.in_(sensor_ids))
+                )).all())
+            for sensor_id in sensor_ids:
+                for event, seen in list(self._waiters.get(sensor_id, {}).items()):
+                    if current.get(sensor_id) != seen:
+                        event.set()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+# =====================================================
+# KNOWN SENSORS
+# =====================================================
+
+class KnownSensors:
+    """Sensor ids accepted by ingest, kept per process until the 'Sensor' version changes.
+
+    The async form of ``cache.sensors()`` for the ingest check: a batch
+    costs the version lookup it already needs for alerts, not a scan of
+    the sensor table.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._ids = frozenset()
+        self._lock = asyncio.Lock()
+
+    async def get(self, session, version):
+        metrics.cache_result('reference', version == self._version)
+        if version != self._version:
+            async with self._lock:
+                if version != self._version:
+                    self._ids = frozenset((await session.execute(select(Sensor.sensor_id))).scalars())
+                    self._version = version
+        return self._ids
+
+
+# =====================================================
+# REQUEST HELPERS
+# =====================================================
+
+_token_reload = asyncio.Lock()
+
+
+async def _authenticate(request, session):
+    """Resolve the bearer token through the shared token table"""
+    token = auth.token_from_request(request)
+    if token is None:
+        return None
+    interval = request.app.state.config['API_TOKEN_REFRESH_INTERVAL']
+    if auth.token_table.stale(interval):
+        async with _token_reload:
+            if auth.token_table.stale(interval):
+                auth.token_table.load((await session.execute(auth.token_table.query())).all())
+    return auth.token_table.get(token)
+
+
+def _full_path(request):
+    # Same form as Flask's request.full_path, so both tiers issue identical
+    # ETags; the long-poll ``wait`` argument does not change the resource
+    query = request.url.query
+    if 'wait' in request.query_params:
+        query = urlencode([(k, v) for k, v in request.query_params.multi_items() if k != 'wait'])
+    return f'{request.url.path}?{query}'
+
+
+async def _validators(request, session, tables, key):
+    rows = (await session.execute(cache.STAMPS_QUERY)).all()
+    stamps = {name: (version, updated_at) for name, version, updated_at in rows}
+    key_result = await key(session, **request.path_params) if key is not None else None
+    return cache.validators(_full_path(request), stamps, tables, key_result)
+
+
+def _is_not_modified(request, etag, last_modified):
+    return cache.is_not_modified(
+        parse_etags(request.headers.get('If-None-Match')),
+        parse_date(request.headers.get('If-Modified-Since')),
+        etag, last_modified
+    )
+
+
+def _with_validators(response, etag, last_modified):
+    response.headers['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def api_view(*tables, key=None, watch=False):
+    """Token-authenticated handler with its own session; the async form of
+    ``login_required`` plus ``cache.conditional``.
+
+    With ``watch=True`` a revalidation carrying ``?wait=<seconds>`` is held
+    open until the sensor's latest reading changes (a long-poll) instead
+    of being answered with an immediate 304.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            state = request.app.state
+            async with state.sessions() as session:
+                if await _authenticate(request, session) is None:
+                    return JSONResponse({'error': 'Authentication required'}, 401)
+                if not tables and key is None:
+                    return await handler(request, session)
+
+                etag, last_modified = await _validators(request, session, tables, key)
+                not_modified = _is_not_modified(request, etag, last_modified)
+                if not_modified and watch:
+                    try:
+                        wait = min(float(request.query_params.get('wait') or 0),
+                                   state.config['LONGPOLL_MAX_WAIT'])
+                    except ValueError:
+                        wait = 0
+                    if wait > 0:
+                        # Release the connection while the client waits
+                        sensor_id = request.path_params['sensor_id']
+                        seen = (await _latest_key(session, sensor_id))[0]
+                        await session.close()
+                        await state.watcher.wait(sensor_id, seen, wait)
+                        etag, last_modified = await _validators(request, session, tables, key)
+                        not_modified = _is_not_modified(request, etag, last_modified)
+
+                metrics.cache_result('http_conditional', not_modified)
+                if not_modified:
+                    response = Response(status_code=304)
+                else:
+                    response = await handler(request, session)
+                if response.status_code in (200, 304):
+                    _with_validators(response, etag, last_modified)
+                return response
+        return wrapper
+    return decorator
+
+
+async def _latest_key(session, sensor_id):
+    row = (await session.execute(series.latest_key_query(sensor_id))).first()
+    return (row.reading_id, row.reading_timestamp) if row else (None, None)
+
+
+def _not_found(message):
+    return JSONResponse({'error': message}, 404)
+
+
+# =====================================================
+# ENDPOINTS
+# =====================================================
+
+def _json(payload, status=200):
+    return Response(fastjson.dumps(payload), status_code=status, media_type='application/json')
+
+
+@api_view('Sensor', 'SensorType', 'Location')
+async def api_sensors(request, session):
+    """Sensors matching ids/filters, limited to the requested fields; filtered lists are paginated"""
+    args = request.query_params
+    try:
+        fields = fieldsets.parse_fields(args.get('fields'))
+        ids = fieldsets.parse_ids(args.get('ids'))
+        page, per_page = fieldsets.parse_page(args, request.app.state.config, fields)
+        type_id = int(args['type_id']) if args.get('type_id') else None
+        location_id = int(args['location_id']) if args.get('location_id') else None
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+
+    filters = dict(status=args.get('status'), type_id=type_id, location_id=location_id,
+                   search=args.get('search'))
+    if ids is not None:
+        query = fieldsets.sensor_query(fields, ids, **filters)
+        sensors = fieldsets.to_dicts(fields, (await session.execute(query)).all())
+        return _json({'count': len(sensors), 'sensors': sensors})
+
+    query = fieldsets.sensor_query(fields, page=page, per_page=per_page, **filters)
+    sensors = fieldsets.to_dicts(fields, (await session.execute(query)).all())
+    total = await session.scalar(fieldsets.sensor_count_query(**filters))
+    return _json({'count': len(sensors), **fieldsets.page_info(page, per_page, total),
+                  'sensors': sensors})
+
+
+@api_view('Sensor', 'SensorType', 'Location')
+async def api_sensor(request, session):
+    """Get sensor details as JSON"""
+    try:
+        fields = fieldsets.parse_fields(request.query_params.get('fields'))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+
+    query = fieldsets.sensor_query(fields, [request.path_params['sensor_id']])
+    rows = (await session.execute(query)).all()
+    if not rows:
+        return _not_found('Sensor not found')
+    return _json(fieldsets.to_dicts(fields, rows)[0])
+
+
+@api_view('Reading', 'Sensor', key=_latest_key, watch=True)
+async def api_latest_reading(request, session):
+    """Get latest reading for a sensor; supports long-polling with ``wait``"""
+    reading = await session.scalar(
+        select(SensorLatest).options(joinedload(SensorLatest.sensor))
+        .where(SensorLatest.sensor_id == request.path_params['sensor_id'])
+    )
+    if reading is None:
+        return _not_found('No readings found')
+    return JSONResponse(reading.to_dict())
+
+
+@api_view('Reading', key=_latest_key)
+async def api_sensor_series(request, session):
+    """Windowed, cursor-paginated reading series for a sensor"""
+    sensor_id = request.path_params['sensor_id']
+    if await session.get(Sensor, sensor_id) is None:
+        return _not_found('Sensor not found')
+    try:
+        days, end, cursor, limit = series.parse_args(request.query_params, request.app.state.config)
+    except ValueError:
+        return JSONResponse({'error': 'Invalid days, end, before or limit parameter'}, 400)
+
+    latest = None
+    if end is None:
+        latest = (await session.execute(series.latest_timestamp_query(sensor_id))).scalar()
+    start, end = series.window_bounds(days, end, latest)
+
+    rows = (await session.execute(series.page_query(sensor_id, start, end, cursor, limit))).all()
+    rows = await session.run_sync(series.merge_chunks, sensor_id, start, end, cursor, limit, rows)
+    rows, next_cursor = series.split_page(rows, limit)
+    stats = None
+    if cursor is None:
+        stats = series.stats_from_row((await session.execute(series.stats_query(sensor_id, start, end))).one())
+        stats = await session.run_sync(series.merge_stats, sensor_id, start, end, stats)
+    return JSONResponse(series.payload(sensor_id, start, end, rows, next_cursor, stats))
+
+
+@api_view()
+async def api_ingest_readings(request, session):
+    """Ingest one reading or a batch of readings posted as JSON"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({'error': 'Request body must be JSON'}, 400)
+
+    versions = {name: version for name, version, _ in (await session.execute(cache.STAMPS_QUERY)).all()}
+    known_sensor_ids = await request.app.state.known_sensors.get(session, versions.get('Sensor', 0))
+    try:
+        rows = ingest.parse_readings(payload, known_sensor_ids)
+    except ingest.IngestError as e:
+        return JSONResponse({'error': 'Invalid readings', 'details': e.errors}, 400)
+
+    try:
+        latest = dict((await session.execute(ingest.latest_query(rows))).all())
+        raised = await session.run_sync(alerts.check_readings, rows, versions)
+        await session.execute(Reading.__table__.insert(), rows)
+        if ingest.has_backfill(rows, latest):
+            result = await session.execute(cache.bump_statement('Reading'))
+            if not result.rowcount:
+                session.add(DataVersion(name='Reading', version=1))
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        return JSONResponse({'error': f'Error storing readings: {str(e)}'}, 500)
+
+    metrics.inc('ingest_readings_total', len(rows))
+    alerts.notify(raised, request.app.state.config)
+    return JSONResponse({'inserted': len(rows), 'alerts': len(raised)}, 201)
+
+
+async def metrics_view(request):
+    """This tier's series in the text exposition format, as the Flask app's /metrics"""
+    token = request.app.state.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', 401, media_type='text/plain')
+    return Response(metrics.render(*metrics.collect()), media_type='text/plain; version=0.0.4')
+
+
+# =====================================================
+# APPLICATION
+# =====================================================
+
+def create_app(config_name='development'):
+    """Application factory for the async tier"""
+    settings = _settings(config_name)
+    if any(key != shards.PRIMARY for key in settings['READING_SHARDS']):
+        raise RuntimeError('The async API tier does not support reading shards; '
+                           'unset READING_SHARD_URLS or serve these routes from the Flask app')
+    options = {}
+    if not settings['ASYNC_DATABASE_URI'].startswith('sqlite'):
+        options = {
+            'pool_size': settings['ASYNC_POOL_SIZE'],
+            'max_overflow': settings['ASYNC_MAX_OVERFLOW'],
+            'pool_recycle': 3600,
+            'pool_pre_ping': True
+        }
+    engine = create_async_engine(settings['ASYNC_DATABASE_URI'], **options)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def lifespan(app):
+        yield
+        app.state.watcher.stop()
+        await engine.dispose()
+
+    routes = [
+        Route('/api/sensors', api_sensors),
+        Route('/api/sensors/{sensor_id:int}', api_sensor),
+        Route('/api/sensors/{sensor_id:int}/latest-reading', api_latest_reading),
+        Route('/api/sensors/{sensor_id:int}/readings', api_sensor_series),
+        Route('/api/readings', api_ingest_readings, methods=['POST']),
+    ]
+    middleware = [Middleware(compress.ASGICompressMiddleware, settings=settings)]
+    # Outermost, so it sees compressed sizes
+    metrics_middleware = metrics.init_asgi(settings, engine.sync_engine.pool)
+    if metrics_middleware is not None:
+        middleware.insert(0, Middleware(metrics_middleware))
+        routes.append(Route('/metrics', metrics_view))
+
+    app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
+    app.state.config = settings
+    app.state.engine = engine
+    app.state.sessions = sessions
+    app.state.watcher = LatestWatcher(sessions, settings['LONGPOLL_INTERVAL'])
+    app.state.known_sensors = KnownSensors()
+    return app
+
+
+app = create_app(os.getenv('FLASK_ENV', 'development'))
@@ -0,0 +1,274 @@
+"""User loading and API token authentication helpers"""
+import hashlib
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import metrics
+from models import db, User, ApiToken
+
+
+class CachedUser(UserMixin):
+    """Read-only snapshot of a User row, safe to share between requests"""
+
+    def __init__(self, user_id, username, email, full_name, is_active):
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+        self.full_name = full_name
+        self._active = bool(is_active)
+
+    @property
+    def is_active(self):
+        return self._active
+
+    def get_id(self):
+        return str(self.user_id)
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+def _snapshot(row):
+    return CachedUser(row.user_id, row.username, row.email, row.full_name, row.is_active)
+
+
+_user_columns = (User.user_id, User.username, User.email, User.full_name, User.is_active)
+
+
+# =====================================================
+# USER CACHE
+# =====================================================
+
+class UserCache:
+    """Short-TTL cache of user snapshots keyed by user id"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, ttl):
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > now:
+            metrics.cache_result('user', True)
+            return entry[1]
+
+        metrics.cache_result('user', False)
+        row = db.session.query(*_user_columns).filter(User.user_id == user_id).first()
+        user = _snapshot(row) if row else None
+        with self._lock:
+            self._entries[user_id] = (now + ttl, user)
+        return user
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+
+# =====================================================
+# API TOKENS
+# =====================================================
+
+def generate_token():
+    """Return a new random token; only its hash is ever stored"""
+    return secrets.token_urlsafe(32)
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenTable:
+    """In-memory map of token hash -> user snapshot.
+
+    The table is reloaded in one query when it is older than the refresh
+    interval, so revocations reach every worker within that interval and
+    token-authenticated requests normally cost no database round trip.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def query():
+        return select(ApiToken.token_hash, *_user_columns).join(
+            User, ApiToken.user_id == User.user_id
+        ).where(
+            ApiToken.is_active.is_(True),
+            User.is_active.is_(True)
+        )
+
+    def stale(self, refresh_interval):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > refresh_interval
+
+    def load(self, rows):
+        """Replace the table with the rows of ``query()``"""
+        tokens = {row.token_hash: _snapshot(row) for row in rows}
+        with self._lock:
+            self._tokens = tokens
+            self._loaded_at = time.monotonic()
+
+    def get(self, token):
+        return self._tokens.get(hash_token(token))
+
+    def lookup(self, token, refresh_interval):
+        if self.stale(refresh_interval):
+            self.load(db.session.execute(self.query()).all())
+        return self.get(token)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+
+token_table = TokenTable()
+
+
+def token_from_request(request):
+    """Extract a bearer token from the Authorization or X-API-Token header"""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[7:].strip() or None
+    return request.headers.get('X-API-Token') or None
+
+
+def create_token(user, name):
+    """Create a token for ``user``; returns the plaintext token once"""
+    token = generate_token()
+    db.session.add(ApiToken(user_id=user.user_id, name=name, token_hash=hash_token(token)))
+    db.session.commit()
+    token_table.invalidate()
+    return token
+
+
+def invalidate_user(user_id):
+    """Drop cached state for a user after their row changes"""
+    user_cache.invalidate(user_id)
+    token_table.invalidate()
+
+
+# =====================================================
+# PASSWORD HASHING
+# =====================================================
+
+class HasherBusy(RuntimeError):
+    """Raised when too many password hashes are already queued"""
+
+
+@lru_cache(maxsize=8)
+def hash_prefix(method):
+    """Parameter prefix werkzeug writes for ``method``, e.g. 'scrypt:32768:8:1'"""
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+@lru_cache(maxsize=8)
+def dummy_hash(method):
+    """Hash of a random password, checked for unknown usernames so they take as long as known ones"""
+    return generate_password_hash(secrets.token_urlsafe(16), method)
+
+
+class PasswordHasher:
+    """Runs password hashing on a small bounded thread pool.
+
+    scrypt and pbkdf2 release the GIL while hashing, so request threads
+    waiting here don't hold up other requests. Capping the pool and the
+    queue limits the CPU and memory a login burst can take; once the
+    queue is full, attempts fail fast with ``HasherBusy`` instead of
+    piling up behind each other.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _submit(self, func, *args):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    config = current_app.config
+                    workers = config['PASSWORD_HASH_WORKERS']
+                    self._slots = threading.BoundedSemaphore(workers + config['PASSWORD_HASH_QUEUE'])
+                    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Password hashing queue is full')
+        future = self._pool.submit(func, *args)
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+        except FutureTimeout:
+            raise HasherBusy('Timed out waiting for password hashing')
+
+    def verify(self, password_hash, password):
+        return self._submit(check_password_hash, password_hash, password)
+
+    def hash(self, password, method=None):
+        return self._submit(generate_password_hash, password,
+                            method or current_app.config['PASSWORD_HASH_METHOD'])
+
+
+password_hasher = PasswordHasher()
+
+
+# =====================================================
+# RATE LIMITING
+# =====================================================
+
+class RateLimiter:
+    """Sliding-window counter per key, kept in process memory"""
+
+    def __init__(self):
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, key, window, now):
+        hits = self._hits.get(key)
+        if hits is None:
+            return None
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if not hits:
+            del self._hits[key]
+            return None
+        return hits
+
+    def exceeded(self, key, limit, window):
+        """True if ``key`` already has ``limit`` hits within ``window`` seconds"""
+        with self._lock:
+            hits = self._prune(key, window, time.monotonic())
+            return hits is not None and len(hits) >= limit
+
+    def hit(self, key, window):
+        """Record one hit for ``key``"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(key, window, now)
+            self._hits.setdefault(key, deque()).append(now)
+            # Keep memory bounded under address-spraying attacks
+            if len(self._hits) > 10000:
+                for stale in [k for k, v in self._hits.items() if v[-1] <= now - window]:
+                    del self._hits[stale]
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+login_attempts = RateLimiter()
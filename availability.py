@@ -0,0 +1,196 @@
+"""Sensor uptime and availability computed from the SensorStatusLog history"""
+import threading
+from bisect import bisect_right
+from datetime import datetime, time
+
+from flask import current_app
+from sqlalchemy import select
+
+import cache
+from models import db, Sensor, SensorStatusLog
+
+STATUSES = ('ACTIVE', 'INACTIVE', 'MAINTENANCE')
+
+
+class Timeline:
+    """Status intervals of one sensor, indexed by start time.
+
+    ``starts[i]`` is when ``statuses[i]`` began; each interval ends where
+    the next one starts, and the last one is still open. Point and range
+    lookups bisect ``starts``, so they cost O(log n) plus the intervals
+    actually inside the window.
+    """
+
+    def __init__(self, since, status):
+        self.starts = [since]
+        self.statuses = [status]
+        self.logged = False
+
+    def record(self, timestamp, old_status, new_status):
+        """Apply one logged transition"""
+        if not self.logged:
+            # Until its first change the sensor had the status it changed from
+            self.statuses[0] = old_status or new_status
+            self.logged = True
+        if timestamp < self.starts[0]:
+            self.starts[0] = timestamp
+        if timestamp >= self.starts[-1]:
+            self.starts.append(timestamp)
+            self.statuses.append(new_status)
+        else:
+            index = bisect_right(self.starts, timestamp)
+            self.starts.insert(index, timestamp)
+            self.statuses.insert(index, new_status)
+
+    def status_at(self, moment):
+        index = bisect_right(self.starts, moment) - 1
+        return self.statuses[index] if index >= 0 else None
+
+    def totals(self, start, end):
+        """Seconds spent in each status and ACTIVE -> INACTIVE failures within [start, end)"""
+        seconds = dict.fromkeys(STATUSES, 0.0)
+        failures = 0
+        index = max(bisect_right(self.starts, start) - 1, 0)
+        last = len(self.starts) - 1
+        while index <= last and self.starts[index] < end:
+            begin = max(self.starts[index], start)
+            finish = min(self.starts[index + 1], end) if index < last else end
+            if finish > begin:
+                seconds[self.statuses[index]] += (finish - begin).total_seconds()
+            if (index > 0 and self.starts[index] >= start and
+                    self.statuses[index] == 'INACTIVE' and self.statuses[index - 1] == 'ACTIVE'):
+                failures += 1
+            index += 1
+        return seconds, failures
+
+
+def summarize(seconds, failures, sensors=1):
+    """Uptime, MTBF and maintenance figures from accumulated status times"""
+    observed = sum(seconds.values())
+    active = seconds['ACTIVE']
+    return {
+        'sensors': sensors,
+        'observed_hours': round(observed / 3600, 2),
+        'uptime_pct': round(active * 100 / observed, 2) if observed else None,
+        'downtime_hours': round(seconds['INACTIVE'] / 3600, 2),
+        'maintenance_hours': round(seconds['MAINTENANCE'] / 3600, 2),
+        'failures': failures,
+        'mtbf_hours': round(active / failures / 3600, 2) if failures else None
+    }
+
+
+class AvailabilityIndex:
+    """Per-process index of every sensor's status timeline.
+
+    The index keeps a watermark on ``SensorStatusLog.log_id``; each refresh
+    reads only log rows near or above it, so repeated fleet-wide reports
+    never rescan the whole log. Ids are allocated before commit, so a row
+    can become visible after a higher one: each refresh re-reads the last
+    ``AVAILABILITY_LOG_OVERLAP`` ids below the watermark too and skips the
+    rows it has already applied. Sensor metadata is reloaded when the
+    Sensor data version changes.
+    """
+
+    def __init__(self):
+        self._timelines = {}
+        self._sensors = {}
+        self._sensor_version = None
+        self._watermark = 0
+        self._applied = set()  # log ids applied within the overlap
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        version = cache.current_versions().get('Sensor', 0)
+        overlap = current_app.config['AVAILABILITY_LOG_OVERLAP']
+        with self._lock:
+            if version != self._sensor_version or not self._sensors:
+                self._reload_sensors()
+                self._sensor_version = version
+            self._apply(SensorStatusLog.log_id > self._watermark - overlap)
+            floor = self._watermark - overlap
+            self._applied = {log_id for log_id in self._applied if log_id > floor}
+
+    def _reload_sensors(self):
+        rows = db.session.execute(select(
+            Sensor.sensor_id, Sensor.type_id, Sensor.location_id,
+            Sensor.install_date, Sensor.created_at, Sensor.status
+        )).all()
+        self._sensors = {row.sensor_id: row for row in rows}
+        for sensor_id in set(self._timelines) - set(self._sensors):
+            del self._timelines[sensor_id]
+
+        added = []
+        for row in rows:
+            timeline = self._timelines.get(row.sensor_id)
+            if timeline is None:
+                since = datetime.combine(row.install_date, time()) if row.install_date else row.created_at
+                self._timelines[row.sensor_id] = Timeline(since or datetime.utcnow(), row.status)
+                added.append(row.sensor_id)
+            elif not timeline.logged:
+                timeline.statuses[0] = row.status
+        if added and self._watermark:
+            # History of sensors first seen now, up to what is already applied
+            self._apply(SensorStatusLog.sensor_id.in_(added),
+                        SensorStatusLog.log_id <= self._watermark, advance=False)
+
+    def _apply(self, *criteria, advance=True):
+        rows = db.session.execute(select(
+            SensorStatusLog.log_id, SensorStatusLog.sensor_id, SensorStatusLog.old_status,
+            SensorStatusLog.new_status, SensorStatusLog.change_timestamp
+        ).where(*criteria).order_by(SensorStatusLog.log_id)).all()
+        for row in rows:
+            timeline = self._timelines.get(row.sensor_id)
+            if timeline is None or row.log_id in self._applied:
+                continue
+            self._applied.add(row.log_id)
+            if row.change_timestamp is not None:
+                timeline.record(row.change_timestamp, row.old_status, row.new_status)
+        if advance and rows:
+            self._watermark = max(self._watermark, rows[-1].log_id)
+
+    def status_at(self, moment):
+        """{sensor_id: status} at ``moment`` for sensors installed by then"""
+        self.refresh()
+        with self._lock:
+            statuses = {sensor_id: timeline.status_at(moment)
+                        for sensor_id, timeline in self._timelines.items()}
+        return {sensor_id: status for sensor_id, status in statuses.items() if status}
+
+    def report(self, start, end, group_by='sensor'):
+        """Availability per sensor, type or location over [start, end), plus the fleet total"""
+        self.refresh()
+        end = min(end, datetime.utcnow())
+        groups, fleet = {}, [dict.fromkeys(STATUSES, 0.0), 0, 0]
+        with self._lock:
+            for sensor_id, timeline in self._timelines.items():
+                seconds, failures = timeline.totals(start, end)
+                if not any(seconds.values()):
+                    continue
+                sensor = self._sensors[sensor_id]
+                key = {'sensor': sensor_id, 'type': sensor.type_id,
+                       'location': sensor.location_id}[group_by]
+                for target in (groups.setdefault(key, [dict.fromkeys(STATUSES, 0.0), 0, 0]), fleet):
+                    for status in STATUSES:
+                        target[0][status] += seconds[status]
+                    target[1] += failures
+                    target[2] += 1
+
+        names = _group_names(group_by)
+        rows = []
+        for key, (seconds, failures, sensors) in groups.items():
+            row = {'key': key, 'name': names.get(key, str(key))}
+            row.update(summarize(seconds, failures, sensors))
+            rows.append(row)
+        rows.sort(key=lambda row: (row['uptime_pct'] is None, row['uptime_pct'] or 0))
+        return rows, summarize(*fleet)
+
+
+def _group_names(group_by):
+    if group_by == 'type':
+        return {t.type_id: t.name for t in cache.sensor_types()}
+    if group_by == 'location':
+        return {loc.location_id: loc.area_name for loc in cache.locations()}
+    return {s.sensor_id: s.model for s in cache.sensors()}
+
+
+index = AvailabilityIndex()
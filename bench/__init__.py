@@ -0,0 +1,4 @@
+"""Benchmark harness: synthetic datasets, endpoint timings and result comparison.
+
+Run ``python -m bench --help`` from the project root.
+"""
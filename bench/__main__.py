@@ -0,0 +1,225 @@
+"""Command line entry point: ``python -m bench generate|run|explain|coldstart|interpolation|compare|loadgen``.
+
+The database comes from ``TEST_DATABASE_URL`` (the testing config), e.g.
+``sqlite:///bench-medium.db`` or ``mysql+pymysql://root@localhost/microclimate_bench``.
+For MySQL load ``database/schema.sql`` into an empty database first so
+triggers and procedures exist.
+"""
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['FLASK_ENV'] = 'testing'
+
+
+def _app(database):
+    if database:
+        os.environ['TEST_DATABASE_URL'] = database
+    elif 'TEST_DATABASE_URL' not in os.environ:
+        raise click.UsageError('Pass --database or set TEST_DATABASE_URL; the default in-memory '
+                               'database does not outlive the command')
+    from app import app
+    return app
+
+
+@click.group()
+def cli():
+    """Benchmark the application against synthetic datasets"""
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default='small')
+@click.option('--database', help='SQLAlchemy URL (defaults to TEST_DATABASE_URL).')
+@click.option('--seed', type=int, default=42)
+def generate(scale, database, seed):
+    """Populate an empty database with a synthetic grid"""
+    from bench import dataset
+    app = _app(database)
+    with app.app_context():
+        from models import db
+        db.create_all()
+        if dataset.existing_readings():
+            raise click.ClickException('The database already holds readings; use an empty one')
+        dataset.generate(dataset.SCALES[scale], seed=seed, echo=click.echo)
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default='small')
+@click.option('--database', help='SQLAlchemy URL (defaults to TEST_DATABASE_URL).')
+@click.option('--repeat', type=int, default=20, help='Warm requests per endpoint.')
+@click.option('--only', multiple=True, help='Time only endpoints whose name contains this (repeatable).')
+@click.option('--seed', type=int, default=42)
+@click.option('--save/--no-save', default=True, help='Write results to bench/results.')
+def run(scale, database, repeat, only, seed, save):
+    """Time pages, exports and JSON APIs; generates the dataset if the database is empty"""
+    from bench import dataset, runner
+    app = _app(database)
+    with app.app_context():
+        from models import db
+        db.create_all()
+        readings = dataset.existing_readings()
+        if not readings:
+            click.echo(f'Generating the {scale} dataset...')
+            dataset.generate(dataset.SCALES[scale], seed=seed, echo=click.echo)
+            readings = dataset.existing_readings()
+
+    document = runner.run(app, scale, readings, repeat, only, echo=click.echo)
+    if save:
+        click.echo(f'Saved {runner.save(document)}')
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default='small')
+@click.option('--database', help='SQLAlchemy URL (defaults to TEST_DATABASE_URL).')
+@click.option('--min-rows', type=int, default=1000, help='Scans of smaller tables are ignored.')
+@click.option('--seed', type=int, default=42)
+@click.option('--verbose', is_flag=True, help='Print every plan, not only those with findings.')
+@click.option('--save/--no-save', default=True, help='Write the report to bench/results.')
+def explain(scale, database, min_rows, seed, verbose, save):
+    """EXPLAIN the hot queries; exits 1 on full scans or filesorts of large tables"""
+    from bench import dataset, explain as plans
+    app = _app(database)
+    with app.app_context():
+        from models import db
+        db.create_all()
+        if not dataset.existing_readings():
+            click.echo(f'Generating the {scale} dataset...')
+            dataset.generate(dataset.SCALES[scale], seed=seed, echo=click.echo)
+
+    document = plans.run(app, scale, min_rows, echo=click.echo)
+    click.echo(plans.format_report(document, verbose))
+    if save:
+        click.echo(f'Saved {plans.save(document)}')
+    if plans.failures(document):
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default='small')
+@click.option('--database', help='SQLAlchemy URL (defaults to TEST_DATABASE_URL).')
+@click.option('--runs', type=int, default=5, help='Fresh processes per mode (cold and warm).')
+@click.option('--repeat', type=int, default=5, help='Steady-state requests per path after the first.')
+@click.option('--path', 'paths', multiple=True, help='Path to request (repeatable; default: bench/coldstart.py PATHS).')
+@click.option('--budget', type=float, default=10.0, help='Seconds a warm start may take to be ready.')
+@click.option('--seed', type=int, default=42)
+@click.option('--save/--no-save', default=True, help='Write results to bench/results.')
+def coldstart(scale, database, runs, repeat, paths, budget, seed, save):
+    """Time fresh processes with and without warm-up; exits 1 over the startup budget"""
+    from bench import coldstart as startup, dataset
+    app = _app(database)
+    with app.app_context():
+        from models import db
+        db.create_all()
+        if not dataset.existing_readings():
+            click.echo(f'Generating the {scale} dataset...')
+            dataset.generate(dataset.SCALES[scale], seed=seed, echo=click.echo)
+
+    try:
+        document = startup.run(os.environ['TEST_DATABASE_URL'], runs, paths or startup.PATHS, repeat,
+                               echo=click.echo)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(startup.format_report(document, budget))
+    if save:
+        click.echo(f'Saved {startup.save(document)}')
+    if startup.over_budget(document, budget):
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option('--resolution', type=int, default=200, help='Grid cells per side (the API maximum).')
+@click.option('--points', 'counts', type=int, multiple=True, help='Location count (repeatable; default: 100, 1000, 5000).')
+@click.option('--budget', type=float, default=2.0, help='Seconds a single raster may take.')
+@click.option('--seed', type=int, default=42)
+@click.option('--save/--no-save', default=True, help='Write results to bench/results.')
+def interpolation(resolution, counts, budget, seed, save):
+    """Time heatmap rasters for city-scale networks; exits 1 over the budget"""
+    from bench import interpolation as raster
+    from config import Config
+    options = dict(max_points=Config.HEATMAP_MAX_POINTS, kriging_points=Config.HEATMAP_KRIGING_MAX_POINTS,
+                   neighbours=Config.HEATMAP_IDW_NEIGHBOURS)
+    document = raster.run(resolution, counts or raster.COUNTS, options, seed=seed, echo=click.echo)
+    click.echo(raster.format_report(document, budget))
+    if save:
+        click.echo(f'Saved {raster.save(document)}')
+    if raster.over_budget(document, budget):
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.argument('baseline', required=False)
+@click.argument('current', required=False)
+@click.option('--metric', type=click.Choice(['p50_ms', 'p99_ms', 'cold_ms', 'peak_kb']), default='p50_ms')
+@click.option('--threshold', type=float, default=0.2, help='Allowed fractional slowdown.')
+@click.option('--min-delta', type=float, default=1.0, help='Ignore smaller absolute changes.')
+def compare(baseline, current, metric, threshold, min_delta):
+    """Compare two result files (default: the two newest); exits 1 on regressions"""
+    from bench import runner
+    if not current:
+        paths = sorted(glob.glob(os.path.join(runner.RESULTS_DIR, '*.json')), key=os.path.getmtime)
+        if len(paths) < 2:
+            raise click.ClickException('Need two result files to compare')
+        baseline, current = baseline or paths[-2], paths[-1]
+    before, after = runner.load(baseline), runner.load(current)
+    click.echo(f'{before["commit"]} -> {after["commit"]} ({after["scale"]}, {after["database"]}, {metric})')
+
+    rows, regressions = runner.compare(before, after, metric, threshold, min_delta)
+    for name, old, new, change in rows:
+        old = f'{old:10.2f}' if old is not None else f'{"-":>10}'
+        new = f'{new:10.2f}' if new is not None else f'{"-":>10}'
+        change = f'{change:+7.1%}' if change is not None else ''
+        flag = '  REGRESSION' if name in regressions else ''
+        click.echo(f'{name:<32}{old}{new} {change}{flag}')
+    if regressions:
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option('--url', default='http://localhost:5000', help='Base URL of the Flask app or async tier.')
+@click.option('--token', envvar='LOADGEN_TOKEN', required=True,
+              help='API token (flask --app app create-api-token); or set LOADGEN_TOKEN.')
+@click.option('--gateways', type=int, default=10, help='Simulated gateways posting readings.')
+@click.option('--interval', type=float, default=10.0, help='Seconds between a gateway\'s posts.')
+@click.option('--dashboards', type=int, default=5, help='Simulated dashboards polling the API.')
+@click.option('--poll-interval', type=float, default=2.0, help='Seconds between dashboard refreshes.')
+@click.option('--duration', type=float, default=60.0, help='Seconds to run (per ramp step).')
+@click.option('--clock-speed', type=float, default=1.0, help='Virtual days pass this many times faster.')
+@click.option('--connections', type=int, default=100, help='Client connection pool size.')
+@click.option('--ramp', type=int, default=0, help='Double the gateways up to this many steps.')
+@click.option('--max-error-rate', type=float, default=0.01, help='Ramp stops above this ingest error rate.')
+@click.option('--max-p99', type=float, default=1000.0, help='Ramp stops above this ingest p99 (ms).')
+@click.option('--seed', type=int, default=42)
+@click.option('--save/--no-save', default=True, help='Write results to bench/results.')
+def loadgen(url, token, gateways, interval, dashboards, poll_interval, duration, clock_speed,
+            connections, ramp, max_error_rate, max_p99, seed, save):
+    """Simulate gateways and dashboards against a running server"""
+    from bench import loadgen as generator, runner
+    options = dict(base_url=url, token=token, interval=interval, dashboards=dashboards,
+                   poll_interval=poll_interval, duration=duration, seed=seed,
+                   clock_speed=clock_speed, max_connections=connections)
+    try:
+        if ramp:
+            steps = generator.ramp(ramp, gateways, max_error_rate, max_p99, echo=click.echo, **options)
+        else:
+            steps = [asyncio.run(generator.run(gateways=gateways, **options))]
+            click.echo(generator.format_summary(steps[0]))
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    if save:
+        os.makedirs(runner.RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        path = os.path.join(runner.RESULTS_DIR, f'loadgen-{stamp}-{runner.commit_id()}.json')
+        with open(path, 'w') as handle:
+            json.dump({'commit': runner.commit_id(), 'steps': steps}, handle, indent=2)
+        click.echo(f'Saved {path}')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,151 @@
+"""Measure how long a fresh process takes to serve its first requests.
+
+Each run starts a new interpreter (``python -m bench.coldstart`` in
+child mode) that imports the app, optionally warms it up the way
+gunicorn.conf.py does (master phases, release, worker phases), then
+requests every path once (first) and ``repeat`` more times (steady).
+Runs alternate between cold and warm starts; the report gives medians
+of the time to ready (interpreter start to the end of warm-up) and of
+each path's first and steady-state latency.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench.runner import RESULTS_DIR, commit_id
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = ('/', '/sensors', '/readings', '/locations', '/technicians', '/alerts')
+
+
+def _child(warm, paths, repeat):
+    """Runs in the measured process; prints one JSON document"""
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    from app import app
+    imported = time.perf_counter()
+
+    phases = {}
+    if warm:
+        import warmup
+        phases = warmup.warm(app, warmup.MASTER_PHASES)
+        warmup.release(app)
+        phases.update({f'worker:{phase}': seconds
+                       for phase, seconds in warmup.warm(app, warmup.WORKER_PHASES).items()})
+    ready = time.time()
+
+    from bench import dataset
+    client = app.test_client()
+    response = client.post('/login', data={'username': dataset.BENCH_USER, 'password': dataset.BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit('Could not log in as the benchmark user; generate the dataset first')
+
+    latencies = {}
+    for path in paths:
+        samples = []
+        for _ in range(repeat + 1):
+            begun = time.perf_counter()
+            response = client.get(path)
+            response.get_data()
+            samples.append((time.perf_counter() - begun) * 1000)
+        latencies[path] = {'status': response.status_code, 'first_ms': samples[0],
+                           'steady_ms': statistics.median(samples[1:]) if repeat else None}
+
+    print(json.dumps({'import_s': imported - started, 'phases': phases, 'ready_at': ready,
+                      'paths': latencies}))
+
+
+def measure(database, warm, paths, repeat):
+    """One fresh process; returns its timings with ``ready_s`` counted from the spawn"""
+    env = dict(os.environ, FLASK_ENV='testing', TEST_DATABASE_URL=database, PYTHONWARNINGS='ignore')
+    command = [sys.executable, '-m', 'bench.coldstart', '--warm' if warm else '--cold',
+               '--repeat', str(repeat), *paths]
+    spawned = time.time()
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else
+                           f'exit status {result.returncode}')
+    document = json.loads(result.stdout.strip().splitlines()[-1])
+    document['ready_s'] = document.pop('ready_at') - spawned
+    return document
+
+
+def _median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+
+def summarize(runs, paths):
+    """Medians over runs of one mode"""
+    phases = list(dict.fromkeys(phase for run in runs for phase in run['phases']))
+    return {
+        'runs': len(runs),
+        'ready_s': _median([run['ready_s'] for run in runs]),
+        'import_s': _median([run['import_s'] for run in runs]),
+        'phases': {phase: _median([run['phases'].get(phase) for run in runs]) for phase in phases},
+        'paths': {path: {
+            'status': runs[-1]['paths'][path]['status'],
+            'first_ms': _median([run['paths'][path]['first_ms'] for run in runs]),
+            'steady_ms': _median([run['paths'][path]['steady_ms'] for run in runs]),
+        } for path in paths},
+    }
+
+
+def run(database, runs, paths, repeat, echo=print):
+    """Alternate cold and warm starts; returns the result document"""
+    samples = {'cold': [], 'warm': []}
+    for index in range(runs):
+        for mode in samples:
+            samples[mode].append(measure(database, mode == 'warm', paths, repeat))
+            echo(f'run {index + 1}/{runs} {mode}: ready in {samples[mode][-1]["ready_s"]:.2f} s')
+
+    return {
+        'commit': commit_id(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'database': database.split(':', 1)[0].split('+', 1)[0],
+        'repeat': repeat,
+        'modes': {mode: summarize(results, paths) for mode, results in samples.items()},
+    }
+
+
+def format_report(document, budget):
+    lines = []
+    for mode, summary in document['modes'].items():
+        lines.append(f'{mode}: ready in {summary["ready_s"]:.2f} s (import {summary["import_s"]:.2f} s)'
+                     + ('  OVER BUDGET' if budget and summary['ready_s'] > budget else ''))
+        for phase, seconds in summary['phases'].items():
+            lines.append(f'  {phase:<24}{seconds * 1000:>10.1f} ms')
+    lines.append(f'{"path":<24}{"cold first":>12}{"warm first":>12}{"steady":>12}')
+    cold, warm = document['modes']['cold']['paths'], document['modes']['warm']['paths']
+    for path in cold:
+        steady = warm[path]['steady_ms']
+        steady = f'{steady:10.1f}ms' if steady is not None else f'{"-":>12}'
+        lines.append(f'{path:<24}{cold[path]["first_ms"]:10.1f}ms{warm[path]["first_ms"]:10.1f}ms{steady}')
+    return '\n'.join(lines)
+
+
+def over_budget(document, budget):
+    """True when a warm start is not ready within ``budget`` seconds"""
+    return bool(budget) and document['modes']['warm']['ready_s'] > budget
+
+
+def save(document, directory=RESULTS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = document['created_at'].replace(':', '').replace('-', '')
+    path = os.path.join(directory, f'coldstart-{document["database"]}-{stamp}-{document["commit"]}.json')
+    with open(path, 'w') as handle:
+        json.dump(document, handle, indent=2)
+    return path
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    warm = arguments.pop(0) == '--warm'
+    arguments.pop(0)
+    repeat = int(arguments.pop(0))
+    _child(warm, arguments, repeat)
@@ -0,0 +1,160 @@
+"""Seeded generator for realistic sensor grids of a given size.
+
+The same seed and scale always produce the same grid, so timings from
+different commits are comparable. Rows are written with Core bulk
+inserts; on MySQL the schema.sql triggers maintain SensorLatest as they
+would in production, on SQLite it is rebuilt afterwards.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import latest
+from models import (db, User, SensorType, Location, Sensor, Reading, Technician,
+                    MaintenanceEvent, SensorStatusLog, DataVersion)
+
+SCALES = {
+    'small': 10 ** 4,
+    'medium': 10 ** 6,
+    'large': 10 ** 7,
+}
+
+READINGS_PER_SENSOR = 10000
+READING_INTERVAL = timedelta(minutes=5)
+INSERT_BATCH = 10000
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench-password'
+
+# name, description, baseline, daily swing, noise
+TYPES = (
+    ('Temperature', 'Measures ambient temperature in Celsius', 24.0, 6.0, 0.4),
+    ('Humidity', 'Measures relative humidity percentage', 60.0, 15.0, 2.0),
+    ('Pressure', 'Measures atmospheric pressure in hPa', 1012.0, 2.0, 0.3),
+    ('Wind Speed', 'Measures wind speed in km/h', 12.0, 5.0, 3.0),
+    ('Rainfall', 'Measures precipitation in mm', 0.5, 0.5, 0.5),
+    ('Solar Radiation', 'Measures solar radiation in W/m²', 400.0, 400.0, 40.0),
+)
+
+VERSIONED_TABLES = ('SensorType', 'Location', 'Sensor', 'Reading', 'Technician',
+                    'MaintenanceEvent', 'AlertRule', 'ReadingChunk', 'LocationShard')
+
+
+def plan(readings):
+    """Row counts for a grid holding ``readings`` readings"""
+    sensors = max(20, readings // READINGS_PER_SENSOR)
+    return {
+        'readings': readings,
+        'sensors': sensors,
+        'locations': max(6, int(math.sqrt(sensors) * 3)),
+        'technicians': max(3, sensors // 50),
+        'maintenance_events': sensors * 4,
+        'status_changes': sensors * 6,
+    }
+
+
+def existing_readings():
+    return db.session.query(func.count(Reading.reading_id)).scalar()
+
+
+def _insert(model, rows):
+    for offset in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(model.__table__.insert(), rows[offset:offset + INSERT_BATCH])
+
+
+def generate(readings, seed=42, now=None, echo=print):
+    """Populate the database with a grid of about ``readings`` readings; returns the plan"""
+    rnd = random.Random(seed)
+    now = (now or datetime.utcnow()).replace(microsecond=0) - timedelta(minutes=1)
+    counts = plan(readings)
+    db.create_all()
+
+    if User.query.filter_by(username=BENCH_USER).first() is None:
+        user = User(username=BENCH_USER, email='bench@example.com', full_name='Benchmark')
+        user.set_password(BENCH_PASSWORD)
+        db.session.add(user)
+    for name in VERSIONED_TABLES:
+        if db.session.get(DataVersion, name) is None:
+            db.session.add(DataVersion(name=name, version=0))
+
+    types = [SensorType(name=name, description=description) for name, description, *_ in TYPES]
+    locations = [Location(area_name=f'Grid Cell {i + 1}',
+                          latitude=round(12.85 + rnd.random() * 0.25, 6),
+                          longitude=round(77.45 + rnd.random() * 0.25, 6),
+                          elevation=round(880 + rnd.random() * 60, 2))
+                 for i in range(counts['locations'])]
+    technicians = [Technician(name=f'Technician {i + 1}', contact_no=f'98{rnd.randrange(10 ** 8):08d}',
+                              specialization=rnd.choice(('Calibration', 'Electronics', 'Field Service')))
+                   for i in range(counts['technicians'])]
+    db.session.add_all(types + locations + technicians)
+    db.session.commit()
+    echo(f'{len(types)} types, {len(locations)} locations, {len(technicians)} technicians')
+
+    per_sensor = readings // counts['sensors']
+    history = READING_INTERVAL * per_sensor
+    sensors = []
+    for i in range(counts['sensors']):
+        sensor_type = types[i % len(types)]
+        sensors.append({
+            'model': f'{sensor_type.name[:4].upper()}-{1000 + i}',
+            'install_date': (now - history - timedelta(days=rnd.randrange(1, 365))).date(),
+            'status': rnd.choices(('ACTIVE', 'INACTIVE', 'MAINTENANCE'), (90, 5, 5))[0],
+            'type_id': sensor_type.type_id,
+            'location_id': rnd.choice(locations).location_id,
+        })
+    _insert(Sensor, sensors)
+    db.session.commit()
+    sensor_rows = db.session.query(Sensor.sensor_id, Sensor.type_id, Sensor.install_date).order_by(
+        Sensor.sensor_id.desc()
+    ).limit(counts['sensors']).all()
+    echo(f'{len(sensor_rows)} sensors')
+
+    events = []
+    for _ in range(counts['maintenance_events']):
+        sensor = rnd.choice(sensor_rows)
+        events.append({
+            'sensor_id': sensor.sensor_id,
+            'tech_id': rnd.choice(technicians).tech_id,
+            'event_type': rnd.choices(('CALIBRATION', 'REPAIR', 'REPLACEMENT'), (70, 25, 5))[0],
+            'event_date': now - timedelta(minutes=rnd.randrange(int(history.total_seconds() // 60))),
+            'notes': 'Synthetic benchmark event',
+        })
+    _insert(MaintenanceEvent, events)
+
+    logs = []
+    for sensor in sensor_rows:
+        status = 'ACTIVE'
+        moments = sorted(now - timedelta(minutes=rnd.randrange(int(history.total_seconds() // 60)))
+                         for _ in range(counts['status_changes'] // counts['sensors']))
+        for moment in moments:
+            new_status = 'ACTIVE' if status != 'ACTIVE' else rnd.choice(('INACTIVE', 'MAINTENANCE'))
+            logs.append({'sensor_id': sensor.sensor_id, 'old_status': status,
+                         'new_status': new_status, 'change_timestamp': moment})
+            status = new_status
+    _insert(SensorStatusLog, logs)
+    db.session.commit()
+    echo(f'{len(events)} maintenance events, {len(logs)} status changes')
+
+    step = READING_INTERVAL.total_seconds()
+    written = 0
+    for sensor in sensor_rows:
+        _, _, baseline, swing, noise = TYPES[(sensor.type_id - types[0].type_id) % len(TYPES)]
+        offset = rnd.gauss(0, swing * 0.1)
+        rows = []
+        for n in range(per_sensor, 0, -1):
+            moment = now - timedelta(seconds=step * n)
+            daily = math.sin((moment.hour * 60 + moment.minute) / 1440 * 2 * math.pi - math.pi / 2)
+            value = max(baseline + offset + swing * daily + rnd.gauss(0, noise), 0.0)
+            rows.append({'sensor_id': sensor.sensor_id, 'reading_value': round(value, 4),
+                         'reading_timestamp': moment})
+        _insert(Reading, rows)
+        db.session.commit()
+        written += len(rows)
+        if written % (INSERT_BATCH * 10) < per_sensor:
+            echo(f'{written} readings')
+
+    latest.rebuild()
+    echo(f'{written} readings in total')
+    return counts
@@ -0,0 +1,402 @@
+"""Query-plan checks for the hot paths against a generated dataset.
+
+Every SELECT issued while the hot pages and exports are requested is
+captured and passed to ``EXPLAIN`` (``EXPLAIN QUERY PLAN`` on SQLite),
+as are the stored procedure bodies and views of schema.sql on MySQL.
+A plan fails the check when it reads a large table without an index
+(full scan) or sorts raw rows of one (filesort), unless the combination
+is listed in ``ACCEPTED`` with the reason it is inherent. Full index
+scans and temporary tables for grouping are reported but do not fail.
+
+The report also lists indexes made redundant by another index with the
+same leading columns, and suggests an index for each failing plan from
+the columns its statement filters and sorts on.
+"""
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from bench.runner import RESULTS_DIR, commit_id
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'schema.sql')
+
+# (path, endpoint, query arguments) requested, plus every GET /export/* route
+HOT_PATHS = (
+    ('index', 'index', lambda ctx: {}),
+    ('readings_list', 'readings_list', lambda ctx: {}),
+    ('readings_list:deep', 'readings_list', lambda ctx: {'page': 50}),
+    ('readings_list:sensor', 'readings_list', lambda ctx: {'sensor': ctx['sensor_id']}),
+    ('reports', 'reports', lambda ctx: {}),
+    ('sensors_list', 'sensors_list', lambda ctx: {}),
+    ('sensors_list:filtered', 'sensors_list', lambda ctx: {'status': 'ACTIVE', 'location': ctx['location_id']}),
+    ('maintenance_list', 'maintenance_list', lambda ctx: {}),
+    ('maintenance_list:filtered', 'maintenance_list', lambda ctx: {'tech': ctx['tech_id'], 'event_type': 'REPAIR'}),
+)
+
+# (path, table, issue) -> why the plan cannot do better
+ACCEPTED = {}
+
+FAILING = ('full scan', 'filesort')
+
+Step = namedtuple('Step', 'table access index')  # access: search, index scan or full scan
+Plan = namedtuple('Plan', 'steps filesort temporary lines')
+
+
+# =====================================================
+# CAPTURING STATEMENTS
+# =====================================================
+
+class StatementLog:
+    """SELECT statements (with parameters) sent while active, first occurrence of each.
+
+    Only statements of the creating thread are kept: the test client runs
+    requests there, while background jobs they queue run on other threads.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.statements = {}
+        self._engine = engine
+        self._thread = threading.get_ident()
+        event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() != self._thread:
+            return
+        if executemany or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return
+        self.statements.setdefault(fingerprint(statement), (statement, parameters))
+
+    def take(self):
+        statements, self.statements = self.statements, {}
+        return statements
+
+    def close(self):
+        from sqlalchemy import event
+        event.remove(self._engine, 'before_cursor_execute', self._record)
+
+
+def fingerprint(statement):
+    """Statement text with whitespace and IN-list lengths normalized"""
+    statement = ' '.join(statement.split())
+    return re.sub(r'\((?:\?|%s|%\(\w+\)s)(?:, (?:\?|%s|%\(\w+\)s))*\)', '(?)', statement)
+
+
+def hot_urls(app, ctx):
+    """(path, url) of the hot pages and every export"""
+    from flask import url_for
+
+    paths = list(HOT_PATHS)
+    paths += [(rule.endpoint, rule.endpoint, lambda ctx: {}) for rule in app.url_map.iter_rules()
+              if 'GET' in rule.methods and rule.rule.startswith('/export/') and not rule.arguments]
+    with app.test_request_context():
+        return [(path, url_for(endpoint, **args(ctx))) for path, endpoint, args in paths]
+
+
+def procedure_statements(schema, sample):
+    """(procedure name, statement) of each procedure body in schema.sql, parameters replaced by ``sample``"""
+    statements = []
+    for name, body in re.findall(r'CREATE PROCEDURE (\w+)\([^)]*\)\s*BEGIN(.*?)END//', schema, re.S):
+        for statement in body.split(';'):
+            statement = statement.strip()
+            if not statement:
+                continue
+            statement = re.sub(r'\bp_(\w+)\b', lambda m: str(sample.get(m.group(1), 1)), statement)
+            statements.append((name, statement))
+    return statements
+
+
+def view_names(schema):
+    return re.findall(r'CREATE VIEW (\w+) AS', schema)
+
+
+# =====================================================
+# READING PLANS
+# =====================================================
+
+def _aliases(statement):
+    """{alias or name: table} for the tables a statement reads"""
+    aliases = {}
+    for table, alias in re.findall(r'(?:FROM|JOIN)\s+[`"]?(\w+)[`"]?(?:\s+(?:AS\s+)?[`"]?(\w+)[`"]?)?',
+                                   statement, re.I):
+        aliases[table] = table
+        if alias and alias.upper() not in ('ON', 'WHERE', 'JOIN', 'LEFT', 'INNER', 'GROUP', 'ORDER',
+                                           'LIMIT', 'CROSS', 'RIGHT', 'OUTER', 'USING', 'UNION'):
+            aliases[alias] = table
+    return aliases
+
+
+def explain_mysql(connection, statement, parameters):
+    rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).mappings().all()
+    aliases = _aliases(statement)
+    steps, filesort, temporary, lines = [], False, False, []
+    for row in rows:
+        extra = row.get('Extra') or ''
+        filesort = filesort or 'Using filesort' in extra
+        temporary = temporary or 'Using temporary' in extra
+        access = {'ALL': 'full scan', 'index': 'index scan'}.get(row['type'], 'search')
+        if row['table'] in aliases:
+            steps.append(Step(aliases[row['table']], access, row['key']))
+        lines.append(f'{row["table"]}: type={row["type"]} key={row["key"]} rows={row["rows"]} {extra}'.rstrip())
+    return Plan(steps, filesort, temporary, lines)
+
+
+def explain_sqlite(connection, statement, parameters):
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    aliases = _aliases(statement)
+    steps, filesort, temporary, lines = [], False, False, []
+    for row in rows:
+        detail = row[-1]
+        lines.append(detail)
+        if detail.startswith('USE TEMP B-TREE FOR'):
+            if 'ORDER BY' in detail:
+                filesort = True
+            else:
+                temporary = True
+            continue
+        match = re.match(r'(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?(?: USING (?:COVERING |INTEGER PRIMARY KEY|PRIMARY KEY)?(?:INDEX (\w+))?)?', detail)
+        if not match:
+            continue
+        verb, name, alias, index = match.groups()
+        table = aliases.get(alias or name, aliases.get(name))
+        if table is None:
+            continue
+        if verb == 'SEARCH':
+            access = 'search'
+        else:
+            access = 'index scan' if 'INDEX' in detail else 'full scan'
+        steps.append(Step(table, access, index))
+    return Plan(steps, filesort, temporary, lines)
+
+
+def issues(plan, statement, sizes, min_rows):
+    """[(table, issue)] of a plan; sorting grouped rows is not counted as a filesort"""
+    found = []
+    large = [step for step in plan.steps if sizes.get(step.table, 0) >= min_rows]
+    for step in large:
+        if step.access in ('full scan', 'index scan'):
+            found.append((step.table, step.access))
+    if large:
+        grouped = re.search(r'\bGROUP BY\b|\bDISTINCT\b', statement, re.I)
+        if plan.filesort and not grouped:
+            found.append((large[0].table, 'filesort'))
+        if plan.temporary:
+            found.append((large[0].table, 'temporary'))
+    return list(dict.fromkeys(found))
+
+
+# =====================================================
+# INDEX ADVICE
+# =====================================================
+
+def table_indexes(inspector, table):
+    """[(name, columns, unique)] including the primary key"""
+    indexes = []
+    primary = inspector.get_pk_constraint(table).get('constrained_columns') or []
+    if primary:
+        indexes.append(('PRIMARY', tuple(primary), True))
+    for index in inspector.get_indexes(table):
+        indexes.append((index['name'], tuple(index['column_names']), bool(index.get('unique'))))
+    return indexes
+
+
+def redundant_indexes(inspector, tables):
+    """(table, index, covered by) for non-unique indexes whose columns lead another index"""
+    found = []
+    for table in tables:
+        indexes = table_indexes(inspector, table)
+        for name, columns, unique in indexes:
+            if unique:
+                continue
+            for other, other_columns, _ in indexes:
+                if other == name or other_columns[:len(columns)] != columns:
+                    continue
+                # Of two identical indexes, keep the first
+                if other_columns == columns and not _ranks_before(indexes, other, name):
+                    continue
+                found.append((table, name, other))
+                break
+    return found
+
+
+def _ranks_before(indexes, first, second):
+    names = [name for name, _, _ in indexes]
+    return names.index(first) < names.index(second)
+
+
+_PREDICATE = re.compile(
+    r'(?:[`"]?(\w+)[`"]?\.)?[`"]?(\w+)[`"]?\s*(=|\bIN\b|>=|<=|>|<|\bBETWEEN\b)', re.I)
+
+
+def suggest_index(statement, table, indexes):
+    """CREATE INDEX for ``table`` from the statement's equality, range and ORDER BY columns, or None"""
+    aliases = _aliases(statement)
+    single = len(set(aliases.values())) == 1
+    where = re.split(r'\bWHERE\b', statement, 1, re.I)
+    clause = re.split(r'\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b', where[1], 1, re.I)[0] if len(where) > 1 else ''
+
+    def owned(qualifier):
+        return aliases.get(qualifier) == table if qualifier else single
+
+    equality, ranged = [], []
+    for qualifier, column, operator in _PREDICATE.findall(clause):
+        if owned(qualifier) and not column.isdigit():
+            (equality if operator.upper() in ('=', 'IN') else ranged).append(column)
+    order = re.search(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|$)', statement, re.I | re.S)
+    ordered = []
+    if order:
+        for qualifier, column in re.findall(r'(?:[`"]?(\w+)[`"]?\.)?[`"]?(\w+)[`"]?(?:\s+(?:ASC|DESC))?\s*(?:,|$)',
+                                            order.group(1).strip(), re.I):
+            if owned(qualifier):
+                ordered.append(column)
+
+    columns = tuple(dict.fromkeys(equality + ranged[:1] + ordered))
+    if not columns:
+        return None
+    if any(existing[:len(columns)] == columns for _, existing, _ in indexes):
+        return None
+    return f'CREATE INDEX idx_{table.lower()}_{"_".join(columns)} ON {table}({", ".join(columns)});'
+
+
+# =====================================================
+# RUN
+# =====================================================
+
+def _check(connection, explain, path, statement, parameters, sizes, min_rows):
+    try:
+        plan = explain(connection, statement, parameters)
+    except Exception as e:
+        return {'path': path, 'sql': ' '.join(statement.split()),
+                'error': f'{type(e).__name__}: {str(e).splitlines()[0]}'}
+    found = issues(plan, statement, sizes, min_rows)
+    failing = [(table, issue) for table, issue in found
+               if issue in FAILING and (path.split(':')[0], table, issue) not in ACCEPTED]
+    return {
+        'path': path,
+        'sql': ' '.join(statement.split()),
+        'plan': plan.lines,
+        'issues': [f'{issue} of {table}' for table, issue in found],
+        'failing': [f'{issue} of {table}' for table, issue in failing],
+        '_failing': failing,
+    }
+
+
+def run(app, scale, min_rows=1000, echo=print):
+    """Explain every hot statement; returns the report document"""
+    from sqlalchemy import func, inspect, select, table as table_clause
+
+    from bench import dataset
+    from models import db, Sensor, Location, Technician
+
+    with app.app_context():
+        engine = db.engine
+        dialect = engine.dialect.name
+        inspector = inspect(engine)
+        tables = inspector.get_table_names()
+        with engine.connect() as connection:
+            sizes = {name: connection.execute(select(func.count()).select_from(table_clause(name))).scalar()
+                     for name in tables}
+        ctx = {
+            'sensor_id': db.session.query(Sensor.sensor_id).order_by(Sensor.sensor_id).first()[0],
+            'location_id': db.session.query(Location.location_id).order_by(Location.location_id).first()[0],
+            'tech_id': db.session.query(Technician.tech_id).order_by(Technician.tech_id).first()[0],
+        }
+        log = StatementLog(engine)
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': dataset.BENCH_USER, 'password': dataset.BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError('Could not log in as the benchmark user; generate the dataset first')
+
+    captured = []  # (path, statement, parameters)
+    seen = set()
+    try:
+        for path, url in hot_urls(app, ctx):
+            log.take()
+            response = client.get(url)
+            response.get_data()
+            response.close()
+            for key, (statement, parameters) in log.take().items():
+                if key not in seen:
+                    seen.add(key)
+                    captured.append((path, statement, parameters))
+    finally:
+        log.close()
+
+    explain = explain_mysql if dialect == 'mysql' else explain_sqlite
+    results = []
+    with app.app_context(), engine.connect() as connection:
+        for path, statement, parameters in captured:
+            results.append(_check(connection, explain, path, statement, parameters, sizes, min_rows))
+        if dialect == 'mysql':
+            with open(SCHEMA_PATH) as handle:
+                schema = handle.read()
+            sample = dict(ctx, limit=10)
+            for name, statement in procedure_statements(schema, sample):
+                results.append(_check(connection, explain, f'procedure:{name}', statement, (),
+                                      sizes, min_rows))
+            for name in view_names(schema):
+                results.append(_check(connection, explain, f'view:{name}', f'SELECT * FROM {name}', (),
+                                      sizes, min_rows))
+
+    indexes = {name: table_indexes(inspector, name) for name in tables}
+    suggestions = []
+    for result in results:
+        for table, _ in result.pop('_failing', []):
+            suggestion = suggest_index(result['sql'], table, indexes.get(table, []))
+            if suggestion and suggestion not in suggestions:
+                suggestions.append(suggestion)
+
+    return {
+        'commit': commit_id(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'scale': scale,
+        'database': dialect,
+        'min_rows': min_rows,
+        'tables': sizes,
+        'statements': results,
+        'redundant_indexes': [{'table': table, 'index': name, 'covered_by': other}
+                              for table, name, other in redundant_indexes(inspector, tables)],
+        'suggested_indexes': suggestions,
+    }
+
+
+def failures(document):
+    return [result for result in document['statements'] if result.get('failing') or result.get('error')]
+
+
+def format_report(document, verbose=False):
+    lines = []
+    for result in document['statements']:
+        failing = result.get('failing') or result.get('error')
+        if not (verbose or failing or result.get('issues')):
+            continue
+        status = 'FAIL' if failing else 'ok  '
+        lines.append(f'{status} {result["path"]:<28} {result["sql"][:100]}')
+        if result.get('error'):
+            lines.append(f'       error: {result["error"]}')
+            continue
+        for issue in result['issues']:
+            mark = '!' if issue in result['failing'] else '-'
+            lines.append(f'       {mark} {issue}')
+        if verbose or failing:
+            lines.extend(f'         {line}' for line in result['plan'])
+    for entry in document['redundant_indexes']:
+        lines.append(f'Redundant index {entry["table"]}.{entry["index"]} (leading columns of {entry["covered_by"]})')
+    for suggestion in document['suggested_indexes']:
+        lines.append(f'Suggested: {suggestion}')
+    checked = len(document['statements'])
+    lines.append(f'{checked} statements checked, {len(failures(document))} failing')
+    return '\n'.join(lines)
+
+
+def save(document, directory=RESULTS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = document['created_at'].replace(':', '').replace('-', '')
+    path = os.path.join(directory, f'plans-{document["scale"]}-{document["database"]}-{stamp}-{document["commit"]}.json')
+    with open(path, 'w') as handle:
+        json.dump(document, handle, indent=2, default=str)
+    return path
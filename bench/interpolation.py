@@ -0,0 +1,85 @@
+"""Time heatmap interpolation at full resolution for city-scale networks.
+
+No database is needed: each run scatters ``counts`` synthetic locations
+over a city-sized box and times ``heatmap.interpolate`` for every method
+twice, cold (no cached weights) and warm (new values at the same
+locations, as when a heatmap is polled). Kriging keeps no weights, so
+its two timings only differ by noise.
+"""
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import heatmap
+from bench.runner import RESULTS_DIR, commit_id
+
+COUNTS = (100, 1000, 5000)
+METHODS = ('idw', 'kriging')
+
+# A 30 x 30 km box around Bengaluru
+CENTER = (12.97, 77.59)
+SPAN = 0.27
+
+
+def _points(count, rnd):
+    return [{'latitude': CENTER[0] + (rnd.random() - 0.5) * SPAN,
+             'longitude': CENTER[1] + (rnd.random() - 0.5) * SPAN,
+             'value': 20 + rnd.random() * 10, 'sensors': 1 + rnd.randrange(3)} for _ in range(count)]
+
+
+def _time(points, resolution, method, options):
+    start = time.perf_counter()
+    heatmap.interpolate(points, resolution, method, **options)
+    return round(time.perf_counter() - start, 3)
+
+
+def run(resolution, counts, options, seed=42, echo=print):
+    """Cold and warm seconds per point count and method; returns the result document"""
+    rnd = random.Random(seed)
+    results = {}
+    for count in counts:
+        echo(f'Timing {count} points at {resolution}x{resolution}...')
+        points = _points(count, rnd)
+        for method in METHODS:
+            heatmap.clear_cache()
+            cold = _time(points, resolution, method, options)
+            for point in points:
+                point['value'] = 20 + rnd.random() * 10
+            warm = _time(points, resolution, method, options)
+            results.setdefault(str(count), {})[method] = {'cold_s': cold, 'warm_s': warm}
+    heatmap.clear_cache()
+
+    return {
+        'commit': commit_id(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'resolution': resolution,
+        'options': options,
+        'results': results,
+    }
+
+
+def format_report(document, budget):
+    lines = [f'{"points":>8}{"method":>10}{"cold":>10}{"warm":>10}']
+    for count, methods in document['results'].items():
+        for method, timing in methods.items():
+            over = budget and max(timing.values()) > budget
+            lines.append(f'{count:>8}{method:>10}{timing["cold_s"]:9.3f}s{timing["warm_s"]:9.3f}s'
+                         + ('  OVER BUDGET' if over else ''))
+    return '\n'.join(lines)
+
+
+def over_budget(document, budget):
+    """True when any raster took longer than ``budget`` seconds, cold or warm"""
+    return bool(budget) and any(max(timing.values()) > budget
+                                for methods in document['results'].values() for timing in methods.values())
+
+
+def save(document, directory=RESULTS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = document['created_at'].replace(':', '').replace('-', '')
+    path = os.path.join(directory, f'interpolation-{document["resolution"]}-{stamp}-{document["commit"]}.json')
+    with open(path, 'w') as handle:
+        json.dump(document, handle, indent=2)
+    return path
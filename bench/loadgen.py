@@ -0,0 +1,273 @@
+"""Sensor-grid traffic simulator for load testing ingest and polling.
+
+Simulates ``gateways`` field gateways, each posting one batch of readings
+for its share of the sensors every ``interval`` seconds, and
+``dashboards`` browser dashboards revalidating latest readings and
+sensor lists with ETags. Values follow each sensor type's daily pattern
+(temperature curve, humidity tracking it inversely, solar radiation in
+daylight, rainfall in bursts) on a virtual clock that ``clock_speed``
+can run faster than real time; timestamps sent are real, as the server
+rejects future readings.
+
+Everything runs on one asyncio loop with ``httpx``. Works against the
+Flask app or the async tier; both authenticate with an API token.
+"""
+import asyncio
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+LATENCY_FIELDS = ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')
+
+
+# =====================================================
+# VALUE MODELS
+# =====================================================
+
+class GridSimulator:
+    """Deterministic per-sensor value models keyed on the sensor type name"""
+
+    def __init__(self, sensors, seed=42, clock_speed=1.0):
+        self.rnd = random.Random(seed)
+        self.clock_speed = clock_speed
+        self.started = time.time()
+        self.offsets = {s['sensor_id']: self.rnd.gauss(0, 1) for s in sensors}
+        self.locations = {s['location_id']: self.rnd.gauss(0, 1) for s in sensors}
+        self.rain = {}   # location_id -> (raining, virtual time of last update)
+        self.wind = {}   # sensor_id -> last value
+
+    def virtual_hours(self, now):
+        """Virtual hours since the epoch; the clock runs ``clock_speed`` times real time"""
+        return (self.started + (now - self.started) * self.clock_speed) / 3600
+
+    def _temperature(self, location_id, hour):
+        # Coolest around 05:00, warmest around 14:00
+        daily = math.cos((hour - 14) / 24 * 2 * math.pi)
+        return 24 + 1.5 * self.locations.get(location_id, 0) + 6 * daily
+
+    def _raining(self, location_id, hours):
+        raining, updated = self.rain.get(location_id, (False, hours))
+        elapsed = max(hours - updated, 0)
+        # Dry spells average 8 hours, showers 40 minutes
+        mean = 0.67 if raining else 8.0
+        if self.rnd.random() < 1 - math.exp(-elapsed / mean):
+            raining = not raining
+        self.rain[location_id] = (raining, hours)
+        return raining
+
+    def value(self, sensor, now):
+        hours = self.virtual_hours(now)
+        hour = hours % 24
+        kind = (sensor.get('sensor_type') or '').lower()
+        offset = self.offsets.get(sensor['sensor_id'], 0)
+        location_id = sensor.get('location_id')
+        noise = self.rnd.gauss
+
+        if 'temp' in kind:
+            value = self._temperature(location_id, hour) + 0.3 * offset + noise(0, 0.3)
+        elif 'humid' in kind:
+            temperature = self._temperature(location_id, hour)
+            value = min(max(85 - 2.2 * (temperature - 18) + 2 * offset + noise(0, 1.5), 5), 100)
+        elif 'solar' in kind:
+            daylight = math.sin((hour - 6) / 12 * math.pi)
+            cloud = 0.4 if self._raining(location_id, hours) else 1.0
+            value = max(950 * daylight * cloud + noise(0, 20), 0) if 6 <= hour <= 18 else 0
+        elif 'rain' in kind:
+            value = self.rnd.lognormvariate(1, 0.8) if self._raining(location_id, hours) else 0
+        elif 'wind' in kind:
+            previous = self.wind.get(sensor['sensor_id'], 10 + 3 * offset)
+            gust = self.rnd.expovariate(1 / 8) if self.rnd.random() < 0.05 else 0
+            value = max(previous + 0.2 * (10 + 3 * offset - previous) + noise(0, 1), 0)
+            self.wind[sensor['sensor_id']] = value
+            value += gust
+        elif 'press' in kind:
+            value = 1012 + 1.2 * math.cos((hour - 10) / 12 * 2 * math.pi) + offset + noise(0, 0.2)
+        else:
+            value = 50 + 10 * offset + noise(0, 1)
+        return round(value, 4)
+
+
+# =====================================================
+# MEASUREMENT
+# =====================================================
+
+class Recorder:
+    """Latency samples and outcomes per operation"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.readings = 0
+
+    async def timed(self, name, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.latencies[name].append(time.perf_counter() - start)
+            self.errors[name] += 1
+            self.statuses[name][type(e).__name__] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - start)
+        self.statuses[name][response.status_code] += 1
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    def summary(self, elapsed):
+        operations = {}
+        for name, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            row = {
+                'requests': len(ordered),
+                'throughput_rps': round(len(ordered) / elapsed, 2),
+                'error_rate': round(self.errors[name] / len(ordered), 4),
+                'statuses': {str(k): v for k, v in self.statuses[name].items()},
+            }
+            for field, fraction in zip(LATENCY_FIELDS, (0.5, 0.9, 0.99, 1.0)):
+                row[field] = round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+            operations[name] = row
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'readings_ingested': self.readings,
+            'readings_per_s': round(self.readings / elapsed, 2),
+            'operations': operations,
+        }
+
+
+# =====================================================
+# CLIENTS
+# =====================================================
+
+async def _gateway(client, sensors, simulator, interval, deadline, recorder, rnd):
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(rnd.uniform(0, interval))
+    next_at = loop.time()
+    while loop.time() < deadline:
+        now = time.time()
+        stamp = (datetime.utcfromtimestamp(now) - timedelta(seconds=1)).replace(microsecond=0).isoformat()
+        readings = [{'sensor_id': s['sensor_id'], 'reading_value': simulator.value(s, now),
+                     'reading_timestamp': stamp} for s in sensors]
+        response = await recorder.timed('ingest', client.post('/api/readings', json={'readings': readings}))
+        if response is not None and response.status_code == 201:
+            recorder.readings += len(readings)
+        # Fixed schedule: a slow server makes gateways fall behind, not slow down
+        next_at += interval
+        await asyncio.sleep(max(next_at - loop.time(), 0))
+
+
+async def _dashboard(client, sensors, poll_interval, deadline, recorder, rnd, watch=6):
+    loop = asyncio.get_running_loop()
+    watched = rnd.sample(sensors, min(watch, len(sensors)))
+    ids = ','.join(str(s['sensor_id']) for s in watched)
+    etags = {}
+    cycle = 0
+    await asyncio.sleep(rnd.uniform(0, poll_interval))
+    while loop.time() < deadline:
+        for sensor in watched:
+            url = f'/api/sensors/{sensor["sensor_id"]}/latest-reading'
+            headers = {'If-None-Match': etags[url]} if url in etags else {}
+            response = await recorder.timed('latest', client.get(url, headers=headers))
+            if response is not None and response.headers.get('ETag'):
+                etags[url] = response.headers['ETag']
+        if cycle % 5 == 0:
+            await recorder.timed('sensors', client.get('/api/sensors', params={
+                'ids': ids, 'fields': 'sensor_id,model,status,location_name'
+            }))
+        cycle += 1
+        await asyncio.sleep(poll_interval * rnd.uniform(0.8, 1.2))
+
+
+async def fetch_sensors(client):
+    sensors, page, pages = [], 1, 1
+    while page <= pages:
+        response = await client.get('/api/sensors', params={
+            'status': 'ACTIVE', 'fields': 'sensor_id,type_id,sensor_type,location_id',
+            'page': page, 'per_page': 1000
+        })
+        response.raise_for_status()
+        body = response.json()
+        sensors.extend(body['sensors'])
+        pages = body['pages']
+        page += 1
+    return sensors
+
+
+async def run(base_url, token, gateways=10, interval=10.0, dashboards=5, poll_interval=2.0,
+              duration=60.0, seed=42, clock_speed=1.0, max_connections=100, timeout=30.0):
+    """Drive the target for ``duration`` seconds; returns the measured summary"""
+    if httpx is None:
+        raise RuntimeError('The load generator needs httpx: pip install ".[bench]"')
+    rnd = random.Random(seed)
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    async with httpx.AsyncClient(base_url=base_url, headers={'Authorization': f'Bearer {token}'},
+                                 limits=limits, timeout=timeout) as client:
+        sensors = await fetch_sensors(client)
+        if not sensors:
+            raise RuntimeError('The target has no active sensors to simulate')
+        simulator = GridSimulator(sensors, seed, clock_speed)
+        shares = [sensors[i::gateways] for i in range(gateways) if sensors[i::gateways]]
+
+        recorder = Recorder()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + duration
+        tasks = [_gateway(client, share, simulator, interval, deadline, recorder, random.Random(rnd.random()))
+                 for share in shares]
+        tasks += [_dashboard(client, sensors, poll_interval, deadline, recorder, random.Random(rnd.random()))
+                  for _ in range(dashboards)]
+        await asyncio.gather(*tasks)
+        summary = recorder.summary(loop.time() - started)
+
+    summary['config'] = {
+        'base_url': base_url, 'gateways': len(shares), 'sensors': len(sensors), 'interval_s': interval,
+        'dashboards': dashboards, 'poll_interval_s': poll_interval, 'clock_speed': clock_speed,
+        'offered_ingest_rps': round(len(shares) / interval, 2),
+    }
+    return summary
+
+
+def ramp(steps, gateways, max_error_rate=0.01, max_p99_ms=1000.0, echo=print, **options):
+    """Double the gateway count each step until errors or ingest p99 exceed the limits.
+
+    Returns the per-step summaries; the last one is the first that broke
+    the limits, if any did.
+    """
+    results = []
+    for step in range(steps):
+        count = gateways * 2 ** step
+        summary = asyncio.run(run(gateways=count, **options))
+        results.append(summary)
+        ingest = summary['operations'].get('ingest', {})
+        echo(format_step(summary))
+        if ingest.get('error_rate', 0) > max_error_rate or ingest.get('p99_ms', 0) > max_p99_ms:
+            echo(f'Limit reached at {count} gateways')
+            break
+    return results
+
+
+def format_step(summary):
+    config = summary['config']
+    ingest = summary['operations'].get('ingest', {})
+    return (f'{config["gateways"]:>5} gateways  offered {config["offered_ingest_rps"]:>8.2f} rps  '
+            f'achieved {ingest.get("throughput_rps", 0):>8.2f} rps  '
+            f'{summary["readings_per_s"]:>9.1f} readings/s  '
+            f'errors {ingest.get("error_rate", 0):6.2%}  p99 {ingest.get("p99_ms", 0):>8.1f} ms')
+
+
+def format_summary(summary):
+    lines = [format_step(summary), '']
+    lines.append(f'{"operation":<10}{"requests":>9}{"rps":>9}{"errors":>8}' +
+                 ''.join(f'{field:>10}' for field in LATENCY_FIELDS))
+    for name, row in summary['operations'].items():
+        lines.append(f'{name:<10}{row["requests"]:>9}{row["throughput_rps"]:>9.1f}{row["error_rate"]:>8.2%}' +
+                     ''.join(f'{row[field]:>10.1f}' for field in LATENCY_FIELDS))
+    return '\n'.join(lines)
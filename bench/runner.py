@@ -0,0 +1,207 @@
+"""Time every page, export and JSON API against a generated dataset.
+
+Each endpoint is requested once cold (server-side caches empty), then
+``repeat`` times warm. For every endpoint the run records cold, p50 and
+p99 latency, SQL statements per request, peak Python memory of one
+request (tracemalloc) and response size. Results are written as JSON
+named after the commit so runs can be compared with ``bench compare``.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Pages timed alongside every GET /api/* and /export/* route
+PAGES = ('index', 'reports', 'readings_list', 'sensor_readings', 'sensors_list', 'maintenance_list')
+
+# Routes that need specific query arguments, by endpoint name
+QUERY_ARGS = {
+    'readings_list': lambda ctx: {'page': 50},
+    'sensor_readings': lambda ctx: {'days': 30},
+    'api_sensor_readings': lambda ctx: {'days': 30, 'limit': 500},
+    'api_heatmap': lambda ctx: {'type_id': ctx['type_id'], 'hours': 24},
+    'api_status_at': lambda ctx: {'at': (datetime.utcnow() - timedelta(days=3)).strftime('%Y-%m-%dT%H:%M')},
+}
+
+# Routes that cannot be timed meaningfully without prior state
+SKIP = {'api_job_status'}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of ``samples``"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def commit_id():
+    """Short hash of HEAD, suffixed with ``-dirty`` when the tree has changes"""
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{head}-dirty' if dirty else head
+
+
+def endpoints(app, ctx, only=None):
+    """(name, url) pairs to time: the listed pages plus every GET API and export route"""
+    from flask import url_for
+
+    names = list(PAGES)
+    for rule in app.url_map.iter_rules():
+        if 'GET' in rule.methods and rule.rule.startswith(('/api/', '/export/')):
+            names.append(rule.endpoint)
+
+    urls = []
+    with app.test_request_context():
+        for name in dict.fromkeys(names):
+            if name in SKIP or (only and not any(part in name for part in only)):
+                continue
+            rule = next(app.url_map.iter_rules(name))
+            args = {arg: ctx['sensor_id'] for arg in rule.arguments if arg == 'sensor_id'}
+            if len(args) != len(rule.arguments):
+                continue
+            args.update(QUERY_ARGS.get(name, lambda ctx: {})(ctx))
+            urls.append((name, url_for(name, **args)))
+    return urls
+
+
+class QueryCounter:
+    """Counts statements sent to the database while active"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._hit)
+
+    def _hit(self, *args):
+        self.count += 1
+
+
+def _request(client, url):
+    response = client.get(url)
+    body = response.get_data()
+    response.close()
+    return response.status_code, len(body)
+
+
+def _clear_caches():
+    import compress
+    import heatmap
+    compress.artifacts.clear()
+    heatmap.clear_cache()
+
+
+def time_endpoint(client, counter, url, repeat):
+    _clear_caches()
+    start = time.perf_counter()
+    status, size = _request(client, url)
+    cold = time.perf_counter() - start
+
+    samples = []
+    queries = counter.count
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _request(client, url)
+        samples.append(time.perf_counter() - start)
+    queries = (counter.count - queries) / repeat if repeat else 0
+
+    tracemalloc.start()
+    _request(client, url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'url': url,
+        'status': status,
+        'bytes': size,
+        'cold_ms': round(cold * 1000, 3),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3) if samples else None,
+        'queries': round(queries, 1),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(app, scale, readings, repeat=20, only=None, echo=print):
+    """Time all endpoints; returns the result document"""
+    from bench import dataset
+    from models import db, Sensor, SensorType
+
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        ctx = {
+            'sensor_id': db.session.query(Sensor.sensor_id).order_by(Sensor.sensor_id).first()[0],
+            'type_id': db.session.query(SensorType.type_id).order_by(SensorType.type_id).first()[0],
+        }
+        engine = db.engine.dialect.name
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': dataset.BENCH_USER, 'password': dataset.BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError('Could not log in as the benchmark user; generate the dataset first')
+
+    results = {}
+    for name, url in endpoints(app, ctx, only):
+        try:
+            results[name] = time_endpoint(client, counter, url, repeat)
+        except Exception as e:
+            results[name] = {'url': url, 'error': f'{type(e).__name__}: {str(e).splitlines()[0]}'}
+            echo(f'{name:<32} ERROR {results[name]["error"]}')
+            continue
+        r = results[name]
+        echo(f'{name:<32} {r["status"]}  p50 {r["p50_ms"]:>9.2f} ms  p99 {r["p99_ms"]:>9.2f} ms  '
+             f'{r["queries"]:>6} q  {r["peak_kb"]:>9.1f} KB')
+
+    return {
+        'commit': commit_id(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'scale': scale,
+        'readings': readings,
+        'repeat': repeat,
+        'database': engine,
+        'python': platform.python_version(),
+        'endpoints': results,
+    }
+
+
+def save(document, directory=RESULTS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = document['created_at'].replace(':', '').replace('-', '')
+    path = os.path.join(directory, f'{document["scale"]}-{document["database"]}-{stamp}-{document["commit"]}.json')
+    with open(path, 'w') as handle:
+        json.dump(document, handle, indent=2)
+    return path
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def compare(baseline, current, metric='p50_ms', threshold=0.2, min_delta=1.0):
+    """Rows of (endpoint, before, after, change) and the endpoints that regressed.
+
+    An endpoint regresses when ``metric`` grows by more than ``threshold``
+    (a fraction) and by at least ``min_delta`` (in the metric's unit, so
+    sub-millisecond jitter is ignored), or when its query count grows.
+    """
+    rows, regressions = [], []
+    for name, after in current['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if not before or 'error' in before or 'error' in after:
+            rows.append((name, before and before.get(metric), after.get(metric), None))
+            continue
+        change = (after[metric] - before[metric]) / before[metric] if before[metric] else None
+        rows.append((name, before[metric], after[metric], change))
+        if ((change is not None and change > threshold and after[metric] - before[metric] >= min_delta)
+                or after['queries'] > before['queries']):
+            regressions.append(name)
+    return rows, regressions
@@ -0,0 +1,240 @@
+"""Versioned in-process caches shared across workers via the DataVersion table"""
+import hashlib
+import threading
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+
+from flask import g, request, make_response
+from sqlalchemy import select, update
+
+import metrics
+from models import db, DataVersion, SensorType, Location, Sensor, Technician
+
+# Lightweight, immutable stand-ins for ORM rows. They are safe to share
+# between threads and requests, and expose the attributes templates use.
+TypeRef = namedtuple('TypeRef', 'type_id name description')
+LocationRef = namedtuple('LocationRef', 'location_id area_name latitude longitude elevation')
+TechnicianRef = namedtuple('TechnicianRef', 'tech_id name contact_no specialization')
+SensorRef = namedtuple('SensorRef', 'sensor_id model status type_id location_id sensor_type location')
+
+
+# =====================================================
+# DATA VERSIONS
+# =====================================================
+
+STAMPS_QUERY = select(DataVersion.name, DataVersion.version, DataVersion.updated_at)
+
+
+def version_stamps():
+    """Return {table name: (version, updated_at)}, read at most once per request"""
+    stamps = g.get('_data_versions')
+    if stamps is None:
+        rows = db.session.execute(STAMPS_QUERY).all()
+        stamps = {name: (version, updated_at) for name, version, updated_at in rows}
+        g._data_versions = stamps
+    return stamps
+
+
+def current_versions():
+    """Return {table name: version}"""
+    return {name: stamp[0] for name, stamp in version_stamps().items()}
+
+
+def bump_statement(name):
+    return update(DataVersion).where(DataVersion.name == name).values(
+        version=DataVersion.version + 1,
+        updated_at=datetime.utcnow()
+    )
+
+
+def bump_version(*names):
+    """Increment the version of each table; call before the write is committed"""
+    for name in names:
+        if not db.session.execute(bump_statement(name)).rowcount:
+            db.session.add(DataVersion(name=name, version=1))
+    g.pop('_data_versions', None)
+
+
+# =====================================================
+# REFERENCE CACHE
+# =====================================================
+
+class ReferenceCache:
+    """Small lookup lists cached per process until their tables change.
+
+    Each entry records the versions of the tables it was built from; a
+    read compares them against ``current_versions()`` and reloads only
+    when another request (in any worker) has bumped one of them.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def loader(self, name, *tables):
+        """Decorator registering ``func`` as the loader for ``name``"""
+        def decorator(func):
+            self._loaders[name] = (tables, func)
+            return func
+        return decorator
+
+    def get(self, name):
+        tables, func = self._loaders[name]
+        versions = current_versions()
+        stamp = tuple(versions.get(table, 0) for table in tables)
+
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == stamp:
+            metrics.cache_result('reference', True)
+            return entry[1]
+
+        metrics.cache_result('reference', False)
+        value = func()
+        with self._lock:
+            self._entries[name] = (stamp, value)
+        return value
+
+    def prime(self):
+        """Load every registered entry that is missing or stale; returns their names"""
+        for name in self._loaders:
+            self.get(name)
+        return list(self._loaders)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+reference_cache = ReferenceCache()
+
+
+@reference_cache.loader('sensor_types', 'SensorType')
+def _load_sensor_types():
+    rows = db.session.query(
+        SensorType.type_id, SensorType.name, SensorType.description
+    ).order_by(SensorType.name).all()
+    return tuple(TypeRef(*row) for row in rows)
+
+
+@reference_cache.loader('locations', 'Location')
+def _load_locations():
+    rows = db.session.query(
+        Location.location_id, Location.area_name,
+        Location.latitude, Location.longitude, Location.elevation
+    ).order_by(Location.area_name).all()
+    return tuple(LocationRef(*row) for row in rows)
+
+
+@reference_cache.loader('technicians', 'Technician')
+def _load_technicians():
+    rows = db.session.query(
+        Technician.tech_id, Technician.name, Technician.contact_no, Technician.specialization
+    ).order_by(Technician.name).all()
+    return tuple(TechnicianRef(*row) for row in rows)
+
+
+@reference_cache.loader('sensors', 'Sensor', 'SensorType', 'Location')
+def _load_sensors():
+    types = {t.type_id: t for t in reference_cache.get('sensor_types')}
+    locations = {loc.location_id: loc for loc in reference_cache.get('locations')}
+    rows = db.session.query(
+        Sensor.sensor_id, Sensor.model, Sensor.status, Sensor.type_id, Sensor.location_id
+    ).order_by(Sensor.model).all()
+    return tuple(
+        SensorRef(*row, types.get(row.type_id), locations.get(row.location_id))
+        for row in rows
+    )
+
+
+def sensor_types():
+    """All sensor types ordered by name"""
+    return reference_cache.get('sensor_types')
+
+
+def locations():
+    """All locations ordered by area name"""
+    return reference_cache.get('locations')
+
+
+def technicians():
+    """All technicians ordered by name"""
+    return reference_cache.get('technicians')
+
+
+def sensors(status=None):
+    """All sensors ordered by model, optionally restricted to one status"""
+    rows = reference_cache.get('sensors')
+    if status is not None:
+        rows = tuple(s for s in rows if s.status == status)
+    return rows
+
+
+# =====================================================
+# HTTP CONDITIONAL REQUESTS
+# =====================================================
+
+def validators(full_path, stamps, tables, key_result=None):
+    """Return (etag, last_modified) for a resource built from ``tables``"""
+    parts = [full_path]
+    modified = [stamps[t][1] for t in tables if t in stamps and stamps[t][1]]
+    parts.extend(f'{t}:{stamps.get(t, (0, None))[0]}' for t in tables)
+    if key_result is not None:
+        token, timestamp = key_result
+        parts.append(str(token))
+        if timestamp is not None:
+            modified.append(timestamp)
+    etag = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+    last_modified = max(modified).replace(microsecond=0) if modified else None
+    return etag, last_modified
+
+
+def is_not_modified(if_none_match, if_modified_since, etag, last_modified):
+    """Evaluate revalidation headers against the current validators.
+
+    Compressed variants carry the same ETag marked weak, so the weak
+    comparison is used. If-None-Match takes precedence over
+    If-Modified-Since (RFC 9110).
+    """
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    return bool(if_modified_since and last_modified and
+                last_modified <= if_modified_since.replace(tzinfo=None))
+
+
+def conditional(*tables, key=None, dated=True):
+    """Serve ETag/Last-Modified from data versions and answer revalidations with 304.
+
+    The ETag covers the request path and query plus the versions of
+    ``tables``. ``key``, if given, is called with the view arguments and
+    returns ``(token, timestamp)`` for finer-grained state such as one
+    sensor's latest reading. Both are checked before the view runs, so
+    an unchanged resource costs only the version lookup.
+
+    Pass ``dated=False`` when changes the ETag sees have no timestamp
+    (a key returning ``(token, None)`` for writes that don't bump a
+    version): Last-Modified is then neither sent nor honoured, since
+    If-Modified-Since would answer 304 for changed content.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key_result = key(*args, **kwargs) if key is not None else None
+            etag, last_modified = validators(request.full_path, version_stamps(), tables, key_result)
+            if not dated:
+                last_modified = None
+            g.etag = etag
+
+            not_modified = is_not_modified(request.if_none_match, request.if_modified_since,
+                                           etag, last_modified)
+            metrics.cache_result('http_conditional', not_modified)
+            response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
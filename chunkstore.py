@@ -0,0 +1,512 @@
+"""Compressed per-sensor chunk storage for historical readings.
+
+Readings older than the compaction horizon are moved out of ``Reading``
+into ``ReadingChunk`` rows, one per sensor per ``CHUNK_HOURS`` window.
+Each chunk holds three blobs in the style of Facebook's Gorilla TSDB:
+
+* timestamps as delta-of-delta codes (regular sampling costs ~1 bit each);
+* values XOR-encoded against the previous value. Values are encoded as
+  the double of ``value * 10**4`` (the column's scale), an exact integer,
+  so repeated and slowly changing values leave long runs of zero bits;
+* reading ids as zig-zag varint deltas, so cursors and exports keep them.
+
+Timestamps are stored with one second resolution, as MySQL DATETIME does.
+Readers call ``window_rows``/``window_stats`` (series), ``export_rows``
+and ``totals`` (reports); each is a no-op unless ``index`` says chunks
+exist in the requested range, so uncompacted deployments pay nothing.
+"""
+import heapq
+import struct
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import delete, func, select
+
+import cache
+from models import ReadingChunk, Reading, SensorLatest, DataVersion
+
+SCALE = 10 ** 4
+EPOCH = datetime(1970, 1, 1)
+
+ChunkRow = namedtuple('ChunkRow', 'reading_id reading_value reading_timestamp')
+
+
+def _seconds(moment):
+    return int((moment - EPOCH).total_seconds())
+
+
+def _moment(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+# =====================================================
+# BIT STREAMS
+# =====================================================
+
+class BitWriter:
+    """Append-only bit stream, most significant bit first"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, width):
+        self._acc = (self._acc << width) | (value & ((1 << width) - 1))
+        self._bits += width
+        while self._bits >= 8:
+            self._bits -= 8
+            self.data.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self):
+        if self._bits:
+            return bytes(self.data) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self.data)
+
+
+class BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, width):
+        first, offset = divmod(self.pos, 8)
+        last = (self.pos + width + 7) // 8
+        chunk = int.from_bytes(self.data[first:last], 'big')
+        self.pos += width
+        return (chunk >> ((last - first) * 8 - offset - width)) & ((1 << width) - 1)
+
+    def bit(self):
+        byte, offset = divmod(self.pos, 8)
+        self.pos += 1
+        return (self.data[byte] >> (7 - offset)) & 1
+
+
+def _signed(value, width):
+    return value - (1 << width) if value >= 1 << (width - 1) else value
+
+
+# =====================================================
+# CODECS
+# =====================================================
+
+# Delta-of-delta buckets: (prefix, prefix width, value width)
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+def encode_timestamps(seconds):
+    """Delta-of-delta encode ascending integer timestamps"""
+    out = BitWriter()
+    if not seconds:
+        return out.getvalue()
+    out.write(seconds[0], 64)
+    previous_delta = 0
+    for index in range(1, len(seconds)):
+        delta = seconds[index] - seconds[index - 1]
+        dod = delta - previous_delta
+        previous_delta = delta
+        if dod == 0:
+            out.write(0, 1)
+            continue
+        for prefix, prefix_width, width in _DOD_BUCKETS:
+            if -(1 << (width - 1)) <= dod < (1 << (width - 1)):
+                out.write(prefix, prefix_width)
+                out.write(dod, width)
+                break
+        else:
+            out.write(0b1111, 4)
+            out.write(dod, 32)
+    return out.getvalue()
+
+
+def decode_timestamps(data, count):
+    if not count:
+        return []
+    reader = BitReader(data)
+    seconds = [reader.read(64)]
+    delta = 0
+    for _ in range(count - 1):
+        if reader.bit():
+            if not reader.bit():
+                width = 7
+            elif not reader.bit():
+                width = 9
+            elif not reader.bit():
+                width = 12
+            else:
+                width = 32
+            delta += _signed(reader.read(width), width)
+        seconds.append(seconds[-1] + delta)
+    return seconds
+
+
+def _float_bits(value):
+    return struct.unpack('>Q', struct.pack('>d', value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack('>d', bits.to_bytes(8, 'big'))[0]
+
+
+def encode_values(values):
+    """XOR-encode floats against their predecessor (Gorilla value compression)"""
+    out = BitWriter()
+    if not values:
+        return out.getvalue()
+    previous = _float_bits(values[0])
+    out.write(previous, 64)
+    leading, trailing = -1, 0
+    for value in values[1:]:
+        current = _float_bits(value)
+        xor = current ^ previous
+        previous = current
+        if xor == 0:
+            out.write(0, 1)
+            continue
+        out.write(1, 1)
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        if leading >= 0 and new_leading >= leading and new_trailing >= trailing:
+            out.write(0, 1)
+            out.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            significant = 64 - leading - trailing
+            out.write(1, 1)
+            out.write(leading, 5)
+            out.write(significant & 63, 6)
+            out.write(xor >> trailing, significant)
+    return out.getvalue()
+
+
+def decode_values(data, count):
+    if not count:
+        return []
+    reader = BitReader(data)
+    previous = reader.read(64)
+    values = [_bits_float(previous)]
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if reader.bit():
+            if reader.bit():
+                leading = reader.read(5)
+                trailing = 64 - leading - (reader.read(6) or 64)
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        values.append(_bits_float(previous))
+    return values
+
+
+def encode_ids(ids):
+    """Zig-zag varint deltas of reading ids"""
+    out = bytearray()
+    previous = 0
+    for reading_id in ids:
+        delta = reading_id - previous
+        previous = reading_id
+        value = (delta << 1) ^ (delta >> 63)
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_ids(data, count):
+    ids = []
+    previous = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += (value >> 1) ^ -(value & 1)
+        ids.append(previous)
+        value = shift = 0
+    return ids[:count]
+
+
+# =====================================================
+# CHUNKS
+# =====================================================
+
+def chunk_start(moment, chunk_hours):
+    """Start of the aligned ``chunk_hours`` window containing ``moment``"""
+    span = chunk_hours * 3600
+    return _moment(_seconds(moment) // span * span)
+
+
+def build_chunk(sensor_id, start, rows):
+    """Column values of a ReadingChunk for (reading_id, value, timestamp) rows"""
+    rows = sorted(((_seconds(ts), reading_id, int(round(Decimal(value) * SCALE)))
+                   for reading_id, value, ts in rows))
+    scaled = [row[2] for row in rows]
+    return {
+        'sensor_id': sensor_id,
+        'chunk_start': start,
+        'first_timestamp': _moment(rows[0][0]),
+        'last_timestamp': _moment(rows[-1][0]),
+        'reading_count': len(rows),
+        'min_value': Decimal(min(scaled)) / SCALE,
+        'max_value': Decimal(max(scaled)) / SCALE,
+        'value_sum': Decimal(sum(scaled)) / SCALE,
+        'timestamp_data': encode_timestamps([row[0] for row in rows]),
+        'value_data': encode_values([float(value) for value in scaled]),
+        'id_data': encode_ids([row[1] for row in rows]),
+    }
+
+
+def _decode_raw(chunk):
+    """(seconds, reading_id, value * SCALE) tuples of a chunk, oldest first"""
+    count = chunk.reading_count
+    return list(zip(decode_timestamps(chunk.timestamp_data, count),
+                    decode_ids(chunk.id_data, count),
+                    (int(value) for value in decode_values(chunk.value_data, count))))
+
+
+def _decimal(scaled):
+    return Decimal(scaled).scaleb(-4)
+
+
+def decode_chunk(chunk):
+    """ChunkRow list for a ReadingChunk, oldest first; values are Decimals like Reading's"""
+    return [ChunkRow(reading_id, _decimal(scaled), _moment(seconds))
+            for seconds, reading_id, scaled in _decode_raw(chunk)]
+
+
+# =====================================================
+# CHUNK INDEX
+# =====================================================
+
+class ChunkIndex:
+    """Per-sensor (first, last) compacted timestamp, reloaded when compaction runs.
+
+    Lets readers skip the ReadingChunk table entirely for windows that
+    hold no compacted data, which is every recent window.
+    """
+
+    def __init__(self):
+        self.spans = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def refresh(self, session, current_versions=None):
+        if current_versions is None:
+            version = session.execute(
+                select(DataVersion.version).where(DataVersion.name == 'ReadingChunk')
+            ).scalar() or 0
+        else:
+            version = current_versions.get('ReadingChunk', 0)
+        if version == self._version:
+            return self
+        spans = {row[0]: (row[1], row[2]) for row in session.execute(
+            select(ReadingChunk.sensor_id, func.min(ReadingChunk.first_timestamp),
+                   func.max(ReadingChunk.last_timestamp))
+            .group_by(ReadingChunk.sensor_id)
+        ).all()}
+        with self._lock:
+            self.spans = spans
+            self._version = version
+        return self
+
+    def overlaps(self, sensor_id, start, end):
+        span = self.spans.get(sensor_id)
+        return span is not None and span[0] <= end and span[1] >= start
+
+    def __bool__(self):
+        return bool(self.spans)
+
+
+index = ChunkIndex()
+
+
+def _window_chunks(session, sensor_id, start, end):
+    return session.execute(
+        select(ReadingChunk).where(
+            ReadingChunk.sensor_id == sensor_id,
+            ReadingChunk.first_timestamp <= end,
+            ReadingChunk.last_timestamp >= start
+        ).order_by(ReadingChunk.first_timestamp)
+    ).scalars()
+
+
+def window_rows(session, sensor_id, start, end, cursor=None, limit=None, current_versions=None):
+    """Up to ``limit`` compacted readings in [start, end] before ``cursor``, newest first.
+
+    Chunks are decoded newest first and only until ``limit`` rows are
+    certain, so a page costs one or two chunk decodes however wide the
+    window is.
+    """
+    if not index.refresh(session, current_versions).overlaps(sensor_id, start, end):
+        return []
+    upper = min(end, cursor[0]) if cursor is not None else end
+    spans = session.execute(
+        select(ReadingChunk.chunk_start, ReadingChunk.last_timestamp).where(
+            ReadingChunk.sensor_id == sensor_id,
+            ReadingChunk.first_timestamp <= upper,
+            ReadingChunk.last_timestamp >= start
+        ).order_by(ReadingChunk.last_timestamp.desc())
+    ).all()
+
+    rows = []
+    for chunk_start_at, last_timestamp in spans:
+        if limit is not None and len(rows) >= limit and last_timestamp < rows[limit - 1].reading_timestamp:
+            break
+        chunk = session.get(ReadingChunk, (sensor_id, chunk_start_at))
+        rows.extend(row for row in decode_chunk(chunk)
+                    if start <= row.reading_timestamp <= end
+                    and (cursor is None or (row.reading_timestamp, row.reading_id) < cursor))
+        rows.sort(key=lambda row: (row.reading_timestamp, row.reading_id), reverse=True)
+    return rows[:limit] if limit is not None else rows
+
+
+def window_stats(session, sensor_id, start, end, current_versions=None):
+    """(count, min, max, sum, first, last) of compacted readings in [start, end], or None.
+
+    Chunks wholly inside the window are answered from their stored
+    aggregates; only the (at most two) boundary chunks are decoded.
+    """
+    if not index.refresh(session, current_versions).overlaps(sensor_id, start, end):
+        return None
+    count, low, high, total, first, last = 0, None, None, 0.0, None, None
+    for chunk in _window_chunks(session, sensor_id, start, end):
+        if chunk.first_timestamp >= start and chunk.last_timestamp <= end:
+            part = (chunk.reading_count, float(chunk.min_value), float(chunk.max_value),
+                    float(chunk.value_sum), chunk.first_timestamp, chunk.last_timestamp)
+        else:
+            rows = [row for row in decode_chunk(chunk) if start <= row.reading_timestamp <= end]
+            if not rows:
+                continue
+            values = [row.reading_value for row in rows]
+            part = (len(rows), float(min(values)), float(max(values)), float(sum(values)),
+                    rows[0].reading_timestamp, rows[-1].reading_timestamp)
+        count += part[0]
+        low = part[1] if low is None else min(low, part[1])
+        high = part[2] if high is None else max(high, part[2])
+        total += part[3]
+        first = first or part[4]
+        last = part[5]
+    return (count, low, high, total, first, last) if count else None
+
+
+def export_rows(session, batch=500):
+    """(reading_id, sensor_id, value, timestamp) of every compacted reading, newest first.
+
+    Chunks are visited by descending end time and decoded one at a time;
+    a decoded row is emitted once no unvisited chunk can hold a newer one.
+    """
+    if not index.refresh(session):
+        return
+    pending = []
+    chunks = session.execute(
+        select(ReadingChunk).order_by(ReadingChunk.last_timestamp.desc()).execution_options(yield_per=batch)
+    ).scalars()
+    for chunk in chunks:
+        horizon = _seconds(chunk.last_timestamp)
+        while pending and -pending[0][0] > horizon:
+            yield _pop(pending)
+        for seconds, reading_id, value in _decode_raw(chunk):
+            heapq.heappush(pending, (-seconds, -reading_id, chunk.sensor_id, value))
+    while pending:
+        yield _pop(pending)
+
+
+def _pop(pending):
+    seconds, reading_id, sensor_id, value = heapq.heappop(pending)
+    return -reading_id, sensor_id, _decimal(value), _moment(-seconds)
+
+
+def totals(session, query, rows):
+    """Fold compacted counts into grouped (key..., avg_value, reading_count) report rows.
+
+    ``query`` selects the same keys followed by ``sum(value_sum)`` and
+    ``sum(reading_count)`` from ReadingChunk; it only runs when chunks exist.
+    """
+    if not index.refresh(session):
+        return rows
+    merged = {tuple(row[:-2]): [float(row[-2] or 0) * row[-1], row[-1]] for row in rows}
+    for row in session.execute(query).all():
+        entry = merged.setdefault(tuple(row[:-2]), [0.0, 0])
+        entry[0] += float(row[-2] or 0)
+        entry[1] += int(row[-1] or 0)
+    return [key + ((total / count if count else None), count) for key, (total, count) in merged.items()]
+
+
+def reading_count(session):
+    """Number of compacted readings"""
+    if not index.refresh(session):
+        return 0
+    return session.execute(select(func.sum(ReadingChunk.reading_count))).scalar() or 0
+
+
+# =====================================================
+# COMPACTION
+# =====================================================
+
+def _bump(session):
+    if not session.execute(cache.bump_statement('ReadingChunk')).rowcount:
+        session.add(DataVersion(name='ReadingChunk', version=1))
+
+
+def compact(job, session, before, chunk_hours):
+    """Move readings older than ``before`` into chunks, one committed window at a time.
+
+    ``before`` is rounded down to a chunk boundary so every chunk written
+    is complete. Each sensor's latest reading stays in Reading so
+    SensorLatest keeps pointing at a live row, and readings that arrive
+    late for an already compacted window are merged into its chunk.
+    """
+    before = chunk_start(before, chunk_hours)
+    span = timedelta(hours=chunk_hours)
+    keep = set(session.execute(select(SensorLatest.reading_id)).scalars())
+    sensors = session.execute(
+        select(Reading.sensor_id, func.min(Reading.reading_timestamp))
+        .where(Reading.reading_timestamp < before).group_by(Reading.sensor_id)
+    ).all()
+    job.total = len(sensors)
+    moved = chunks = 0
+
+    for sensor_id, oldest in sensors:
+        start = chunk_start(oldest, chunk_hours)
+        while start is not None and start < before:
+            end = start + span
+            rows = [tuple(row) for row in session.execute(
+                select(Reading.reading_id, Reading.reading_value, Reading.reading_timestamp)
+                .where(Reading.sensor_id == sensor_id,
+                       Reading.reading_timestamp >= start, Reading.reading_timestamp < end)
+            ).all() if row.reading_id not in keep]
+            if rows:
+                ids = [row[0] for row in rows]
+                existing = session.get(ReadingChunk, (sensor_id, start))
+                if existing is not None:
+                    rows.extend(tuple(row) for row in decode_chunk(existing))
+                    session.delete(existing)
+                    session.flush()
+                session.execute(ReadingChunk.__table__.insert(), [build_chunk(sensor_id, start, rows)])
+                session.execute(delete(Reading).where(Reading.reading_id.in_(ids)))
+                _bump(session)
+                session.commit()
+                moved += len(ids)
+                chunks += 1
+                job.message = f'Compacted {moved} readings into {chunks} chunks'
+
+            following = session.execute(
+                select(func.min(Reading.reading_timestamp))
+                .where(Reading.sensor_id == sensor_id, Reading.reading_timestamp >= end)
+            ).scalar()
+            start = chunk_start(following, chunk_hours) if following is not None else None
+        job.progress += 1
+
+    return {'readings': moved, 'chunks': chunks}
+
+
+def storage_summary(session):
+    """Readings and bytes held in chunks, for the compact-readings report"""
+    row = session.execute(select(
+        func.count(), func.sum(ReadingChunk.reading_count),
+        func.sum(func.length(ReadingChunk.timestamp_data) + func.length(ReadingChunk.value_data)
+                 + func.length(ReadingChunk.id_data))
+    )).one()
+    return {'chunks': row[0], 'readings': int(row[1] or 0), 'bytes': int(row[2] or 0)}
@@ -0,0 +1,291 @@
+"""Negotiated response compression, including streamed responses"""
+import threading
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request, Response
+from werkzeug.http import parse_accept_header
+
+import metrics
+
+# Optional encoders; gzip is always available through zlib
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+
+class _Encoder:
+    """Uniform incremental interface over the different compressor objects"""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self._push, self._finish = self._obj.compress, self._obj.flush
+        elif encoding == 'br':
+            self._obj = brotli.Compressor(quality=level)
+            self._push = getattr(self._obj, 'process', None) or self._obj.compress
+            self._finish = self._obj.finish
+        elif encoding == 'zstd':
+            if hasattr(zstd, 'ZstdCompressor') and hasattr(zstd.ZstdCompressor, 'compressobj'):
+                self._obj = zstd.ZstdCompressor(level=level).compressobj()
+            else:
+                self._obj = zstd.ZstdCompressor(level=level)
+            self._push, self._finish = self._obj.compress, self._obj.flush
+        else:
+            raise ValueError(f'Unsupported encoding {encoding}')
+
+    def compress(self, data):
+        return self._push(data)
+
+    def finish(self):
+        return self._finish()
+
+
+def available_encodings(preferred):
+    """Encodings from ``preferred`` whose encoder is installed"""
+    installed = {'gzip': True, 'br': brotli is not None, 'zstd': zstd is not None}
+    return [enc for enc in preferred if installed.get(enc)]
+
+
+def negotiate(accept_encodings, preferred):
+    """Pick the first server-preferred encoding the client accepts"""
+    for encoding in available_encodings(preferred):
+        if accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def _stream(chunks, encoder, on_complete=None, limit=0):
+    """Compress an iterable of chunks, yielding output as the encoder produces it"""
+    captured, size = ([] if on_complete is not None else None), 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        out = encoder.compress(chunk)
+        if out:
+            if captured is not None:
+                size += len(out)
+                if size <= limit:
+                    captured.append(out)
+                else:
+                    captured = None  # too large to keep; stream it only
+            yield out
+    out = encoder.finish()
+    if out:
+        yield out
+    if captured is not None and size + len(out) <= limit:
+        on_complete(b''.join(captured) + out)
+
+
+# =====================================================
+# PRE-COMPRESSED EXPORT ARTIFACTS
+# =====================================================
+
+class ArtifactCache:
+    """LRU of finished, compressed export bodies bounded by total size"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype, headers, max_bytes):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, mimetype, headers)
+            self._size += len(body)
+            while self._size > max_bytes and self._entries:
+                _, (old, _, _) = self._entries.popitem(last=False)
+                self._size -= len(old)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+artifacts = ArtifactCache()
+
+
+def artifact(view):
+    """Serve a finished export from the compressed artifact cache when possible.
+
+    Must sit below ``cache.conditional`` so ``g.etag`` identifies the
+    data version being exported.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = g.get('etag')
+        encoding = negotiate(request.accept_encodings, current_app.config['COMPRESS_ALGORITHMS'])
+        if etag is None or encoding is None:
+            return view(*args, **kwargs)
+
+        key = (request.full_path, etag, encoding)
+        entry = artifacts.get(key)
+        metrics.cache_result('export_artifact', entry is not None)
+        if entry is not None:
+            body, mimetype, headers = entry
+            response = Response(body, mimetype=mimetype, headers=headers)
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            g.response_precompressed = True
+            return response
+
+        g.artifact_key = key
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# =====================================================
+# RESPONSE HOOK
+# =====================================================
+
+def compress_response(app, response):
+    """after_request hook: compress eligible responses for the negotiated encoding"""
+    response = _compress(app, response)
+    # Compressed bytes, fresh or from the artifact cache, are a different
+    # representation of the same data
+    if 'Content-Encoding' in response.headers:
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+    return response
+
+
+def _compress(app, response):
+    config = app.config
+    if (response.status_code != 200 or g.get('response_precompressed') or
+            'Content-Encoding' in response.headers or response.direct_passthrough or
+            not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+    if not response.is_streamed and response.content_length is not None \
+            and response.content_length < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings, config['COMPRESS_ALGORITHMS'])
+    if encoding is None:
+        return response
+
+    encoder = _Encoder(encoding, config['COMPRESS_LEVELS'][encoding])
+    response.headers['Content-Encoding'] = encoding
+
+    if response.is_streamed:
+        on_complete = None
+        key = g.get('artifact_key')
+        if key is not None:
+            mimetype = response.mimetype
+            headers = {'Content-Disposition': response.headers.get('Content-Disposition', '')}
+            max_bytes = config['EXPORT_CACHE_MAX_BYTES']
+
+            def on_complete(body):
+                artifacts.put(key, body, mimetype, headers, max_bytes)
+
+        response.response = _stream(response.response, encoder, on_complete,
+                                    config['EXPORT_CACHE_MAX_BYTES'] // 4)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(encoder.compress(response.get_data()) + encoder.finish())
+    return response
+
+
+def init_app(app):
+    app.after_request(lambda response: compress_response(app, response))
+
+
+# =====================================================
+# ASGI MIDDLEWARE
+# =====================================================
+
+class ASGICompressMiddleware:
+    """``compress_response`` for the async tier: same negotiation, encoders and weak ETags.
+
+    The start message is held back until the first body message, so a
+    body sent in one piece gets its compressed Content-Length and one
+    below ``COMPRESS_MIN_SIZE`` is sent as it is.
+    """
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        accept = b', '.join(value for name, value in scope['headers'] if name == b'accept-encoding')
+        encoding = negotiate(parse_accept_header(accept.decode('latin-1')),
+                             self.settings['COMPRESS_ALGORITHMS'])
+        start = encoder = None
+
+        async def send_compressed(message):
+            nonlocal start, encoder
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if start is not None:
+                encoder = self._encoder(start, message, encoding)
+                if encoder is not None:
+                    message = self._compress(encoder, message)
+                    headers = [(name, value) for name, value in start['headers']
+                               if name.lower() != b'content-length']
+                    if not message.get('more_body'):
+                        headers.append((b'content-length', str(len(message['body'])).encode()))
+                    start['headers'] = headers
+                await send(start)
+                start = None
+            elif encoder is not None and message['type'] == 'http.response.body':
+                message = self._compress(encoder, message)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _encoder(self, start, first, encoding):
+        """Encoder for an eligible response, adjusting its start headers; None otherwise"""
+        headers = start['headers'] = list(start.get('headers', []))
+        lowered = {name.lower(): value for name, value in headers}
+        if (start['status'] != 200 or b'content-encoding' in lowered or
+                not lowered.get(b'content-type', b'').decode('latin-1').startswith(COMPRESSIBLE_TYPES)):
+            return None
+        if not first.get('more_body') and len(first.get('body', b'')) < self.settings['COMPRESS_MIN_SIZE']:
+            return None
+
+        headers.append((b'vary', b'Accept-Encoding'))
+        if encoding is None:
+            return None
+        headers.append((b'content-encoding', encoding.encode()))
+        for index, (name, value) in enumerate(headers):
+            if name.lower() == b'etag' and not value.startswith(b'W/'):
+                headers[index] = (name, b'W/' + value)
+        return _Encoder(encoding, self.settings['COMPRESS_LEVELS'][encoding])
+
+    @staticmethod
+    def _compress(encoder, message):
+        body = encoder.compress(message.get('body', b''))
+        if not message.get('more_body'):
+            body += encoder.finish()
+        return {**message, 'body': body}
@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Databases storing readings ('primary' is the main database), see shards.py
+READING_SHARD_URLS = [url.strip() for url in os.getenv('READING_SHARD_URLS', '').split(',') if url.strip()]
+
 class Config:
     """Base configuration class"""
     
@@ -19,7 +22,11 @@ class Config:
     
     # SQLAlchemy configuration
     SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URI = f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_BINDS = {f'readings{i}': url for i, url in enumerate(READING_SHARD_URLS) if url != 'primary'}
+    READING_SHARDS = tuple(url if url == 'primary' else f'readings{i}' for i, url in enumerate(READING_SHARD_URLS))
+    SHARD_QUERY_WORKERS = int(os.getenv('SHARD_QUERY_WORKERS', '8'))
     SQLALCHEMY_ECHO = False  # Set to True for SQL debugging
     
     # Flask configuration
@@ -28,6 +35,114 @@ class Config:
     
     # Pagination
     ITEMS_PER_PAGE = 20
+    API_PAGE_SIZE = 100  # sensor and maintenance list APIs
+    API_MAX_PAGE_SIZE = 1000
+    API_MAX_NARROW_PAGE_SIZE = 20000  # sensor lists of ids, status and coordinates only
+    READINGS_PAGE_SIZE = 100
+    READINGS_MAX_PAGE_SIZE = 5000
+    READINGS_WINDOW_DAYS = 7
+    READINGS_MAX_WINDOW_DAYS = 366
+    
+    # Compressed chunk storage for old readings (flask compact-readings)
+    CHUNK_HOURS = int(os.getenv('CHUNK_HOURS', '24'))
+    CHUNK_COMPACT_AFTER_DAYS = int(os.getenv('CHUNK_COMPACT_AFTER_DAYS', '90'))
+    
+    # Password hashing (werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '8'))
+    PASSWORD_HASH_TIMEOUT = 5  # seconds a login waits for a free hashing slot
+    
+    # Login rate limiting (per worker process)
+    LOGIN_RATE_WINDOW = 300  # seconds
+    LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_IP', '30'))
+    LOGIN_MAX_FAILURES_PER_USER = int(os.getenv('LOGIN_MAX_FAILURES_PER_USER', '5'))
+    
+    # Authentication caches
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '30'))  # seconds
+    API_TOKEN_REFRESH_INTERVAL = int(os.getenv('API_TOKEN_REFRESH_INTERVAL', '30'))  # seconds
+    
+    # Background jobs
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+    SENSOR_PURGE_CHUNK_SIZE = int(os.getenv('SENSOR_PURGE_CHUNK_SIZE', '5000'))
+    
+    # Heatmap interpolation
+    HEATMAP_CACHE_TTL = int(os.getenv('HEATMAP_CACHE_TTL', '300'))  # seconds
+    HEATMAP_MAX_RESOLUTION = 200
+    HEATMAP_DEFAULT_RESOLUTION = 50
+    HEATMAP_MAX_POWER = 10  # inverse distance weighting exponent
+    HEATMAP_MAX_POINTS = 256  # IDW inputs; denser networks are binned to about this many
+    HEATMAP_KRIGING_MAX_POINTS = 100  # kriging solves a system of this size
+    HEATMAP_IDW_NEIGHBOURS = 16  # nearest points weighted per cell
+    
+    # Predictive maintenance scoring
+    CALIBRATION_INTERVAL_DAYS = int(os.getenv('CALIBRATION_INTERVAL_DAYS', '180'))
+    MAINTENANCE_SCORE_RECENT_DAYS = 7
+    MAINTENANCE_SCORE_BASELINE_DAYS = 30
+    MAINTENANCE_SCORE_MAX_AGE = int(os.getenv('MAINTENANCE_SCORE_MAX_AGE', '3600'))  # seconds
+    MAINTENANCE_ATTENTION_LIMIT = 10
+    MAINTENANCE_ATTENTION_THRESHOLD = 0.4
+    
+    # Alerting (notifiers: log, webhook)
+    ALERT_NOTIFIERS = tuple(n.strip() for n in os.getenv('ALERT_NOTIFIERS', 'log').split(',') if n.strip())
+    ALERT_WEBHOOK_URL = os.getenv('ALERT_WEBHOOK_URL')
+    
+    # Availability reports
+    AVAILABILITY_REPORT_DAYS = 30
+    AVAILABILITY_LOG_OVERLAP = int(os.getenv('AVAILABILITY_LOG_OVERLAP', '1000'))  # log ids re-read per refresh
+    
+    # Report snapshots (snapshots.py; flask snapshot-reports from cron)
+    REPORT_SNAPSHOT_MAX_AGE = int(os.getenv('REPORT_SNAPSHOT_MAX_AGE', '900'))  # seconds, reading-based sections
+    REPORT_SNAPSHOT_KEEP = int(os.getenv('REPORT_SNAPSHOT_KEEP', '200'))  # per section
+    REPORT_HISTORY_LIMIT = 50  # snapshots offered for comparison
+    
+    # Response compression (encodings in server preference order)
+    COMPRESS_ALGORITHMS = ('zstd', 'br', 'gzip')
+    COMPRESS_LEVELS = {
+        'gzip': int(os.getenv('COMPRESS_GZIP_LEVEL', '6')),
+        'br': int(os.getenv('COMPRESS_BROTLI_QUALITY', '4')),
+        'zstd': int(os.getenv('COMPRESS_ZSTD_LEVEL', '3'))
+    }
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # bytes
+    EXPORT_CACHE_MAX_BYTES = int(os.getenv('EXPORT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    EXPORT_STREAM_BATCH = 500  # CSV rows per streamed chunk
+    
+    # Async API tier (async_api.py)
+    ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', '20'))
+    ASYNC_MAX_OVERFLOW = int(os.getenv('ASYNC_MAX_OVERFLOW', '20'))
+    LONGPOLL_MAX_WAIT = 30  # seconds a latest-reading long-poll may be held open
+    LONGPOLL_INTERVAL = 1.0  # seconds between SensorLatest checks while waiting
+    
+    # Search index (search_index.py)
+    SEARCH_RESULT_LIMIT = 10  # default /api/search results
+    SEARCH_MAX_RESULTS = 50
+    SEARCH_SIMILARITY_THRESHOLD = 0.3  # trigram similarity for near-miss suggestions
+    SEARCH_MAX_FILTER_IDS = 1000  # list views use LIKE when more records match
+    
+    # Warm-up before serving traffic (warmup.py, gunicorn.conf.py)
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+    WARMUP_PATHS = tuple(p.strip() for p in os.getenv(
+        'WARMUP_PATHS', '/sensors,/locations,/technicians,/sensor-types,/alerts').split(',') if p.strip())
+    WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', '2'))  # per engine and worker
+    WARMUP_BUDGET = float(os.getenv('WARMUP_BUDGET', '5'))  # seconds; slower warm-ups are logged as warnings
+    
+    # Metrics at /metrics (METRICS_DIR: directory shared by worker processes)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_DIR = os.getenv('METRICS_DIR') or os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = 5  # seconds between a worker's snapshot writes
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
+    # Edge nodes (FLASK_ENV=edge): local SQLite, readings shipped to EDGE_CENTRAL_URL
+    EDGE_MODE = False
+    EDGE_SITE_ID = os.getenv('EDGE_SITE_ID')
+    EDGE_CENTRAL_URL = os.getenv('EDGE_CENTRAL_URL')
+    EDGE_SYNC_TOKEN = os.getenv('EDGE_SYNC_TOKEN')
+    EDGE_SYNC_BATCH = int(os.getenv('EDGE_SYNC_BATCH', '5000'))  # readings per batch
+    EDGE_SYNC_INTERVAL = int(os.getenv('EDGE_SYNC_INTERVAL', '300'))  # seconds
+    EDGE_SYNC_MAX_BACKOFF = 3600  # seconds between retries while the central server is unreachable
+    EDGE_SYNC_TIMEOUT = 60  # seconds per batch upload
+    EDGE_RETENTION_DAYS = int(os.getenv('EDGE_RETENTION_DAYS', '30'))  # shipped readings kept locally
+    EDGE_MAX_BATCH_BYTES = 64 * 1024 * 1024  # decompressed size accepted by /api/edge/batches
     
     @staticmethod
     def init_app(app):
@@ -47,12 +162,19 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite:///:memory:')
+    ASYNC_DATABASE_URI = os.getenv('TEST_ASYNC_DATABASE_URL', 'sqlite+aiosqlite:///:memory:')
+
+class EdgeConfig(ProductionConfig):
+    """Edge node configuration (local SQLite in WAL mode)"""
+    EDGE_MODE = True
+    SQLALCHEMY_DATABASE_URI = os.getenv('EDGE_DATABASE_URL', 'sqlite:///edge.db')
 
 # Configuration dictionary
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
     'testing': TestingConfig,
+    'edge': EdgeConfig,
     'default': DevelopmentConfig
 }
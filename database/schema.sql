@@ -26,6 +26,17 @@ CREATE TABLE User (
     INDEX idx_email (email)
 );
 
+-- Table: ApiToken (hashed tokens for machine clients)
+CREATE TABLE ApiToken (
+    token_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    token_hash CHAR(64) NOT NULL UNIQUE,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE
+);
+
 -- Table: SensorType
 CREATE TABLE SensorType (
     type_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -66,7 +77,10 @@ CREATE TABLE Reading (
     reading_value DECIMAL(10,4) NOT NULL,
     reading_timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (sensor_id) REFERENCES Sensor(sensor_id) ON DELETE CASCADE,
-    INDEX idx_sensor_timestamp (sensor_id, reading_timestamp)
+    -- reading_value is included so per-sensor window scans never touch the row
+    INDEX idx_sensor_timestamp (sensor_id, reading_timestamp, reading_value),
+    -- newest-first listing and exports across all sensors
+    INDEX idx_reading_timestamp (reading_timestamp)
 );
 
 -- Table: Technician
@@ -101,6 +115,122 @@ CREATE TABLE SensorStatusLog (
     FOREIGN KEY (sensor_id) REFERENCES Sensor(sensor_id) ON DELETE CASCADE
 );
 
+-- Table: SensorLatest (most recent reading per sensor, kept current by triggers)
+CREATE TABLE SensorLatest (
+    sensor_id INT PRIMARY KEY,
+    reading_id BIGINT NOT NULL,
+    reading_value DECIMAL(10,4) NOT NULL,
+    reading_timestamp DATETIME NOT NULL,
+    FOREIGN KEY (sensor_id) REFERENCES Sensor(sensor_id) ON DELETE CASCADE,
+    INDEX idx_latest_timestamp (reading_timestamp)
+);
+
+-- Table: ReadingChunk (compressed historical readings, written by compact-readings)
+CREATE TABLE ReadingChunk (
+    sensor_id INT NOT NULL,
+    chunk_start DATETIME NOT NULL,
+    first_timestamp DATETIME NOT NULL,
+    last_timestamp DATETIME NOT NULL,
+    reading_count INT NOT NULL,
+    min_value DECIMAL(10,4) NOT NULL,
+    max_value DECIMAL(10,4) NOT NULL,
+    value_sum DECIMAL(20,4) NOT NULL,
+    timestamp_data MEDIUMBLOB NOT NULL,
+    value_data MEDIUMBLOB NOT NULL,
+    id_data MEDIUMBLOB NOT NULL,
+    PRIMARY KEY (sensor_id, chunk_start),
+    FOREIGN KEY (sensor_id) REFERENCES Sensor(sensor_id) ON DELETE CASCADE,
+    INDEX idx_chunk_last (last_timestamp)
+);
+
+-- Table: MaintenanceScore (predictive maintenance ranking, written by the scoring job)
+CREATE TABLE MaintenanceScore (
+    sensor_id INT PRIMARY KEY,
+    score DOUBLE NOT NULL,
+    `rank` INT NOT NULL,
+    days_since_calibration DOUBLE,
+    drift DOUBLE,
+    variance_ratio DOUBLE,
+    repairs INT NOT NULL DEFAULT 0,
+    silence_hours DOUBLE,
+    reasons VARCHAR(255),
+    computed_at DATETIME NOT NULL,
+    FOREIGN KEY (sensor_id) REFERENCES Sensor(sensor_id) ON DELETE CASCADE,
+    INDEX idx_score_rank (`rank`)
+);
+
+-- Table: ReportSnapshot (reports page sections, written by the snapshot job)
+CREATE TABLE ReportSnapshot (
+    snapshot_id INT AUTO_INCREMENT PRIMARY KEY,
+    section VARCHAR(32) NOT NULL,
+    generated_at DATETIME NOT NULL,
+    versions VARCHAR(255) NOT NULL,
+    duration_ms DOUBLE,
+    payload MEDIUMTEXT NOT NULL,
+    INDEX idx_snapshot_section (section, generated_at)
+);
+
+-- Table: AlertRule (threshold, rate-of-change and no-data rules)
+CREATE TABLE AlertRule (
+    rule_id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    rule_kind ENUM('THRESHOLD', 'RATE', 'NO_DATA') NOT NULL,
+    type_id INT,
+    location_id INT,
+    min_value DECIMAL(10,4),
+    max_value DECIMAL(10,4),
+    max_rate_per_hour DECIMAL(10,4),
+    no_data_minutes INT,
+    severity ENUM('INFO', 'WARNING', 'CRITICAL') NOT NULL DEFAULT 'WARNING',
+    cooldown_minutes INT NOT NULL DEFAULT 30,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (type_id) REFERENCES SensorType(type_id) ON DELETE CASCADE,
+    FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE CASCADE
+);
+
+-- Table: Alert (raised alerts; repeats within a rule's cooldown update one row)
+CREATE TABLE Alert (
+    alert_id INT AUTO_INCREMENT PRIMARY KEY,
+    rule_id INT NOT NULL,
+    sensor_id INT NOT NULL,
+    severity ENUM('INFO', 'WARNING', 'CRITICAL') NOT NULL,
+    message VARCHAR(255) NOT NULL,
+    reading_value DECIMAL(10,4),
+    triggered_at DATETIME NOT NULL,
+    last_seen_at DATETIME NOT NULL,
+    occurrences INT NOT NULL DEFAULT 1,
+    acknowledged_at DATETIME,
+    acknowledged_by INT,
+    FOREIGN KEY (rule_id) REFERENCES AlertRule(rule_id) ON DELETE CASCADE,
+    FOREIGN KEY (sensor_id) REFERENCES Sensor(sensor_id) ON DELETE CASCADE,
+    FOREIGN KEY (acknowledged_by) REFERENCES User(user_id) ON DELETE SET NULL,
+    INDEX idx_alert_open (rule_id, sensor_id, acknowledged_at),
+    INDEX idx_alert_triggered (triggered_at)
+);
+
+-- Table: LocationShard (database storing each location's readings when sharded)
+CREATE TABLE LocationShard (
+    location_id INT PRIMARY KEY,
+    shard VARCHAR(50) NOT NULL,
+    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE CASCADE
+);
+
+-- Table: SyncWatermark (highest edge-node reading id received per site)
+CREATE TABLE SyncWatermark (
+    site_id VARCHAR(50) PRIMARY KEY,
+    last_reading_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Table: DataVersion (change counters for application caches)
+CREATE TABLE DataVersion (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- =====================================================
 -- TRIGGERS
 -- =====================================================
@@ -147,6 +277,48 @@ BEGIN
 END//
 DELIMITER ;
 
+-- Trigger: Keep SensorLatest current on insert
+-- (reading_timestamp is assigned last so the IF()s compare against the old row)
+DELIMITER //
+CREATE TRIGGER after_reading_insert
+AFTER INSERT ON Reading
+FOR EACH ROW
+BEGIN
+    INSERT INTO SensorLatest (sensor_id, reading_id, reading_value, reading_timestamp)
+    VALUES (NEW.sensor_id, NEW.reading_id, NEW.reading_value, NEW.reading_timestamp)
+    ON DUPLICATE KEY UPDATE
+        reading_id = IF(NEW.reading_timestamp >= reading_timestamp, NEW.reading_id, reading_id),
+        reading_value = IF(NEW.reading_timestamp >= reading_timestamp, NEW.reading_value, reading_value),
+        reading_timestamp = GREATEST(NEW.reading_timestamp, reading_timestamp);
+END//
+DELIMITER ;
+
+-- Trigger: Recompute SensorLatest when a reading is edited
+DELIMITER //
+CREATE TRIGGER after_reading_update
+AFTER UPDATE ON Reading
+FOR EACH ROW
+BEGIN
+    CALL RefreshSensorLatest(OLD.sensor_id);
+    IF NEW.sensor_id != OLD.sensor_id THEN
+        CALL RefreshSensorLatest(NEW.sensor_id);
+    END IF;
+END//
+DELIMITER ;
+
+-- Trigger: Recompute SensorLatest when the latest reading is deleted
+DELIMITER //
+CREATE TRIGGER after_reading_delete
+AFTER DELETE ON Reading
+FOR EACH ROW
+BEGIN
+    IF EXISTS (SELECT 1 FROM SensorLatest
+               WHERE sensor_id = OLD.sensor_id AND reading_id = OLD.reading_id) THEN
+        CALL RefreshSensorLatest(OLD.sensor_id);
+    END IF;
+END//
+DELIMITER ;
+
 -- =====================================================
 -- STORED PROCEDURES
 -- =====================================================
@@ -170,6 +342,20 @@ BEGIN
 END//
 DELIMITER ;
 
+-- Procedure: Recompute the SensorLatest row for one sensor
+DELIMITER //
+CREATE PROCEDURE RefreshSensorLatest(IN p_sensor_id INT)
+BEGIN
+    DELETE FROM SensorLatest WHERE sensor_id = p_sensor_id;
+    INSERT INTO SensorLatest (sensor_id, reading_id, reading_value, reading_timestamp)
+    SELECT sensor_id, reading_id, reading_value, reading_timestamp
+    FROM Reading
+    WHERE sensor_id = p_sensor_id
+    ORDER BY reading_timestamp DESC, reading_id DESC
+    LIMIT 1;
+END//
+DELIMITER ;
+
 -- Procedure: Get maintenance summary by event type
 DELIMITER //
 CREATE PROCEDURE GetMaintenanceSummary()
@@ -254,6 +440,18 @@ INSERT INTO User (username, email, password_hash, full_name, is_active) VALUES
 ('admin', 'admin@microclimate.com', 'scrypt:32768:8:1$RDhqhekc2l0UI32I$0f1bc8c5a56e0d6b03078b937cc108e691809b313e15a091784487752f04b822c4b7bf25e8d7020bcf33af75160d43d92174de99521da9b61247c70a65863f09', 'System Administrator', TRUE),
 ('demo', 'demo@microclimate.com', 'scrypt:32768:8:1$RDhqhekc2l0UI32I$0f1bc8c5a56e0d6b03078b937cc108e691809b313e15a091784487752f04b822c4b7bf25e8d7020bcf33af75160d43d92174de99521da9b61247c70a65863f09', 'Demo User', TRUE);
 
+-- Initialise cache versions
+INSERT INTO DataVersion (name, version) VALUES
+('SensorType', 0),
+('Location', 0),
+('Sensor', 0),
+('Reading', 0),
+('Technician', 0),
+('MaintenanceEvent', 0),
+('AlertRule', 0),
+('ReadingChunk', 0),
+('LocationShard', 0);
+
 -- Insert Sensor Types
 INSERT INTO SensorType (name, description) VALUES
 ('Temperature', 'Measures ambient temperature in Celsius'),
@@ -423,25 +621,19 @@ JOIN SensorType st ON s.type_id = st.type_id
 JOIN Location l ON s.location_id = l.location_id
 WHERE s.status = 'ACTIVE';
 
--- View: Latest Readings per Sensor
+-- View: Latest Readings per Sensor (one SensorLatest lookup per sensor)
 CREATE VIEW LatestReadingsView AS
 SELECT 
     s.sensor_id,
     s.model,
     st.name AS sensor_type,
     l.area_name,
-    r.reading_value,
-    r.reading_timestamp
+    sl.reading_value,
+    sl.reading_timestamp
 FROM Sensor s
 JOIN SensorType st ON s.type_id = st.type_id
 JOIN Location l ON s.location_id = l.location_id
-LEFT JOIN Reading r ON s.sensor_id = r.sensor_id
-WHERE r.reading_timestamp = (
-    SELECT MAX(reading_timestamp)
-    FROM Reading
-    WHERE sensor_id = s.sensor_id
-)
-OR r.reading_id IS NULL;
+LEFT JOIN SensorLatest sl ON s.sensor_id = sl.sensor_id;
 
 -- View: Maintenance Statistics
 CREATE VIEW MaintenanceStatsView AS
@@ -461,12 +653,15 @@ GROUP BY s.sensor_id;
 -- INDEXES FOR PERFORMANCE
 -- =====================================================
 
-CREATE INDEX idx_sensor_status ON Sensor(status);
-CREATE INDEX idx_sensor_type ON Sensor(type_id);
-CREATE INDEX idx_sensor_location ON Sensor(location_id);
-CREATE INDEX idx_reading_sensor ON Reading(sensor_id);
-CREATE INDEX idx_maintenance_sensor ON MaintenanceEvent(sensor_id);
-CREATE INDEX idx_maintenance_tech ON MaintenanceEvent(tech_id);
+-- Sensor list filters: any combination of status, type and location
+-- is a prefix of one of these (the primary key is implied at the end)
+CREATE INDEX idx_sensor_status_type ON Sensor(status, type_id, location_id);
+CREATE INDEX idx_sensor_type_location ON Sensor(type_id, location_id);
+CREATE INDEX idx_sensor_location_status ON Sensor(location_id, status);
+-- Maintenance list filters, each read newest first
+CREATE INDEX idx_maintenance_sensor_date ON MaintenanceEvent(sensor_id, event_date);
+CREATE INDEX idx_maintenance_tech_date ON MaintenanceEvent(tech_id, event_date);
+CREATE INDEX idx_maintenance_type_date ON MaintenanceEvent(event_type, event_date);
 CREATE INDEX idx_maintenance_date ON MaintenanceEvent(event_date);
 
 -- =====================================================
@@ -0,0 +1,34 @@
+-- =====================================================
+-- Microclimate Sensor Grid Reading Shard Schema
+-- Load into each database listed in READING_SHARD_URLS
+-- (other than 'primary'); see shards.py
+-- =====================================================
+
+-- Give every shard the same increment and its own offset so reading
+-- ids never collide, e.g. for the second of up to 16 shards:
+--   SET GLOBAL auto_increment_increment = 16;
+--   SET GLOBAL auto_increment_offset = 2;
+
+-- Table: Reading (sensors live in the primary database, so no foreign key)
+CREATE TABLE Reading (
+    reading_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    sensor_id INT NOT NULL,
+    reading_value DECIMAL(10,4) NOT NULL,
+    reading_timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- Unique so a retried batch is not stored twice (see shards.py)
+    UNIQUE INDEX idx_sensor_timestamp (sensor_id, reading_timestamp, reading_value),
+    INDEX idx_reading_timestamp (reading_timestamp)
+);
+
+-- Trigger: Validate reading values
+DELIMITER //
+CREATE TRIGGER before_reading_insert
+BEFORE INSERT ON Reading
+FOR EACH ROW
+BEGIN
+    IF NEW.reading_timestamp > CURRENT_TIMESTAMP THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'Reading timestamp cannot be in the future';
+    END IF;
+END//
+DELIMITER ;
@@ -0,0 +1,418 @@
+"""Edge-node mode: run a site on local SQLite and ship readings to the central server.
+
+An edge node (``FLASK_ENV=edge``) keeps its own SQLite database in WAL
+mode, so dashboards keep reading while gateways write and the site works
+without its backhaul. ``TRIGGERS`` port the MySQL triggers of schema.sql
+to SQLite (``flask edge-init`` installs them); the stored procedures have query equivalents in
+procedures.py.
+
+``flask edge-sync`` ships readings to the central deployment in batches
+of up to ``EDGE_SYNC_BATCH`` rows, in reading id order. Each batch is
+encoded per sensor with the chunk storage codecs (a few bytes per
+reading) and gzipped. The central server keeps one ``SyncWatermark`` per
+site, the highest edge reading id it has stored, and skips rows at or
+below it in the same transaction that inserts the rest, so a batch that
+is retried after a lost response is applied once. The edge only advances
+its own watermark to what the central server reports.
+"""
+import base64
+import gzip
+import json
+import time
+import urllib.error
+import urllib.request
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, delete, select
+
+import alerts
+import cache
+import chunkstore
+import ingest
+from models import db, Reading, ReadingChunk, SyncWatermark, DataVersion
+
+BATCH_FORMAT = 1
+
+VERSIONED_TABLES = ('SensorType', 'Location', 'Sensor', 'Reading', 'Technician',
+                    'MaintenanceEvent', 'AlertRule', 'ReadingChunk', 'LocationShard')
+
+# schema.sql triggers for SQLite. Timestamps are written as SQLAlchemy
+# stores them ('YYYY-MM-DD HH:MM:SS[.ffffff]', UTC), so they compare as text.
+TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS before_sensor_update
+    BEFORE UPDATE OF status ON Sensor
+    FOR EACH ROW WHEN OLD.status != NEW.status
+    BEGIN
+        INSERT INTO SensorStatusLog (sensor_id, old_status, new_status, change_timestamp)
+        VALUES (OLD.sensor_id, OLD.status, NEW.status, strftime('%Y-%m-%d %H:%M:%S', 'now'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS after_maintenance_insert
+    AFTER INSERT ON MaintenanceEvent
+    FOR EACH ROW WHEN NEW.event_type IN ('REPAIR', 'REPLACEMENT')
+    BEGIN
+        UPDATE Sensor
+        SET status = 'MAINTENANCE', updated_at = strftime('%Y-%m-%d %H:%M:%S', 'now')
+        WHERE sensor_id = NEW.sensor_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS before_reading_insert
+    BEFORE INSERT ON Reading
+    FOR EACH ROW WHEN NEW.reading_timestamp > strftime('%Y-%m-%d %H:%M:%S.999999', 'now')
+    BEGIN
+        SELECT RAISE(ABORT, 'Reading timestamp cannot be in the future');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS after_reading_insert
+    AFTER INSERT ON Reading
+    FOR EACH ROW
+    BEGIN
+        INSERT INTO SensorLatest (sensor_id, reading_id, reading_value, reading_timestamp)
+        VALUES (NEW.sensor_id, NEW.reading_id, NEW.reading_value, NEW.reading_timestamp)
+        ON CONFLICT (sensor_id) DO UPDATE SET
+            reading_id = excluded.reading_id,
+            reading_value = excluded.reading_value,
+            reading_timestamp = excluded.reading_timestamp
+        WHERE excluded.reading_timestamp >= SensorLatest.reading_timestamp;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS after_reading_update
+    AFTER UPDATE ON Reading
+    FOR EACH ROW
+    BEGIN
+        DELETE FROM SensorLatest WHERE sensor_id IN (OLD.sensor_id, NEW.sensor_id);
+        INSERT INTO SensorLatest (sensor_id, reading_id, reading_value, reading_timestamp)
+        SELECT r.sensor_id, r.reading_id, r.reading_value, r.reading_timestamp
+        FROM Reading r
+        WHERE r.sensor_id IN (OLD.sensor_id, NEW.sensor_id)
+          AND r.reading_id = (SELECT n.reading_id FROM Reading n WHERE n.sensor_id = r.sensor_id
+                              ORDER BY n.reading_timestamp DESC, n.reading_id DESC LIMIT 1);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS after_reading_delete
+    AFTER DELETE ON Reading
+    FOR EACH ROW WHEN EXISTS (SELECT 1 FROM SensorLatest
+                              WHERE sensor_id = OLD.sensor_id AND reading_id = OLD.reading_id)
+    BEGIN
+        DELETE FROM SensorLatest WHERE sensor_id = OLD.sensor_id;
+        INSERT INTO SensorLatest (sensor_id, reading_id, reading_value, reading_timestamp)
+        SELECT sensor_id, reading_id, reading_value, reading_timestamp
+        FROM Reading
+        WHERE sensor_id = OLD.sensor_id
+        ORDER BY reading_timestamp DESC, reading_id DESC
+        LIMIT 1;
+    END
+    """,
+)
+
+
+class SyncError(Exception):
+    """The central server could not be reached or refused a batch"""
+
+
+class WatermarkMismatch(Exception):
+    """An edge batch starts past the central watermark, so rows in between would be lost"""
+
+    def __init__(self, watermark):
+        super().__init__('Batch does not continue from the stored watermark')
+        self.watermark = watermark
+
+
+# =====================================================
+# LOCAL DATABASE
+# =====================================================
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets dashboards read while ingest writes; NORMAL is durable across app crashes
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+
+def init_app(app):
+    """Configure SQLite connections of an edge node"""
+    if not app.config['EDGE_MODE']:
+        return
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            raise RuntimeError('Edge mode needs a SQLite EDGE_DATABASE_URL')
+        event.listen(db.engine, 'connect', _configure_sqlite)
+
+
+def install(site_id):
+    """Create tables, triggers and version rows in an empty edge database"""
+    db.create_all()
+    with db.engine.begin() as connection:
+        for statement in TRIGGERS:
+            connection.exec_driver_sql(statement)
+    for name in VERSIONED_TABLES:
+        if db.session.get(DataVersion, name) is None:
+            db.session.add(DataVersion(name=name, version=0))
+    if db.session.get(SyncWatermark, site_id) is None:
+        db.session.add(SyncWatermark(site_id=site_id, last_reading_id=0))
+    db.session.commit()
+
+
+# =====================================================
+# BATCH ENCODING
+# =====================================================
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def encode_batch(site_id, after, rows):
+    """Payload for (reading_id, sensor_id, value, timestamp) rows with ids above ``after``"""
+    by_sensor = {}
+    for reading_id, sensor_id, value, timestamp in rows:
+        by_sensor.setdefault(sensor_id, []).append((reading_id, value, timestamp))
+    sensors = []
+    for sensor_id, sensor_rows in by_sensor.items():
+        chunk = chunkstore.build_chunk(sensor_id, None, sensor_rows)
+        sensors.append({
+            'sensor_id': sensor_id,
+            'count': chunk['reading_count'],
+            'timestamps': _b64(chunk['timestamp_data']),
+            'values': _b64(chunk['value_data']),
+            'ids': _b64(chunk['id_data']),
+        })
+    return {
+        'format': BATCH_FORMAT,
+        'site_id': site_id,
+        'after': after,
+        'last_id': rows[-1][0],
+        'sensors': sensors,
+    }
+
+
+def decode_batch(payload):
+    """(edge reading id, row) pairs of a batch, rows shaped like ingest's"""
+    if not isinstance(payload, dict) or payload.get('format') != BATCH_FORMAT:
+        raise ValueError('Unsupported batch format')
+    readings = []
+    try:
+        for entry in payload['sensors']:
+            chunk = ReadingChunk(sensor_id=int(entry['sensor_id']), reading_count=int(entry['count']),
+                                 timestamp_data=base64.b64decode(entry['timestamps']),
+                                 value_data=base64.b64decode(entry['values']),
+                                 id_data=base64.b64decode(entry['ids']))
+            for row in chunkstore.decode_chunk(chunk):
+                readings.append((row.reading_id, {
+                    'sensor_id': chunk.sensor_id,
+                    'reading_value': float(row.reading_value),
+                    'reading_timestamp': row.reading_timestamp,
+                }))
+    except (KeyError, TypeError, ValueError, IndexError) as e:
+        raise ValueError(f'Malformed batch: {e}')
+    readings.sort(key=lambda item: item[0])
+    return readings
+
+
+def read_request(request, max_bytes):
+    """Parse a (possibly gzipped) batch upload; raises ValueError when invalid"""
+    data = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        inflater = zlib.decompressobj(wbits=31)
+        try:
+            data = inflater.decompress(data, max_bytes)
+        except zlib.error:
+            raise ValueError('Invalid gzip body')
+        if inflater.unconsumed_tail:
+            raise ValueError('Batch too large')
+    try:
+        return json.loads(data)
+    except ValueError:
+        raise ValueError('Request body must be JSON')
+
+
+# =====================================================
+# CENTRAL SIDE
+# =====================================================
+
+def _batch_id(payload, name, default=None):
+    """A non-negative integer reading id field of a batch; raises ValueError when missing or invalid"""
+    value = payload.get(name)
+    if value is None:
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f'{name} must be a non-negative integer')
+    return value
+
+
+def apply_batch(payload, known_sensor_ids, current_versions=None):
+    """Store a batch shipped by an edge node; the caller commits.
+
+    Rows at or below the site's watermark were stored by an earlier
+    attempt and are skipped. Returns a result dict with the new alerts
+    under ``'alerts'``.
+    """
+    readings = decode_batch(payload)
+    site_id = str(payload.get('site_id') or '')[:50]
+    if not site_id:
+        raise ValueError('site_id is required')
+    after = _batch_id(payload, 'after', 0)
+    last_id = _batch_id(payload, 'last_id')
+    if last_id < after or (readings and readings[-1][0] > last_id):
+        raise ValueError('last_id must be at least after and every reading id in the batch')
+
+    mark = db.session.execute(
+        select(SyncWatermark).where(SyncWatermark.site_id == site_id).with_for_update()
+    ).scalar_one_or_none()
+    if mark is None:
+        mark = SyncWatermark(site_id=site_id, last_reading_id=0)
+        db.session.add(mark)
+    watermark = mark.last_reading_id or 0
+    if after > watermark:
+        raise WatermarkMismatch(watermark)
+
+    rows = [row for reading_id, row in readings if reading_id > watermark]
+    now = datetime.utcnow()
+    errors = [f'sensor {row["sensor_id"]}: unknown sensor' for row in rows
+              if row['sensor_id'] not in known_sensor_ids]
+    errors += [f'sensor {row["sensor_id"]}: reading timestamp {row["reading_timestamp"]} is in the future'
+               for row in rows if row['reading_timestamp'] > now]
+    if errors:
+        raise ingest.IngestError(sorted(set(errors))[:50])
+
+    raised = alerts.check_readings(db.session, rows, current_versions) if rows else []
+    if rows and ingest.is_backfill(rows):
+        cache.bump_version('Reading')
+    inserted = ingest.insert_readings(rows)
+    mark.last_reading_id = max(watermark, last_id)
+    return {
+        'site_id': site_id,
+        'accepted': inserted,
+        'skipped': len(readings) - inserted,
+        'watermark': mark.last_reading_id,
+        'alerts': raised,
+    }
+
+
+# =====================================================
+# EDGE SIDE
+# =====================================================
+
+def _watermark(site_id):
+    mark = db.session.get(SyncWatermark, site_id)
+    if mark is None:
+        mark = SyncWatermark(site_id=site_id, last_reading_id=0)
+        db.session.add(mark)
+    return mark
+
+
+def pending_rows(after, limit):
+    return db.session.execute(
+        select(Reading.reading_id, Reading.sensor_id, Reading.reading_value, Reading.reading_timestamp)
+        .where(Reading.reading_id > after)
+        .order_by(Reading.reading_id)
+        .limit(limit)
+    ).all()
+
+
+def post_batch(config, payload):
+    """Send one batch; returns the decoded JSON response (any status with a watermark)"""
+    body = gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    request = urllib.request.Request(
+        config['EDGE_CENTRAL_URL'].rstrip('/') + '/api/edge/batches', data=body, method='POST',
+        headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip',
+                 'Authorization': f'Bearer {config["EDGE_SYNC_TOKEN"]}'})
+    try:
+        with urllib.request.urlopen(request, timeout=config['EDGE_SYNC_TIMEOUT']) as response:
+            # A rejected token is redirected to the login page
+            if response.headers.get_content_type() != 'application/json':
+                raise SyncError(f'Central server did not accept the batch (check EDGE_SYNC_TOKEN): '
+                                f'{response.geturl()}')
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            document = json.loads(e.read())
+        except ValueError:
+            document = {}
+        if e.code == 409 and 'watermark' in document:
+            return document
+        details = '; '.join(document.get('details', [])) if isinstance(document, dict) else ''
+        raise SyncError(f'Central server answered {e.code}: {document.get("error", e.reason)} {details}'.strip())
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise SyncError(f'Central server unreachable: {e}')
+
+
+def sync(config, echo=print):
+    """Ship pending readings until caught up; returns the number of readings sent"""
+    site_id = config['EDGE_SITE_ID']
+    if not (site_id and config['EDGE_CENTRAL_URL'] and config['EDGE_SYNC_TOKEN']):
+        raise SyncError('Set EDGE_SITE_ID, EDGE_CENTRAL_URL and EDGE_SYNC_TOKEN')
+    sent = 0
+    while True:
+        mark = _watermark(site_id)
+        rows = pending_rows(mark.last_reading_id, config['EDGE_SYNC_BATCH'])
+        db.session.rollback()   # end the read transaction before the (slow) upload
+        if not rows:
+            return sent
+        result = post_batch(config, encode_batch(site_id, mark.last_reading_id, rows))
+
+        mark = _watermark(site_id)
+        if 'accepted' not in result:
+            echo(f'Central watermark is {result["watermark"]}; resending from there')
+        else:
+            sent += result['accepted']
+            echo(f'Shipped readings {rows[0][0]}-{rows[-1][0]}: {result["accepted"]} stored, '
+                 f'{result["skipped"]} already present')
+        mark.last_reading_id = result['watermark']
+        db.session.commit()
+        if 'accepted' in result and len(rows) < config['EDGE_SYNC_BATCH']:
+            return sent
+
+
+def prune(site_id, keep_days):
+    """Delete readings that were shipped and are older than ``keep_days``; returns the count"""
+    mark = db.session.get(SyncWatermark, site_id)
+    if mark is None or not mark.last_reading_id:
+        return 0
+    removed = db.session.execute(delete(Reading).where(
+        Reading.reading_id <= mark.last_reading_id,
+        Reading.reading_timestamp < datetime.utcnow() - timedelta(days=keep_days)
+    )).rowcount
+    if removed:
+        cache.bump_version('Reading')
+    db.session.commit()
+    return removed
+
+
+def run(config, loop=False, keep_days=None, echo=print):
+    """Sync once, or forever every EDGE_SYNC_INTERVAL seconds backing off while offline.
+
+    With ``keep_days``, shipped readings older than that are pruned after
+    each successful sync.
+    """
+    delay = config['EDGE_SYNC_INTERVAL']
+    while True:
+        try:
+            sync(config, echo)
+            delay = config['EDGE_SYNC_INTERVAL']
+            if keep_days is not None:
+                removed = prune(config['EDGE_SITE_ID'], keep_days)
+                if removed:
+                    echo(f'Pruned {removed} shipped readings')
+        except SyncError as e:
+            db.session.rollback()
+            if not loop:
+                raise
+            echo(f'{e}; retrying in {delay} s')
+            time.sleep(delay)
+            delay = min(delay * 2, config['EDGE_SYNC_MAX_BACKOFF'])
+            continue
+        if not loop:
+            return
+        time.sleep(delay)
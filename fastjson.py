@@ -0,0 +1,31 @@
+"""JSON encoding for large API payloads, using orjson when it is installed"""
+from datetime import date
+from decimal import Decimal
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload):
+    """Encode ``payload`` to UTF-8 JSON bytes; dates and Decimals are supported"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def response(payload, status=200):
+    """A JSON response encoded with ``dumps`` (the jsonify counterpart)"""
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,121 @@
+"""Column-projected sensor queries with sparse fieldsets"""
+from flask import has_app_context
+from sqlalchemy import func, select
+
+import search_index
+from models import Sensor, SensorType, Location
+
+# Every field a client may request, mapped to the column it is read from
+SENSOR_FIELDS = {
+    'sensor_id': Sensor.sensor_id,
+    'model': Sensor.model,
+    'install_date': Sensor.install_date,
+    'status': Sensor.status,
+    'type_id': Sensor.type_id,
+    'location_id': Sensor.location_id,
+    'sensor_type': SensorType.name,
+    'location_name': Location.area_name,
+    'latitude': Location.latitude,
+    'longitude': Location.longitude,
+    'elevation': Location.elevation,
+    'created_at': Sensor.created_at,
+    'updated_at': Sensor.updated_at,
+}
+
+# Same keys as Sensor.to_dict, so existing clients see no difference
+DEFAULT_FIELDS = ('sensor_id', 'model', 'install_date', 'status', 'type_id', 'location_id',
+                  'sensor_type', 'location_name', 'created_at', 'updated_at')
+
+# Fixed-width columns from Sensor and Location; lists of only these (a map's
+# ``sensor_id,latitude,longitude``) may be fetched in much larger pages
+NARROW_FIELDS = {'sensor_id', 'status', 'type_id', 'location_id', 'latitude', 'longitude', 'elevation'}
+
+_TYPE_FIELDS = {'sensor_type'}
+_LOCATION_FIELDS = {'location_name', 'latitude', 'longitude', 'elevation'}
+_NUMERIC_FIELDS = ('latitude', 'longitude', 'elevation')
+
+
+def parse_fields(value):
+    """Field names from a ``fields=a,b,c`` argument; raises ValueError for unknown names"""
+    if not value:
+        return DEFAULT_FIELDS
+    fields = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in SENSOR_FIELDS]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    return tuple(fields) or DEFAULT_FIELDS
+
+
+def parse_ids(value):
+    """Sensor ids from an ``ids=1,2,3`` argument; raises ValueError for non-integers"""
+    if not value:
+        return None
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+def _filtered(query, ids, status, type_id, location_id, search):
+    if ids is not None:
+        query = query.where(Sensor.sensor_id.in_(ids))
+    if status:
+        query = query.where(Sensor.status == status)
+    if type_id:
+        query = query.where(Sensor.type_id == type_id)
+    if location_id:
+        query = query.where(Sensor.location_id == location_id)
+    if search:
+        # The async tier runs without the Flask app and its search index
+        query = query.where(search_index.clause('sensor', search) if has_app_context()
+                            else Sensor.model.like(f'%{search}%'))
+    return query
+
+
+def sensor_query(fields, ids=None, status=None, type_id=None, location_id=None, search=None,
+                 page=None, per_page=None):
+    """One SELECT of just the requested columns, joining only the tables they need"""
+    query = select(*(SENSOR_FIELDS[name].label(name) for name in fields)).select_from(Sensor)
+    if _TYPE_FIELDS.intersection(fields):
+        query = query.outerjoin(SensorType, Sensor.type_id == SensorType.type_id)
+    if _LOCATION_FIELDS.intersection(fields):
+        query = query.outerjoin(Location, Sensor.location_id == Location.location_id)
+
+    query = _filtered(query, ids, status, type_id, location_id, search).order_by(Sensor.sensor_id)
+    if per_page:
+        query = query.limit(per_page).offset((page - 1) * per_page)
+    return query
+
+
+def sensor_count_query(ids=None, status=None, type_id=None, location_id=None, search=None):
+    """COUNT of the sensors ``sensor_query`` pages through, from the Sensor indexes alone"""
+    return _filtered(select(func.count()).select_from(Sensor), ids, status, type_id, location_id, search)
+
+
+def parse_page(args, config, fields=None):
+    """(page, per_page) from query arguments; raises ValueError on bad input.
+
+    ``per_page`` is capped at ``API_MAX_PAGE_SIZE``, or at
+    ``API_MAX_NARROW_PAGE_SIZE`` when ``fields`` are all narrow.
+    """
+    page = int(args.get('page') or 1)
+    if page < 1:
+        raise ValueError('page must be at least 1')
+    per_page = int(args.get('per_page') or config['API_PAGE_SIZE'])
+    narrow = fields is not None and NARROW_FIELDS.issuperset(fields)
+    limit = config['API_MAX_NARROW_PAGE_SIZE'] if narrow else config['API_MAX_PAGE_SIZE']
+    return page, max(1, min(per_page, limit))
+
+
+def page_info(page, per_page, total):
+    """Pagination fields of a list response"""
+    return {'page': page, 'per_page': per_page, 'total': total, 'pages': -(-total // per_page)}
+
+
+def to_dicts(fields, rows):
+    """Plain dicts for the encoder; only coordinates need converting from Decimal"""
+    records = [dict(zip(fields, row)) for row in rows]
+    numeric = [name for name in _NUMERIC_FIELDS if name in fields]
+    if numeric:
+        for record in records:
+            for name in numeric:
+                if record[name] is not None:
+                    record[name] = float(record[name])
+    return records
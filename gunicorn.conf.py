@@ -0,0 +1,33 @@
+"""Gunicorn settings: ``gunicorn -c gunicorn.conf.py app:app`` (needs the ``server`` extra).
+
+The app is imported once in the master (``preload_app``), which also
+configures mappers, compiles templates and loads the reference caches so
+every worker inherits them. Each worker then opens its pool connections,
+refreshes the caches and requests ``WARMUP_PATHS`` before it accepts
+connections. See warmup.py.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+preload_app = True
+
+
+def when_ready(server):
+    """Warm the master once, before the first worker is forked"""
+    import warmup
+    from app import app
+    if app.config['WARMUP_ENABLED']:
+        warmup.warm(app, warmup.MASTER_PHASES)
+    # Connections opened in the master must not be shared with the workers
+    warmup.release(app)
+
+
+def post_worker_init(worker):
+    """Warm a worker; it starts accepting connections when this returns"""
+    import warmup
+    app = worker.wsgi
+    if app.config['WARMUP_ENABLED']:
+        warmup.warm(app, warmup.WORKER_PHASES)
@@ -0,0 +1,408 @@
+"""Spatial interpolation of sensor readings onto a regular lat/lon grid"""
+import heapq
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from operator import add
+
+from sqlalchemy import and_, func, select
+
+import cache
+import chunkstore
+import metrics
+import shards
+from models import db, Sensor, Reading
+
+# Cached rasters keyed by (type_id, window, resolution, method, aggregate)
+_raster_cache = {}
+_raster_lock = threading.Lock()
+_MAX_CACHED_RASTERS = 128
+
+# IDW neighbour weights keyed by point positions, bounds, resolution, power
+# and neighbour count; a 200x200 entry of 16 neighbours is about 8 MB
+_weights_cache = OrderedDict()
+_weights_lock = threading.Lock()
+_MAX_CACHED_WEIGHTS = 8
+
+
+def _window_totals(sensors, start, end):
+    """(sensor_id, sum, count) of the readings of ``sensors`` (a WHERE clause) in [start, end]"""
+    return select(
+        Reading.sensor_id, func.sum(Reading.reading_value), func.count(Reading.reading_id)
+    ).where(
+        sensors, Reading.reading_timestamp >= start, Reading.reading_timestamp <= end
+    ).group_by(Reading.sensor_id)
+
+
+def _window_latest(sensors, start, end):
+    """(sensor_id, reading_timestamp, reading_value) of each sensor's newest readings in [start, end]"""
+    newest = select(
+        Reading.sensor_id, func.max(Reading.reading_timestamp).label('ts')
+    ).where(
+        sensors, Reading.reading_timestamp >= start, Reading.reading_timestamp <= end
+    ).group_by(Reading.sensor_id).subquery()
+    return select(Reading.sensor_id, Reading.reading_timestamp, Reading.reading_value).join(
+        newest, and_(Reading.sensor_id == newest.c.sensor_id, Reading.reading_timestamp == newest.c.ts)
+    )
+
+
+def _compacted_rows(sensor_ids, start, end, aggregate):
+    """Rows shaped like ``_window_latest``/``_window_totals`` for readings compacted into chunks.
+
+    Only sensors whose compacted history overlaps the window cost a query,
+    so recent windows read no chunks at all.
+    """
+    rows = []
+    if not chunkstore.index.refresh(db.session):
+        return rows
+    for sensor_id in sensor_ids:
+        if aggregate == 'latest':
+            newest = chunkstore.window_rows(db.session, sensor_id, start, end, limit=1)
+            rows.extend((sensor_id, row.reading_timestamp, row.reading_value) for row in newest)
+        else:
+            stats = chunkstore.window_stats(db.session, sensor_id, start, end)
+            if stats is not None:
+                rows.append((sensor_id, stats[3], stats[0]))
+    return rows
+
+
+def location_values(type_id, start, end, aggregate='avg'):
+    """Return one value per location for a sensor type over a time window.
+
+    ``aggregate='avg'`` averages every reading in the window, ``'latest'``
+    averages the most recent reading of each sensor at the location.
+    Readings on other shards and compacted readings are included: each
+    source gives per-sensor partials, which are folded into locations here.
+    """
+    sensors = {sensor.sensor_id: sensor for sensor in cache.sensors() if sensor.type_id == type_id}
+    query = _window_latest if aggregate == 'latest' else _window_totals
+    # Shards have no Sensor table, so they are filtered by id
+    remote = shards.scatter(query(Reading.sensor_id.in_(list(sensors)), start, end)) if sensors else None
+    rows = db.session.execute(query(
+        Reading.sensor_id.in_(select(Sensor.sensor_id).where(Sensor.type_id == type_id)), start, end
+    )).all()
+    if remote:
+        rows += remote.rows()
+    rows += _compacted_rows(sensors, start, end, aggregate)
+
+    # {sensor_id: [sum, count]}; for 'latest', of the values at the newest timestamp
+    partials, newest = {}, {}
+    for row in rows:
+        if aggregate == 'latest':
+            sensor_id, timestamp, value = row
+            if newest.get(sensor_id) is not None and timestamp < newest[sensor_id]:
+                continue
+            if newest.get(sensor_id) != timestamp:
+                newest[sensor_id], partials[sensor_id] = timestamp, [0.0, 0]
+            partials[sensor_id][0] += float(value)
+            partials[sensor_id][1] += 1
+        else:
+            sensor_id, total, count = row
+            entry = partials.setdefault(sensor_id, [0.0, 0])
+            entry[0] += float(total or 0)
+            entry[1] += count
+
+    # {LocationRef: [sum, count, sensors]}
+    locations = {}
+    for sensor_id, (total, count) in partials.items():
+        sensor = sensors.get(sensor_id)
+        if sensor is None or sensor.location is None or not count:
+            continue
+        entry = locations.setdefault(sensor.location, [0.0, 0, 0])
+        if aggregate == 'latest':
+            # Each sensor's latest value weighs the same
+            entry[0] += total / count
+            entry[1] += 1
+        else:
+            entry[0] += total
+            entry[1] += count
+        entry[2] += 1
+
+    points = []
+    for location, (total, count, sensor_count) in sorted(locations.items()):
+        points.append({
+            'location_id': location.location_id,
+            'area_name': location.area_name,
+            'latitude': float(location.latitude),
+            'longitude': float(location.longitude),
+            'value': total / count,
+            'sensors': sensor_count,
+        })
+    return points
+
+
+def grid_bounds(points, padding=0.05):
+    """Bounding box around the points, padded so edge sensors aren't on the border"""
+    lats = [p['latitude'] for p in points]
+    lons = [p['longitude'] for p in points]
+    min_lat, max_lat = min(lats), max(lats)
+    min_lon, max_lon = min(lons), max(lons)
+    pad_lat = max((max_lat - min_lat) * padding, 0.001)
+    pad_lon = max((max_lon - min_lon) * padding, 0.001)
+    return {
+        'min_lat': min_lat - pad_lat,
+        'max_lat': max_lat + pad_lat,
+        'min_lon': min_lon - pad_lon,
+        'max_lon': max_lon + pad_lon,
+    }
+
+
+def _axes(bounds, resolution):
+    """Cell-centre coordinates along each axis"""
+    lat_step = (bounds['max_lat'] - bounds['min_lat']) / resolution
+    lon_step = (bounds['max_lon'] - bounds['min_lon']) / resolution
+    lats = [bounds['min_lat'] + (i + 0.5) * lat_step for i in range(resolution)]
+    lons = [bounds['min_lon'] + (j + 0.5) * lon_step for j in range(resolution)]
+    return lats, lons
+
+
+def _squared_offsets(points, bounds, resolution):
+    """Per-row and per-column squared offsets to every point.
+
+    Longitudes are scaled by cos(latitude) so distances are roughly
+    isotropic. Precomputing both axes turns each cell distance into a
+    single addition instead of a full projection.
+    """
+    lats, lons = _axes(bounds, resolution)
+    scale = math.cos(math.radians((bounds['min_lat'] + bounds['max_lat']) / 2))
+    pts_y = [p['latitude'] for p in points]
+    pts_x = [p['longitude'] * scale for p in points]
+    dy2 = [[(lat - y) ** 2 for y in pts_y] for lat in lats]
+    dx2 = [[(lon * scale - x) ** 2 for x in pts_x] for lon in lons]
+    return dy2, dx2
+
+
+def bin_points(points, bounds, limit):
+    """At most ``limit`` points: those in the same cell of a coarse grid are merged.
+
+    Interpolation costs cells x points (and kriging's solve points cubed),
+    so a dense network is interpolated from one point per bin, placed and
+    valued by the sensor-weighted mean of its locations. Networks within
+    the limit are returned as they are.
+    """
+    if len(points) <= limit:
+        return points
+    side = max(1, math.isqrt(limit))
+    lat_span = (bounds['max_lat'] - bounds['min_lat']) / side
+    lon_span = (bounds['max_lon'] - bounds['min_lon']) / side
+    bins = {}
+    for p in points:
+        row = min(int((p['latitude'] - bounds['min_lat']) / lat_span), side - 1)
+        col = min(int((p['longitude'] - bounds['min_lon']) / lon_span), side - 1)
+        weight = p.get('sensors') or 1
+        total = bins.setdefault((row, col), [0.0, 0.0, 0.0, 0])
+        total[0] += p['latitude'] * weight
+        total[1] += p['longitude'] * weight
+        total[2] += p['value'] * weight
+        total[3] += weight
+    return [{'latitude': lat / weight, 'longitude': lon / weight, 'value': value / weight, 'sensors': weight}
+            for lat, lon, value, weight in bins.values()]
+
+
+def _idw_weights(points, bounds, resolution, power, neighbours):
+    """(k, indices, weights): each cell's ``k`` nearest points and normalised weights, row by row.
+
+    Weights depend only on where the points are, so they are cached; a
+    raster of new values at the same locations costs k multiplications
+    per cell.
+    """
+    key = (tuple((p['latitude'], p['longitude']) for p in points),
+           tuple(bounds.values()), resolution, power, neighbours)
+    with _weights_lock:
+        entry = _weights_cache.get(key)
+        if entry is not None:
+            _weights_cache.move_to_end(key)
+            return entry
+
+    dy2, dx2 = _squared_offsets(points, bounds, resolution)
+    half_power = power / 2.0
+    k = min(neighbours, len(points))
+    candidates = range(len(points))
+    indices, weights = array('i'), array('d')
+    for row_dy2 in dy2:
+        for col_dx2 in dx2:
+            d2 = list(map(add, row_dy2, col_dx2))
+            nearest = heapq.nsmallest(k, candidates, key=d2.__getitem__)
+            if d2[nearest[0]] == 0.0:
+                # A cell centred on a point takes its value exactly
+                cell = [1.0] + [0.0] * (k - 1)
+            else:
+                cell = [1.0 / d2[i] ** half_power for i in nearest]
+                total = sum(cell)
+                cell = [w / total for w in cell]
+            indices.extend(nearest)
+            weights.extend(cell)
+
+    entry = (k, indices, weights)
+    with _weights_lock:
+        _weights_cache[key] = entry
+        while len(_weights_cache) > _MAX_CACHED_WEIGHTS:
+            _weights_cache.popitem(last=False)
+    return entry
+
+
+def idw_grid(points, bounds, resolution, power=2.0, neighbours=16):
+    """Inverse distance weighted raster over each cell's nearest points, row 0 is the southern edge"""
+    values = [p['value'] for p in points]
+    k, indices, weights = _idw_weights(points, bounds, resolution, power, neighbours)
+    grid, offset = [], 0
+    for _ in range(resolution):
+        row = []
+        for _ in range(resolution):
+            end = offset + k
+            row.append(sum(values[i] * w for i, w in zip(indices[offset:end], weights[offset:end])))
+            offset = end
+        grid.append(row)
+    return grid
+
+
+def _solve(matrix, rhs):
+    """Gaussian elimination with partial pivoting; returns None if singular"""
+    n = len(rhs)
+    a = [list(matrix[i]) + [rhs[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            return None
+        a[col], a[pivot] = a[pivot], a[col]
+        for r in range(col + 1, n):
+            factor = a[r][col] / a[col][col]
+            if factor:
+                for c in range(col, n + 1):
+                    a[r][c] -= factor * a[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (a[r][n] - sum(a[r][c] * x[c] for c in range(r + 1, n))) / a[r][r]
+    return x
+
+
+def kriging_grid(points, bounds, resolution):
+    """Ordinary kriging raster using an exponential variogram.
+
+    The system is solved once in dual form, so each cell costs one pass
+    over the points. Returns None when the system is degenerate (fewer
+    than three locations or collinear duplicates), callers fall back to IDW.
+    """
+    n = len(points)
+    if n < 3:
+        return None
+
+    values = [p['value'] for p in points]
+    mean = sum(values) / n
+    sill = sum((v - mean) ** 2 for v in values) / n
+    if sill == 0.0:
+        return [[mean] * resolution for _ in range(resolution)]
+
+    scale = math.cos(math.radians((bounds['min_lat'] + bounds['max_lat']) / 2))
+    coords = [(p['latitude'], p['longitude'] * scale) for p in points]
+    max_dist = max(math.dist(a, b) for a in coords for b in coords)
+    effective_range = max_dist / 3.0 or 1e-6
+
+    def gamma_from_d2(d2):
+        return sill * (1.0 - math.exp(-3.0 * math.sqrt(d2) / effective_range))
+
+    matrix = [[gamma_from_d2((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) for b in coords] + [1.0]
+              for a in coords]
+    matrix.append([1.0] * n + [0.0])
+    weights = _solve(matrix, values + [0.0])
+    if weights is None:
+        return None
+    coeffs, mu = weights[:n], weights[n]
+
+    dy2, dx2 = _squared_offsets(points, bounds, resolution)
+    grid = []
+    for row_dy2 in dy2:
+        row = []
+        for col_dx2 in dx2:
+            row.append(mu + sum(
+                c * gamma_from_d2(dy + dx) for c, dy, dx in zip(coeffs, row_dy2, col_dx2)
+            ))
+        grid.append(row)
+    return grid
+
+
+def interpolate(points, resolution, method='idw', power=2.0, max_points=256, kriging_points=100,
+                neighbours=16):
+    """(bounds, grid, method used) for ``points``, binned down to the method's point limit"""
+    bounds = grid_bounds(points)
+    if method == 'kriging':
+        grid = kriging_grid(bin_points(points, bounds, kriging_points), bounds, resolution)
+        if grid is not None:
+            return bounds, grid, method
+    return bounds, idw_grid(bin_points(points, bounds, max_points), bounds, resolution, power, neighbours), 'idw'
+
+
+def build_raster(type_id, start, end, resolution, method='idw', aggregate='avg', power=2.0,
+                 max_points=256, kriging_points=100, neighbours=16):
+    """Compute a heatmap raster payload for the given sensor type and window"""
+    points = location_values(type_id, start, end, aggregate)
+    payload = {
+        'type_id': type_id,
+        'method': method,
+        'aggregate': aggregate,
+        'window': {'start': start.isoformat(), 'end': end.isoformat()},
+        'rows': resolution,
+        'cols': resolution,
+        'points': points,
+        'bounds': None,
+        'grid': [],
+        'generated_at': datetime.utcnow().isoformat(),
+    }
+    if not points:
+        return payload
+
+    bounds, grid, payload['method'] = interpolate(points, resolution, method, power, max_points,
+                                                  kriging_points, neighbours)
+    payload['bounds'] = bounds
+    payload['grid'] = [[round(v, 4) for v in row] for row in grid]
+    return payload
+
+
+def parse_window(args, default_hours=24):
+    """Read ``start``/``end`` or ``hours`` query args into a (start, end) pair"""
+    fmt = '%Y-%m-%dT%H:%M'
+    end = datetime.strptime(args['end'], fmt) if args.get('end') else datetime.utcnow()
+    if args.get('start'):
+        start = datetime.strptime(args['start'], fmt)
+    else:
+        hours = args.get('hours', default_hours, type=int)
+        if hours <= 0:
+            raise ValueError('hours must be positive')
+        try:
+            start = end - timedelta(hours=hours)
+        except OverflowError:
+            raise ValueError('hours reaches before the earliest supported date')
+    if start > end:
+        raise ValueError('start must be before end')
+    return start, end
+
+
+def cached_raster(key, ttl, builder):
+    """Return a cached raster for ``key`` or build and store a fresh one"""
+    now = time.monotonic()
+    with _raster_lock:
+        entry = _raster_cache.get(key)
+        if entry and now - entry[0] < ttl:
+            metrics.cache_result('heatmap_raster', True)
+            return entry[1]
+
+    metrics.cache_result('heatmap_raster', False)
+    payload = builder()
+
+    with _raster_lock:
+        if len(_raster_cache) >= _MAX_CACHED_RASTERS:
+            oldest = min(_raster_cache, key=lambda k: _raster_cache[k][0])
+            del _raster_cache[oldest]
+        _raster_cache[key] = (now, payload)
+    return payload
+
+
+def clear_cache():
+    """Drop all cached rasters and interpolation weights"""
+    with _raster_lock:
+        _raster_cache.clear()
+    with _weights_lock:
+        _weights_cache.clear()
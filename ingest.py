@@ -0,0 +1,119 @@
+"""Validation and bulk insert of readings posted by gateways"""
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import select
+
+import latest
+import shards
+from models import db, Reading, SensorLatest
+
+
+class IngestError(ValueError):
+    """Raised when a reading payload is rejected"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def _parse_timestamp(value, default):
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    # Accept 'YYYY-MM-DDTHH:MM[:SS]', naive (UTC) or with 'Z' or an offset
+    timestamp = datetime.fromisoformat(str(value))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def parse_readings(payload, known_sensor_ids):
+    """Validate a JSON payload into a list of Reading insert dicts.
+
+    ``payload`` is either a single reading object or ``{"readings": [...]}``.
+    The rules mirror the ``before_reading_insert`` trigger so bad rows are
+    rejected up front instead of failing the whole batch in the database.
+    """
+    if isinstance(payload, dict) and 'readings' in payload:
+        items = payload['readings']
+    else:
+        items = [payload]
+    if not isinstance(items, list) or not items:
+        raise IngestError(['Expected a reading object or a non-empty "readings" list'])
+
+    now = datetime.utcnow()
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append(f'readings[{index}]: expected an object')
+            continue
+        try:
+            sensor_id = int(item.get('sensor_id'))
+        except (TypeError, ValueError):
+            errors.append(f'readings[{index}]: sensor_id is required')
+            continue
+        if sensor_id not in known_sensor_ids:
+            errors.append(f'readings[{index}]: unknown sensor {sensor_id}')
+            continue
+        try:
+            value = Decimal(str(item.get('reading_value')))
+            if not value.is_finite():
+                raise InvalidOperation
+        except (InvalidOperation, ValueError):
+            errors.append(f'readings[{index}]: reading_value must be a number')
+            continue
+        try:
+            timestamp = _parse_timestamp(item.get('reading_timestamp'), now)
+        except (TypeError, ValueError, OverflowError):
+            errors.append(f'readings[{index}]: invalid reading_timestamp')
+            continue
+        if timestamp > now:
+            errors.append(f'readings[{index}]: reading timestamp cannot be in the future')
+            continue
+        rows.append({
+            'sensor_id': sensor_id,
+            'reading_value': value,
+            'reading_timestamp': timestamp,
+        })
+
+    if errors:
+        raise IngestError(errors)
+    return rows
+
+
+def insert_readings(rows):
+    """Insert validated rows with a single executemany (one per shard when sharded)"""
+    if rows and shards.enabled():
+        latest.record(shards.insert_readings(rows))
+    elif rows:
+        db.session.execute(Reading.__table__.insert(), rows)
+    return len(rows)
+
+
+def latest_query(rows):
+    """Latest known timestamp of each sensor in ``rows``"""
+    sensor_ids = {row['sensor_id'] for row in rows}
+    return select(SensorLatest.sensor_id, SensorLatest.reading_timestamp).where(
+        SensorLatest.sensor_id.in_(sensor_ids)
+    )
+
+
+def has_backfill(rows, latest):
+    """True if any row predates ``latest[sensor_id]``"""
+    return any(
+        latest.get(row['sensor_id']) is not None and row['reading_timestamp'] < latest[row['sensor_id']]
+        for row in rows
+    )
+
+
+def is_backfill(rows):
+    """True if any row is older than its sensor's current latest reading.
+
+    New latest readings are visible through SensorLatest; only
+    out-of-order inserts need to invalidate cached reading history.
+    """
+    if not rows:
+        return False
+    return has_backfill(rows, dict(db.session.execute(latest_query(rows)).all()))
@@ -0,0 +1,107 @@
+"""In-process background jobs with progress reporting"""
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from models import db
+
+
+class Job:
+    """State of one background job, updated by the job function as it runs"""
+
+    def __init__(self, name, key=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.key = key
+        self.status = 'queued'
+        self.progress = 0
+        self.total = None
+        self.message = ''
+        self.result = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100.0 if self.status == 'done' else 0.0
+        return min(100.0, self.progress * 100.0 / self.total)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'name': self.name,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'percent': round(self.percent, 1),
+            'message': self.message,
+            'result': self.result,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobRunner:
+    """Runs jobs on a thread pool inside an application context.
+
+    Job state lives in this process only; a deployment with several
+    workers reports progress from the worker that accepted the job.
+    """
+
+    def __init__(self, keep=100):
+        self._jobs = OrderedDict()
+        self._keep = keep
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def submit(self, app, name, func, *args, key=None):
+        """Queue ``func(job, *args)``; returns the running job for ``key`` if any"""
+        with self._lock:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and job.active:
+                        return job
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'],
+                                                thread_name_prefix='job')
+            job = Job(name, key)
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self._keep:
+                oldest = next(iter(self._jobs))
+                if self._jobs[oldest].active:
+                    break
+                del self._jobs[oldest]
+        self._pool.submit(self._run, app, job, func, args)
+        return job
+
+    def _run(self, app, job, func, args):
+        with app.app_context():
+            job.status = 'running'
+            try:
+                job.result = func(job, *args)
+                job.status = 'done'
+            except Exception as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.message = str(e)
+            finally:
+                job.finished_at = datetime.utcnow()
+                db.session.remove()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def active(self, key_prefix=''):
+        """Jobs still queued or running whose key starts with ``key_prefix``"""
+        return [job for job in list(self._jobs.values())
+                if job.active and str(job.key or '').startswith(key_prefix)]
+
+
+runner = JobRunner()
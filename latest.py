@@ -0,0 +1,89 @@
+"""Maintenance helpers for the SensorLatest table"""
+from sqlalchemy import select, update
+
+import shards
+from models import db, Sensor, Reading, SensorLatest
+
+
+def _newest_query(sensor_id):
+    return select(
+        Reading.reading_id, Reading.reading_value, Reading.reading_timestamp
+    ).where(
+        Reading.sensor_id == sensor_id
+    ).order_by(
+        Reading.reading_timestamp.desc(), Reading.reading_id.desc()
+    ).limit(1)
+
+
+def _newest_reading(sensor_id):
+    remote = shards.scatter(_newest_query(sensor_id)) if shards.enabled() else None
+    rows = db.session.execute(_newest_query(sensor_id)).all()
+    if remote:
+        rows += remote.rows()
+    return max(rows, key=lambda row: (row.reading_timestamp, row.reading_id), default=None)
+
+
+def record(rows):
+    """Advance SensorLatest to readings stored in other databases (shards).
+
+    ``rows`` are (sensor_id, reading_id, reading_value, reading_timestamp);
+    the schema.sql triggers only see readings inserted into this database.
+    """
+    for row in rows:
+        advanced = db.session.execute(update(SensorLatest).where(
+            SensorLatest.sensor_id == row.sensor_id,
+            SensorLatest.reading_timestamp <= row.reading_timestamp
+        ).values(
+            reading_id=row.reading_id, reading_value=row.reading_value,
+            reading_timestamp=row.reading_timestamp
+        )).rowcount
+        if not advanced and db.session.get(SensorLatest, row.sensor_id) is None:
+            db.session.add(SensorLatest(sensor_id=row.sensor_id, reading_id=row.reading_id,
+                                        reading_value=row.reading_value,
+                                        reading_timestamp=row.reading_timestamp))
+
+
+def refresh_sensor(sensor_id):
+    """Recompute one sensor's SensorLatest row; returns True if it changed"""
+    newest = _newest_reading(sensor_id)
+    current = SensorLatest.query.get(sensor_id)
+
+    if newest is None:
+        if current is None:
+            return False
+        db.session.delete(current)
+        return True
+
+    if current is not None and current.reading_id == newest.reading_id \
+            and current.reading_value == newest.reading_value \
+            and current.reading_timestamp == newest.reading_timestamp:
+        return False
+
+    if current is None:
+        current = SensorLatest(sensor_id=sensor_id)
+        db.session.add(current)
+    current.reading_id = newest.reading_id
+    current.reading_value = newest.reading_value
+    current.reading_timestamp = newest.reading_timestamp
+    return True
+
+
+def rebuild(check_only=False):
+    """Verify every sensor's SensorLatest row and fix any that drifted.
+
+    Uses one indexed (sensor_id, reading_timestamp) lookup per sensor, so
+    the cost grows with the number of sensors rather than the history.
+    Returns the ids of sensors whose row was (or, with ``check_only``,
+    would be) changed.
+    """
+    changed = []
+    sensor_ids = [row[0] for row in db.session.query(Sensor.sensor_id).order_by(Sensor.sensor_id)]
+    for sensor_id in sensor_ids:
+        if refresh_sensor(sensor_id):
+            changed.append(sensor_id)
+    # Rows for sensors that no longer exist are removed by the FK cascade
+    if check_only:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    return changed
@@ -0,0 +1,109 @@
+"""Paginated list views with filter counts.
+
+Each list shows how many rows every filter option would give, with the
+other filters applied. All of them come from one GROUP BY over the filter
+columns, folded in Python, and the same fold gives the row total for the
+pagination, so paging needs no separate COUNT query. The unfiltered
+grouping is cached until its table's version changes.
+"""
+from collections import namedtuple
+
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import func
+
+import cache
+from models import db, Sensor, MaintenanceEvent
+
+# total: rows matching every filter; counts: {facet: {value: rows}}
+Facets = namedtuple('Facets', 'total counts')
+
+
+def fold(rows, selected):
+    """Facets from grouped (value per facet..., count) rows.
+
+    ``selected`` maps each facet, in column order, to its filter value
+    ('' or None for no filter). A facet's counts apply every filter but
+    its own, so each option shows the rows choosing it would give.
+    """
+    names = list(selected)
+    wanted = [str(selected[name]) if selected[name] not in (None, '') else None for name in names]
+    counts = {name: {} for name in names}
+    total = 0
+    for row in rows:
+        values, count = row[:-1], row[-1]
+        matched = [want is None or str(value) == want for value, want in zip(values, wanted)]
+        misses = matched.count(False)
+        if not misses:
+            total += count
+        for index, name in enumerate(names):
+            if misses == 0 or (misses == 1 and not matched[index]):
+                facet = counts[name]
+                facet[values[index]] = facet.get(values[index], 0) + count
+    return Facets(total, counts)
+
+
+def paginate(query, page, per_page, total):
+    """Flask-SQLAlchemy pagination of ``query`` using an already known total"""
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+    pagination.total = total
+    return pagination
+
+
+class MergedPagination(Pagination):
+    """Pagination over rows already fetched and merged in Python, up to the end of the page"""
+
+    def _query_items(self):
+        return self._query_args['rows'][self._query_offset:self._query_offset + self.per_page]
+
+    def _query_count(self):
+        return self._query_args['total']
+
+
+def paginate_merged(rows, page, per_page, total):
+    """Pagination of ``rows``, which hold at least every row up to the end of ``page``"""
+    return MergedPagination(page=page, per_page=per_page, max_per_page=None, error_out=False,
+                            rows=rows, total=total)
+
+
+# =====================================================
+# SENSORS
+# =====================================================
+
+SENSOR_GROUPS = (Sensor.status, Sensor.type_id, Sensor.location_id)
+
+
+@cache.reference_cache.loader('sensor_facets', 'Sensor')
+def _sensor_groups():
+    return tuple(db.session.query(*SENSOR_GROUPS, func.count()).group_by(*SENSOR_GROUPS).all())
+
+
+def sensor_facets(search=None, status=None, type_id=None, location_id=None):
+    """Counts by status, type and location; ``search`` is a WHERE clause on Sensor"""
+    if search is None:
+        rows = cache.reference_cache.get('sensor_facets')
+    else:
+        rows = db.session.query(*SENSOR_GROUPS, func.count()).filter(search).group_by(*SENSOR_GROUPS).all()
+    return fold(rows, {'status': status, 'type': type_id, 'location': location_id})
+
+
+# =====================================================
+# MAINTENANCE EVENTS
+# =====================================================
+
+MAINTENANCE_GROUPS = (MaintenanceEvent.tech_id, MaintenanceEvent.event_type)
+
+
+@cache.reference_cache.loader('maintenance_facets', 'MaintenanceEvent')
+def _maintenance_groups():
+    return tuple(db.session.query(*MAINTENANCE_GROUPS, func.count()).group_by(*MAINTENANCE_GROUPS).all())
+
+
+def maintenance_facets(sensor_id=None, tech_id=None, event_type=None):
+    """Counts by technician and event type, within one sensor's events if given"""
+    if not sensor_id:
+        rows = cache.reference_cache.get('maintenance_facets')
+    else:
+        rows = db.session.query(*MAINTENANCE_GROUPS, func.count()).filter(
+            MaintenanceEvent.sensor_id == sensor_id
+        ).group_by(*MAINTENANCE_GROUPS).all()
+    return fold(rows, {'tech': tech_id, 'event_type': event_type})
@@ -0,0 +1,419 @@
+"""Prometheus-style metrics collected per process and served at /metrics.
+
+Recording is lock-free on the hot path: every thread increments its own
+shard of plain dicts, and shards are only merged when metrics are
+scraped. Threads that have exited are folded into a retired shard so
+nothing is lost and the shard list stays bounded.
+
+With several worker processes, set ``METRICS_DIR`` to a directory shared
+by the workers. Each worker writes its totals there at most every
+``METRICS_FLUSH_INTERVAL`` seconds (from the request hooks, so there is
+no background thread) and /metrics merges every worker's file. Counters
+and histograms of exited workers are kept, as Prometheus expects of a
+counter; their pool gauges are dropped.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import Response, current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+DESCRIPTIONS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time from request start to the last byte sent'),
+    'http_response_bytes_total': ('counter', 'Response body bytes sent, after compression'),
+    'db_queries_total': ('counter', 'SQL statements executed, by endpoint'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent executing SQL, by endpoint'),
+    'ingest_readings_total': ('counter', 'Readings accepted by the ingest API'),
+    'cache_requests_total': ('counter', 'Cache lookups, by cache and result (hit or miss)'),
+    'db_pool_connections': ('gauge', 'Connection pool state per worker'),
+}
+
+
+# =====================================================
+# PER-THREAD SHARDS
+# =====================================================
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def merge(self, counters, histograms):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in histograms.items():
+            current = self.histograms.get(key)
+            if current is None:
+                self.histograms[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    current[index] += value
+
+
+_local = threading.local()
+_shards = []          # (thread, shard) of live threads
+_retired = _Shard()   # totals of threads that have exited
+_shards_lock = threading.Lock()
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def inc(name, amount=1, **labels):
+    """Add ``amount`` to counter ``name``"""
+    counters = _shard().counters
+    key = (name, tuple(sorted(labels.items())))
+    counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Record ``value`` in histogram ``name``"""
+    histograms = _shard().histograms
+    key = (name, tuple(sorted(labels.items())))
+    values = histograms.get(key)
+    if values is None:
+        # One count per bucket, +Inf, then the sum
+        values = histograms[key] = [0] * (len(BUCKETS) + 2)
+    values[bisect_left(BUCKETS, value)] += 1
+    values[-1] += value
+
+
+def cache_result(cache, hit):
+    inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def snapshot():
+    """This process's totals as (counters, histograms)"""
+    totals = _Shard()
+    with _shards_lock:
+        alive = []
+        for thread, shard in _shards:
+            # dict.copy() is atomic under the GIL, so owners need no lock
+            counters, histograms = shard.counters.copy(), shard.histograms.copy()
+            if thread.is_alive():
+                alive.append((thread, shard))
+                totals.merge(counters, histograms)
+            else:
+                _retired.merge(counters, histograms)
+        _shards[:] = alive
+        totals.merge(_retired.counters, _retired.histograms)
+    return totals.counters, totals.histograms
+
+
+def reset():
+    """Forget everything recorded so far in this process (warm-up work, see warmup.py)"""
+    with _shards_lock:
+        for thread, shard in _shards:
+            shard.counters.clear()
+            shard.histograms.clear()
+        _retired.counters.clear()
+        _retired.histograms.clear()
+
+
+# =====================================================
+# REQUEST AND QUERY HOOKS
+# =====================================================
+
+class _RequestStats:
+    __slots__ = ('endpoint', 'method', 'started', 'queries', 'query_time')
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    # Streamed bodies run in the request's thread, so their queries count too
+    stats = getattr(_local, 'request', None) or _async_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += elapsed
+    else:
+        inc('db_queries_total', endpoint='(background)')
+        inc('db_query_duration_seconds_total', elapsed, endpoint='(background)')
+
+
+def _before_request():
+    _local.request = _RequestStats(request.endpoint or '(unmatched)', request.method)
+
+
+def _finish(stats, status, sent):
+    _local.request = None
+    endpoint = stats.endpoint
+    observe('http_request_duration_seconds', time.perf_counter() - stats.started, endpoint=endpoint)
+    inc('http_requests_total', endpoint=endpoint, method=stats.method, status=str(status))
+    inc('http_response_bytes_total', sent, endpoint=endpoint)
+    if stats.queries:
+        inc('db_queries_total', stats.queries, endpoint=endpoint)
+        inc('db_query_duration_seconds_total', stats.query_time, endpoint=endpoint)
+    _maybe_flush()
+
+
+def _counted(chunks, stats, status):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        _finish(stats, status, sent)
+
+
+def _after_request(response):
+    """Registered before compression so it runs after it and counts the bytes actually sent"""
+    stats = getattr(_local, 'request', None)
+    if stats is None:
+        return response
+    if response.is_streamed:
+        # Finished when the last chunk has been sent
+        response.response = _counted(response.response, stats, response.status_code)
+    else:
+        _finish(stats, response.status_code, response.content_length or 0)
+    return response
+
+
+# =====================================================
+# ASGI MIDDLEWARE
+# =====================================================
+
+_async_request = ContextVar('metrics_request', default=None)
+
+
+class ASGIMetricsMiddleware:
+    """The request hooks for the async tier, recording the same series.
+
+    Requests share the event loop's thread, so their stats live in a
+    context variable rather than the thread-local; SQLAlchemy's async
+    calls carry it into the query hooks. The endpoint label is the
+    handler's name, which matches the Flask view's. Place it outside the
+    compression middleware so it counts the bytes actually sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = _RequestStats('(unmatched)', scope['method'])
+        token = _async_request.set(stats)
+        status, sent = 500, 0
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            _async_request.reset(token)
+            # The router records the matched handler in the scope
+            stats.endpoint = getattr(scope.get('endpoint'), '__name__', stats.endpoint)
+            _finish(stats, status, sent)
+
+
+def init_asgi(settings, pool):
+    """``init_app`` for the async tier: returns its middleware, or None when disabled.
+
+    ``pool`` is the async engine's pool, reported instead of Flask-SQLAlchemy's.
+    """
+    if not settings['METRICS_ENABLED']:
+        return None
+    _configure(settings, pool)
+    return ASGIMetricsMiddleware
+
+
+# =====================================================
+# MULTI-WORKER AGGREGATION
+# =====================================================
+
+_last_flush = [0.0]
+_state = {}
+
+
+def _encode(counters, histograms):
+    return {
+        'counters': [[name, list(map(list, labels)), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(map(list, labels)), values] for (name, labels), values in histograms.items()],
+    }
+
+
+def _decode(document):
+    counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in document['counters']}
+    histograms = {(name, tuple(map(tuple, labels))): values for name, labels, values in document['histograms']}
+    return counters, histograms
+
+
+def flush():
+    """Write this worker's totals and pool state to METRICS_DIR"""
+    directory = _state.get('directory')
+    if not directory:
+        return
+    _last_flush[0] = time.monotonic()
+    document = _encode(*snapshot())
+    document['pid'] = os.getpid()
+    document['pool'] = _pool_stats()
+    path = os.path.join(directory, f'worker-{os.getpid()}.json')
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as handle:
+        json.dump(document, handle)
+    os.replace(temporary, path)
+
+
+def _maybe_flush():
+    if _state.get('directory') and time.monotonic() - _last_flush[0] >= _state['interval']:
+        try:
+            flush()
+        except OSError:
+            logger = current_app.logger if has_app_context() else logging.getLogger(__name__)
+            logger.exception('Could not write metrics snapshot')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """(counters, histograms, {pid: pool stats}) across every worker"""
+    directory = _state.get('directory')
+    if not directory:
+        counters, histograms = snapshot()
+        return counters, histograms, {os.getpid(): _pool_stats()}
+
+    flush()
+    totals, pools = _Shard(), {}
+    for name in os.listdir(directory):
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as handle:
+                document = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        totals.merge(*_decode(document))
+        if _alive(document['pid']):
+            pools[document['pid']] = document.get('pool') or {}
+    return totals.counters, totals.histograms, pools
+
+
+def _pool_stats():
+    pool = _state.get('pool')
+    if pool is None:
+        extension = current_app.extensions.get('sqlalchemy')
+        pool = extension.engine.pool if extension is not None else None
+    if pool is None or not hasattr(pool, 'checkedout'):
+        return {}
+    return {'size': pool.size(), 'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0), 'checked_in': pool.checkedin()}
+
+
+# =====================================================
+# EXPOSITION
+# =====================================================
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms, pools):
+    """Text exposition format 0.0.4"""
+    series = {}  # name -> [(labels, lines)]
+    for (name, labels), value in counters.items():
+        series.setdefault(name, []).append((labels, [f'{name}{_labels(labels)} {_number(value)}']))
+    for (name, labels), values in histograms.items():
+        lines, cumulative = [], 0
+        for bound, count in zip(BUCKETS + ('+Inf',), values[:-1]):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(values[-1])}')
+        lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        series.setdefault(name, []).append((labels, lines))
+    for pid, stats in pools.items():
+        for state, value in stats.items():
+            labels = (('pid', pid), ('state', state))
+            series.setdefault('db_pool_connections', []).append(
+                (labels, [f'db_pool_connections{_labels(labels)} {value}']))
+
+    output = []
+    for name in sorted(series):
+        kind, text = DESCRIPTIONS.get(name, ('untyped', name))
+        output.append(f'# HELP {name} {text}')
+        output.append(f'# TYPE {name} {kind}')
+        for labels, lines in sorted(series[name], key=lambda item: item[0]):
+            output.extend(lines)
+    return '\n'.join(output) + '\n'
+
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', 401, mimetype='text/plain')
+    return Response(render(*collect()), mimetype='text/plain; version=0.0.4')
+
+
+def _configure(settings, pool=None):
+    _state['interval'] = settings['METRICS_FLUSH_INTERVAL']
+    _state['directory'] = settings['METRICS_DIR']
+    _state['pool'] = pool
+    if _state['directory']:
+        os.makedirs(_state['directory'], exist_ok=True)
+
+
+def init_app(app):
+    """Install the request hooks and /metrics; call before compress.init_app"""
+    if not app.config['METRICS_ENABLED']:
+        return
+    _configure(app.config)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
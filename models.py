@@ -1,10 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores ON DELETE CASCADE unless foreign keys are switched on"""
+    if type(dbapi_connection).__module__.startswith('sqlite3'):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 class User(UserMixin, db.Model):
     """User Model for Authentication"""
     __tablename__ = 'User'
@@ -22,14 +32,18 @@ class User(UserMixin, db.Model):
         """Override UserMixin method to use user_id instead of id"""
         return str(self.user_id)
     
-    def set_password(self, password):
+    def set_password(self, password, method='scrypt'):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method)
     
     def check_password(self, password):
         """Check password against hash"""
         return check_password_hash(self.password_hash, password)
     
+    def password_needs_rehash(self, prefix):
+        """True if the stored hash was made with different parameters than ``prefix``"""
+        return self.password_hash.split('$', 1)[0] != prefix
+    
     def __repr__(self):
         return f'<User {self.username}>'
     
@@ -43,6 +57,32 @@ class User(UserMixin, db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class ApiToken(db.Model):
+    """API token for machine clients (gateways, dashboards)"""
+    __tablename__ = 'ApiToken'
+    
+    token_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('User.user_id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    user = db.relationship('User', backref='api_tokens', lazy=True)
+    
+    def __repr__(self):
+        return f'<ApiToken {self.name}>'
+    
+    def to_dict(self):
+        return {
+            'token_id': self.token_id,
+            'user_id': self.user_id,
+            'name': self.name,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class SensorType(db.Model):
     """Sensor Type Model"""
     __tablename__ = 'SensorType'
@@ -109,9 +149,22 @@ class Sensor(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Any combination of the list filters (status, type, location) is a prefix of one index
+    __table_args__ = (
+        db.Index('idx_sensor_status_type', 'status', 'type_id', 'location_id'),
+        db.Index('idx_sensor_type_location', 'type_id', 'location_id'),
+        db.Index('idx_sensor_location_status', 'location_id', 'status'),
+    )
+    
     # Relationships
-    readings = db.relationship('Reading', backref='sensor', lazy=True, cascade='all, delete-orphan')
-    maintenance_events = db.relationship('MaintenanceEvent', backref='sensor', lazy=True, cascade='all, delete-orphan')
+    # passive_deletes lets the database's ON DELETE CASCADE remove children
+    # instead of SQLAlchemy loading and deleting every row one at a time
+    readings = db.relationship('Reading', backref='sensor', lazy=True,
+                               cascade='all, delete-orphan', passive_deletes=True)
+    maintenance_events = db.relationship('MaintenanceEvent', backref='sensor', lazy=True,
+                                         cascade='all, delete-orphan', passive_deletes=True)
+    status_logs = db.relationship('SensorStatusLog', backref='sensor', lazy=True,
+                                  cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Sensor {self.model}>'
@@ -134,11 +187,17 @@ class Reading(db.Model):
     """Reading Model"""
     __tablename__ = 'Reading'
     
-    reading_id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
-    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id'), nullable=False)
+    # SQLite only autoincrements INTEGER PRIMARY KEY columns
+    reading_id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), nullable=False)
     reading_value = db.Column(db.Numeric(10, 4), nullable=False)
     reading_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    # sqlite_autoincrement: ids are never reused, which edge sync watermarks rely on
+    __table_args__ = (db.Index('idx_sensor_timestamp', 'sensor_id', 'reading_timestamp', 'reading_value'),
+                      db.Index('idx_reading_timestamp', 'reading_timestamp'),
+                      {'sqlite_autoincrement': True})
+    
     def __repr__(self):
         return f'<Reading {self.reading_id}>'
     
@@ -151,6 +210,53 @@ class Reading(db.Model):
             'sensor_model': self.sensor.model if self.sensor else None
         }
 
+class ReadingChunk(db.Model):
+    """Compacted readings of one sensor for one time window (see chunkstore)"""
+    __tablename__ = 'ReadingChunk'
+    
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), primary_key=True)
+    chunk_start = db.Column(db.DateTime, primary_key=True)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    reading_count = db.Column(db.Integer, nullable=False)
+    min_value = db.Column(db.Numeric(10, 4), nullable=False)
+    max_value = db.Column(db.Numeric(10, 4), nullable=False)
+    value_sum = db.Column(db.Numeric(20, 4), nullable=False)
+    timestamp_data = db.Column(db.LargeBinary().with_variant(db.LargeBinary(2 ** 24 - 1), 'mysql'), nullable=False)
+    value_data = db.Column(db.LargeBinary().with_variant(db.LargeBinary(2 ** 24 - 1), 'mysql'), nullable=False)
+    id_data = db.Column(db.LargeBinary().with_variant(db.LargeBinary(2 ** 24 - 1), 'mysql'), nullable=False)
+    
+    __table_args__ = (db.Index('idx_chunk_last', 'last_timestamp'),)
+    
+    def __repr__(self):
+        return f'<ReadingChunk {self.sensor_id} {self.chunk_start}>'
+
+class SensorLatest(db.Model):
+    """Most recent reading per sensor, kept current by triggers on Reading"""
+    __tablename__ = 'SensorLatest'
+    
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), primary_key=True)
+    reading_id = db.Column(db.BigInteger, nullable=False)
+    reading_value = db.Column(db.Numeric(10, 4), nullable=False)
+    reading_timestamp = db.Column(db.DateTime, nullable=False)
+    
+    # Relationships
+    sensor = db.relationship('Sensor', backref=db.backref('latest', uselist=False, passive_deletes=True))
+    
+    __table_args__ = (db.Index('idx_latest_timestamp', 'reading_timestamp'),)
+    
+    def __repr__(self):
+        return f'<SensorLatest {self.sensor_id}>'
+    
+    def to_dict(self):
+        return {
+            'reading_id': self.reading_id,
+            'sensor_id': self.sensor_id,
+            'reading_value': float(self.reading_value),
+            'reading_timestamp': self.reading_timestamp.isoformat() if self.reading_timestamp else None,
+            'sensor_model': self.sensor.model if self.sensor else None
+        }
+
 class Technician(db.Model):
     """Technician Model"""
     __tablename__ = 'Technician'
@@ -181,13 +287,21 @@ class MaintenanceEvent(db.Model):
     __tablename__ = 'MaintenanceEvent'
     
     maintenance_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id'), nullable=False)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), nullable=False)
     tech_id = db.Column(db.Integer, db.ForeignKey('Technician.tech_id'), nullable=False)
     event_type = db.Column(db.Enum('CALIBRATION', 'REPAIR', 'REPLACEMENT'), nullable=False)
     event_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Each list filter, read newest first
+    __table_args__ = (
+        db.Index('idx_maintenance_sensor_date', 'sensor_id', 'event_date'),
+        db.Index('idx_maintenance_tech_date', 'tech_id', 'event_date'),
+        db.Index('idx_maintenance_type_date', 'event_type', 'event_date'),
+        db.Index('idx_maintenance_date', 'event_date'),
+    )
+    
     def __repr__(self):
         return f'<MaintenanceEvent {self.maintenance_id}>'
     
@@ -209,7 +323,7 @@ class SensorStatusLog(db.Model):
     __tablename__ = 'SensorStatusLog'
     
     log_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id'), nullable=False)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), nullable=False)
     old_status = db.Column(db.Enum('ACTIVE', 'INACTIVE', 'MAINTENANCE'))
     new_status = db.Column(db.Enum('ACTIVE', 'INACTIVE', 'MAINTENANCE'))
     change_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -225,3 +339,175 @@ class SensorStatusLog(db.Model):
             'new_status': self.new_status,
             'change_timestamp': self.change_timestamp.isoformat() if self.change_timestamp else None
         }
+
+class MaintenanceScore(db.Model):
+    """Latest predictive maintenance score per sensor, written by the scoring job"""
+    __tablename__ = 'MaintenanceScore'
+    
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    days_since_calibration = db.Column(db.Float)
+    drift = db.Column(db.Float)
+    variance_ratio = db.Column(db.Float)
+    repairs = db.Column(db.Integer, nullable=False, default=0)
+    silence_hours = db.Column(db.Float)
+    reasons = db.Column(db.String(255))
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_score_rank', 'rank'),
+    )
+    
+    sensor = db.relationship('Sensor', backref=db.backref('maintenance_score', uselist=False,
+                                                          passive_deletes=True))
+    
+    def __repr__(self):
+        return f'<MaintenanceScore {self.sensor_id}={self.score:.2f}>'
+    
+    def to_dict(self):
+        return {
+            'sensor_id': self.sensor_id,
+            'score': round(self.score, 3),
+            'rank': self.rank,
+            'days_since_calibration': self.days_since_calibration,
+            'drift': self.drift,
+            'variance_ratio': self.variance_ratio,
+            'repairs': self.repairs,
+            'silence_hours': self.silence_hours,
+            'reasons': self.reasons.split('; ') if self.reasons else [],
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+class ReportSnapshot(db.Model):
+    """One section of the reports page as computed at ``generated_at`` (see snapshots.py)"""
+    __tablename__ = 'ReportSnapshot'
+    
+    snapshot_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    section = db.Column(db.String(32), nullable=False)
+    generated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    versions = db.Column(db.String(255), nullable=False)  # JSON {table: data version} it was computed from
+    duration_ms = db.Column(db.Float)
+    payload = db.Column(db.Text().with_variant(db.Text(2 ** 24 - 1), 'mysql'), nullable=False)  # JSON
+    
+    __table_args__ = (db.Index('idx_snapshot_section', 'section', 'generated_at'),)
+    
+    def __repr__(self):
+        return f'<ReportSnapshot {self.section} {self.generated_at}>'
+
+class AlertRule(db.Model):
+    """Threshold, rate-of-change or no-data rule scoped to a sensor type and/or location"""
+    __tablename__ = 'AlertRule'
+    
+    rule_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(100), nullable=False)
+    rule_kind = db.Column(db.Enum('THRESHOLD', 'RATE', 'NO_DATA'), nullable=False)
+    type_id = db.Column(db.Integer, db.ForeignKey('SensorType.type_id', ondelete='CASCADE'))
+    location_id = db.Column(db.Integer, db.ForeignKey('Location.location_id', ondelete='CASCADE'))
+    min_value = db.Column(db.Numeric(10, 4))
+    max_value = db.Column(db.Numeric(10, 4))
+    max_rate_per_hour = db.Column(db.Numeric(10, 4))
+    no_data_minutes = db.Column(db.Integer)
+    severity = db.Column(db.Enum('INFO', 'WARNING', 'CRITICAL'), nullable=False, default='WARNING')
+    cooldown_minutes = db.Column(db.Integer, nullable=False, default=30)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    sensor_type = db.relationship('SensorType')
+    location = db.relationship('Location')
+    
+    def __repr__(self):
+        return f'<AlertRule {self.name}>'
+    
+    def to_dict(self):
+        return {
+            'rule_id': self.rule_id,
+            'name': self.name,
+            'rule_kind': self.rule_kind,
+            'type_id': self.type_id,
+            'location_id': self.location_id,
+            'min_value': float(self.min_value) if self.min_value is not None else None,
+            'max_value': float(self.max_value) if self.max_value is not None else None,
+            'max_rate_per_hour': float(self.max_rate_per_hour) if self.max_rate_per_hour is not None else None,
+            'no_data_minutes': self.no_data_minutes,
+            'severity': self.severity,
+            'cooldown_minutes': self.cooldown_minutes,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class Alert(db.Model):
+    """Alert raised by a rule; repeats within the cooldown are folded into one row"""
+    __tablename__ = 'Alert'
+    
+    alert_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('AlertRule.rule_id', ondelete='CASCADE'), nullable=False)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensor.sensor_id', ondelete='CASCADE'), nullable=False)
+    severity = db.Column(db.Enum('INFO', 'WARNING', 'CRITICAL'), nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    reading_value = db.Column(db.Numeric(10, 4))
+    triggered_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    occurrences = db.Column(db.Integer, nullable=False, default=1)
+    acknowledged_at = db.Column(db.DateTime)
+    acknowledged_by = db.Column(db.Integer, db.ForeignKey('User.user_id', ondelete='SET NULL'))
+    
+    __table_args__ = (
+        db.Index('idx_alert_open', 'rule_id', 'sensor_id', 'acknowledged_at'),
+        db.Index('idx_alert_triggered', 'triggered_at'),
+    )
+    
+    rule = db.relationship('AlertRule', backref=db.backref('alerts', cascade='all, delete-orphan',
+                                                                 passive_deletes=True))
+    sensor = db.relationship('Sensor', backref=db.backref('alerts', cascade='all, delete-orphan',
+                                                                 passive_deletes=True))
+    
+    def __repr__(self):
+        return f'<Alert {self.alert_id}>'
+    
+    def to_dict(self):
+        return {
+            'alert_id': self.alert_id,
+            'rule_id': self.rule_id,
+            'sensor_id': self.sensor_id,
+            'severity': self.severity,
+            'message': self.message,
+            'reading_value': float(self.reading_value) if self.reading_value is not None else None,
+            'triggered_at': self.triggered_at.isoformat() if self.triggered_at else None,
+            'last_seen_at': self.last_seen_at.isoformat() if self.last_seen_at else None,
+            'occurrences': self.occurrences,
+            'acknowledged_at': self.acknowledged_at.isoformat() if self.acknowledged_at else None
+        }
+
+class LocationShard(db.Model):
+    """Database (shard) storing a location's readings, assigned on first ingest"""
+    __tablename__ = 'LocationShard'
+    
+    location_id = db.Column(db.Integer, db.ForeignKey('Location.location_id', ondelete='CASCADE'), primary_key=True)
+    shard = db.Column(db.String(50), nullable=False)
+    assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<LocationShard {self.location_id}={self.shard}>'
+
+class SyncWatermark(db.Model):
+    """Highest edge-node reading id shipped (on the edge) or received (centrally) per site"""
+    __tablename__ = 'SyncWatermark'
+    
+    site_id = db.Column(db.String(50), primary_key=True)
+    last_reading_id = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SyncWatermark {self.site_id}={self.last_reading_id}>'
+
+class DataVersion(db.Model):
+    """Per-table change counter used to invalidate in-process caches"""
+    __tablename__ = 'DataVersion'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.name}={self.version}>'
@@ -0,0 +1,57 @@
+"""Stored procedure calls with query equivalents for databases without them.
+
+On MySQL the procedures in schema.sql are called; elsewhere (SQLite
+edge nodes, the testing config) the same result rows are built with
+SQLAlchemy queries.
+"""
+from collections import namedtuple
+
+from sqlalchemy import func, text
+
+from models import Technician, MaintenanceEvent
+
+TechnicianRank = namedtuple('TechnicianRank', 'tech_id name specialization maintenance_count event_types')
+MaintenanceSummaryRow = namedtuple('MaintenanceSummaryRow',
+                                   'event_type event_count sensors_affected technicians_involved')
+
+
+def _has_procedures(session):
+    return session.get_bind().dialect.name == 'mysql'
+
+
+def top_technicians(session, limit):
+    """GetTopTechnicians: technicians by maintenance count with their event types"""
+    if _has_procedures(session):
+        return session.execute(text('CALL GetTopTechnicians(:limit)'), {'limit': limit}).fetchall()
+
+    count = func.count(MaintenanceEvent.maintenance_id)
+    ranked = session.query(
+        Technician.tech_id, Technician.name, Technician.specialization, count
+    ).outerjoin(
+        MaintenanceEvent, Technician.tech_id == MaintenanceEvent.tech_id
+    ).group_by(
+        Technician.tech_id, Technician.name, Technician.specialization
+    ).order_by(count.desc()).limit(limit).all()
+
+    types = {}
+    for tech_id, event_type in session.query(MaintenanceEvent.tech_id, MaintenanceEvent.event_type).filter(
+        MaintenanceEvent.tech_id.in_([row[0] for row in ranked])
+    ).distinct():
+        types.setdefault(tech_id, []).append(event_type)
+    return [TechnicianRank(tech_id, name, specialization, maintenance_count,
+                           ','.join(sorted(types[tech_id])) if tech_id in types else None)
+            for tech_id, name, specialization, maintenance_count in ranked]
+
+
+def maintenance_summary(session):
+    """GetMaintenanceSummary: events, sensors and technicians per event type"""
+    if _has_procedures(session):
+        return session.execute(text('CALL GetMaintenanceSummary()')).fetchall()
+
+    count = func.count()
+    rows = session.query(
+        MaintenanceEvent.event_type, count,
+        func.count(MaintenanceEvent.sensor_id.distinct()),
+        func.count(MaintenanceEvent.tech_id.distinct())
+    ).group_by(MaintenanceEvent.event_type).order_by(count.desc()).all()
+    return [MaintenanceSummaryRow(*row) for row in rows]
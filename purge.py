@@ -0,0 +1,61 @@
+"""Chunked deletion of sensors that have a long reading history"""
+import cache
+import shards
+from models import db, Sensor, Reading, ReadingChunk, MaintenanceEvent, SensorStatusLog
+
+# Child tables purged before the sensor row, as (model, primary key column)
+_CHILDREN = (
+    (Reading, Reading.reading_id),
+    (MaintenanceEvent, MaintenanceEvent.maintenance_id),
+    (SensorStatusLog, SensorStatusLog.log_id),
+)
+
+
+def history_exceeds(sensor_id, threshold):
+    """True when deleting ``sensor_id`` would remove more than ``threshold`` child rows.
+
+    Reads at most ``threshold + 1`` primary keys per table (readings on
+    other shards included) instead of counting the whole history.
+    """
+    remaining = threshold + 1
+    for model, pk in _CHILDREN:
+        remaining -= len(db.session.query(pk).filter(model.sensor_id == sensor_id).limit(remaining).all())
+        if remaining <= 0:
+            return True
+    return shards.count_readings(sensor_id, remaining) >= remaining
+
+
+def purge_sensor(job, sensor_id, chunk_size):
+    """Delete a sensor's children in committed chunks, then the sensor itself.
+
+    Each chunk is a short transaction over primary keys, so locks and
+    undo space stay small and the purge can resume if it is interrupted.
+    """
+    for model, pk in _CHILDREN:
+        while True:
+            ids = [row[0] for row in db.session.query(pk).filter(
+                model.sensor_id == sensor_id
+            ).limit(chunk_size).all()]
+            if not ids:
+                break
+            model.query.filter(pk.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            job.progress += len(ids)
+            job.message = f'Deleted {job.progress} rows'
+
+    # Readings stored on other shards do not cascade from the sensor row
+    def remote_progress(count):
+        job.progress += count
+        job.message = f'Deleted {job.progress} rows (other shards)'
+    shards.delete_readings(sensor_id, chunk_size, remote_progress)
+
+    # Compacted history is one row per window, small enough for one statement
+    ReadingChunk.query.filter_by(sensor_id=sensor_id).delete(synchronize_session=False)
+
+    sensor = Sensor.query.get(sensor_id)
+    if sensor is not None:
+        db.session.delete(sensor)
+        cache.bump_version('Sensor', 'MaintenanceEvent', 'ReadingChunk')
+        db.session.commit()
+    job.message = f'Sensor {sensor_id} deleted'
+    return {'sensor_id': sensor_id, 'rows_deleted': job.progress}
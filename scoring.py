@@ -0,0 +1,232 @@
+"""Fleet-wide predictive maintenance scoring.
+
+Every feature is gathered for all sensors at once with a grouped query,
+so a run costs a fixed handful of queries however large the fleet is.
+The per-sensor arithmetic then runs over plain dicts in one pass.
+"""
+import math
+from datetime import datetime, time, timedelta
+from statistics import median
+
+from sqlalchemy import case, func, select
+
+import chunkstore
+import shards
+from models import db, Sensor, Reading, ReadingChunk, SensorLatest, MaintenanceEvent, MaintenanceScore
+
+# Normalised feature -> (weight, reason shown when it dominates)
+FEATURES = {
+    'calibration': (0.30, 'calibration overdue'),
+    'drift': (0.30, 'drifting from co-located sensors'),
+    'variance': (0.15, 'reading variance changed'),
+    'repairs': (0.15, 'repeated repairs'),
+    'silence': (0.10, 'no recent readings'),
+}
+
+
+def _sensors():
+    return db.session.execute(select(
+        Sensor.sensor_id, Sensor.type_id, Sensor.location_id, Sensor.install_date, Sensor.status
+    )).all()
+
+
+def _last_calibrations():
+    return dict(db.session.execute(
+        select(MaintenanceEvent.sensor_id, func.max(MaintenanceEvent.event_date))
+        .where(MaintenanceEvent.event_type == 'CALIBRATION')
+        .group_by(MaintenanceEvent.sensor_id)
+    ).all())
+
+
+def _repair_counts(since):
+    return dict(db.session.execute(
+        select(MaintenanceEvent.sensor_id, func.count(MaintenanceEvent.maintenance_id))
+        .where(MaintenanceEvent.event_type.in_(('REPAIR', 'REPLACEMENT')),
+               MaintenanceEvent.event_date >= since)
+        .group_by(MaintenanceEvent.sensor_id)
+    ).all())
+
+
+def _window_moments(baseline_start, recent_start):
+    """{sensor_id: {'recent'|'baseline': (n, sum, sum of squares)}} in one scan per shard"""
+    bucket = case((Reading.reading_timestamp >= recent_start, 'recent'), else_='baseline')
+    statement = (
+        select(Reading.sensor_id, bucket.label('bucket'),
+               func.count(Reading.reading_id),
+               func.sum(Reading.reading_value),
+               func.sum(Reading.reading_value * Reading.reading_value))
+        .where(Reading.reading_timestamp >= baseline_start)
+        .group_by(Reading.sensor_id, bucket)
+    )
+    remote = shards.scatter(statement)
+    rows = db.session.execute(statement).all()
+    if remote:
+        rows += remote.rows()
+    rows += _compacted_moments(baseline_start, recent_start)
+    moments = {}
+    for sensor_id, name, count, total, squares in rows:
+        buckets = moments.setdefault(sensor_id, {})
+        before = buckets.get(name, (0, 0.0, 0.0))
+        buckets[name] = (before[0] + count, before[1] + float(total or 0), before[2] + float(squares or 0))
+    return moments
+
+
+def _compacted_moments(baseline_start, recent_start):
+    """Rows like ``_window_moments``' query for readings compacted into chunks.
+
+    Chunks store no sum of squares, so the ones reaching into the window
+    are decoded; with the default settings the window ends before the
+    compaction horizon and none are.
+    """
+    if not chunkstore.index.refresh(db.session):
+        return []
+    moments = {}
+    chunks = db.session.execute(
+        select(ReadingChunk).where(ReadingChunk.last_timestamp >= baseline_start)
+        .execution_options(yield_per=200)
+    ).scalars()
+    for chunk in chunks:
+        for row in chunkstore.decode_chunk(chunk):
+            if row.reading_timestamp < baseline_start:
+                continue
+            name = 'recent' if row.reading_timestamp >= recent_start else 'baseline'
+            value = float(row.reading_value)
+            entry = moments.setdefault((chunk.sensor_id, name), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += value
+            entry[2] += value * value
+    return [(sensor_id, name, *entry) for (sensor_id, name), entry in moments.items()]
+
+
+def _mean_variance(count, total, squares):
+    if not count:
+        return None, None
+    mean = total / count
+    variance = max(squares / count - mean * mean, 0.0) if count > 1 else None
+    return mean, variance
+
+
+def _peer_drift(means, groups):
+    """Robust z-score of each sensor's recent mean within its peer group.
+
+    Peers are sensors of the same type at the same location; groups with
+    fewer than three members fall back to all sensors of the type.
+    """
+    drift = {}
+    for members in groups:
+        values = [means[s] for s in members if means.get(s) is not None]
+        if len(values) < 2:
+            continue
+        center = median(values)
+        spread = median(abs(v - center) for v in values) * 1.4826 or None
+        for sensor_id in members:
+            if means.get(sensor_id) is None or sensor_id in drift:
+                continue
+            deviation = abs(means[sensor_id] - center)
+            drift[sensor_id] = deviation / spread if spread else (0.0 if deviation == 0 else 3.0)
+    return drift
+
+
+def compute_scores(now=None, recent_days=7, baseline_days=30, calibration_days=180):
+    """Feature values and a 0..1 score for every sensor, highest score first"""
+    now = now or datetime.utcnow()
+    recent_start = now - timedelta(days=recent_days)
+    baseline_start = recent_start - timedelta(days=baseline_days)
+
+    sensors = _sensors()
+    calibrations = _last_calibrations()
+    repairs = _repair_counts(now - timedelta(days=365))
+    latest = dict(db.session.execute(select(SensorLatest.sensor_id, SensorLatest.reading_timestamp)).all())
+    moments = _window_moments(baseline_start, recent_start)
+
+    recent_mean, variance_ratio = {}, {}
+    for sensor_id, buckets in moments.items():
+        mean, recent_var = _mean_variance(*buckets.get('recent', (0, 0, 0)))
+        recent_mean[sensor_id] = mean
+        _, baseline_var = _mean_variance(*buckets.get('baseline', (0, 0, 0)))
+        if recent_var is not None and baseline_var:
+            variance_ratio[sensor_id] = recent_var / baseline_var
+
+    co_located, by_type = {}, {}
+    for sensor in sensors:
+        co_located.setdefault((sensor.type_id, sensor.location_id), []).append(sensor.sensor_id)
+        by_type.setdefault(sensor.type_id, []).append(sensor.sensor_id)
+    drift = _peer_drift(recent_mean, [g for g in co_located.values() if len(g) >= 3])
+    drift.update({k: v for k, v in _peer_drift(recent_mean, by_type.values()).items() if k not in drift})
+
+    results = []
+    for sensor in sensors:
+        sensor_id = sensor.sensor_id
+        calibrated = calibrations.get(sensor_id) or (
+            datetime.combine(sensor.install_date, time()) if sensor.install_date else None)
+        days_since = (now - calibrated).total_seconds() / 86400 if calibrated else None
+        last_seen = latest.get(sensor_id)
+        silence = (now - last_seen).total_seconds() / 3600 if last_seen else None
+        ratio = variance_ratio.get(sensor_id)
+
+        normalised = {
+            'calibration': min((days_since or calibration_days * 2) / (calibration_days * 2), 1.0),
+            'drift': min(drift.get(sensor_id, 0.0) / 3.0, 1.0),
+            'variance': min(abs(math.log(ratio)) / math.log(4), 1.0) if ratio else 0.0,
+            'repairs': min(repairs.get(sensor_id, 0) / 3.0, 1.0),
+            # Silence only matters for sensors that are supposed to report
+            'silence': (min((silence if silence is not None else 48.0) / 48.0, 1.0)
+                        if sensor.status == 'ACTIVE' else 0.0),
+        }
+        contributions = {name: FEATURES[name][0] * value for name, value in normalised.items()}
+        reasons = [FEATURES[name][1] for name, value in
+                   sorted(contributions.items(), key=lambda item: -item[1]) if value >= 0.1]
+
+        results.append({
+            'sensor_id': sensor_id,
+            'score': sum(contributions.values()),
+            'days_since_calibration': round(days_since, 1) if days_since is not None else None,
+            'drift': round(drift[sensor_id], 3) if sensor_id in drift else None,
+            'variance_ratio': round(ratio, 3) if ratio else None,
+            'repairs': repairs.get(sensor_id, 0),
+            'silence_hours': round(silence, 1) if silence is not None else None,
+            'reasons': '; '.join(reasons) or None,
+        })
+
+    results.sort(key=lambda row: -row['score'])
+    for rank, row in enumerate(results, 1):
+        row['rank'] = rank
+    return results
+
+
+def score_fleet(job, config):
+    """Job entry point: recompute and replace every MaintenanceScore row"""
+    job.message = 'Collecting features'
+    results = compute_scores(
+        recent_days=config['MAINTENANCE_SCORE_RECENT_DAYS'],
+        baseline_days=config['MAINTENANCE_SCORE_BASELINE_DAYS'],
+        calibration_days=config['CALIBRATION_INTERVAL_DAYS']
+    )
+    job.total = len(results)
+    computed_at = datetime.utcnow()
+    for row in results:
+        row['computed_at'] = computed_at
+
+    MaintenanceScore.query.delete(synchronize_session=False)
+    if results:
+        db.session.execute(MaintenanceScore.__table__.insert(), results)
+    db.session.commit()
+    job.progress = len(results)
+    job.message = f'Scored {len(results)} sensors'
+    return {'sensors': len(results)}
+
+
+def needs_attention(limit, threshold):
+    """Highest-ranked (MaintenanceScore, Sensor) pairs scoring at least ``threshold``"""
+    return db.session.query(MaintenanceScore, Sensor).join(
+        Sensor, MaintenanceScore.sensor_id == Sensor.sensor_id
+    ).filter(MaintenanceScore.score >= threshold).order_by(MaintenanceScore.rank).limit(limit).all()
+
+
+def last_run():
+    return db.session.query(func.max(MaintenanceScore.computed_at)).scalar()
+
+
+def is_stale(scored_at, max_age):
+    """Whether a ranking computed at ``scored_at`` is older than ``max_age`` seconds"""
+    return scored_at is None or (datetime.utcnow() - scored_at).total_seconds() > max_age
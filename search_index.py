@@ -0,0 +1,240 @@
+"""In-process trigram search over sensors, locations, technicians and sensor types.
+
+Each kind of record has an index mapping every trigram of its
+normalized label to the ids containing it. A search intersects the
+postings of the query's trigrams and confirms the candidates with a
+substring test, so list views keep the ``LIKE '%term%'`` results without
+scanning the table. Queries shorter than a trigram scan the labels in
+memory.
+
+Indexes are reference-cache entries: a CRUD write bumps its table's
+version, and the next search in any worker brings the index up to date.
+Only records whose label changed are re-indexed; the previous index is
+never modified, so concurrent searches need no lock.
+"""
+import unicodedata
+from collections import Counter, namedtuple
+
+from flask import current_app, url_for
+
+import cache
+from models import Sensor, Location, Technician, SensorType
+
+# id_column, label_column: what list views filter; endpoint builds result URLs
+Kind = namedtuple('Kind', 'id_column label_column endpoint')
+Entry = namedtuple('Entry', 'label text detail grams')
+Result = namedtuple('Result', 'kind id label detail score')
+
+KINDS = {
+    'sensor': Kind(Sensor.sensor_id, Sensor.model, 'sensor_readings'),
+    'location': Kind(Location.location_id, Location.area_name, 'locations_list'),
+    'technician': Kind(Technician.tech_id, Technician.name, 'technicians_list'),
+    'sensor_type': Kind(SensorType.type_id, SensorType.name, 'sensor_types_list'),
+}
+
+# Scores by how the label matches; trigram-similar labels score below these
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, SIMILAR = 1.0, 0.9, 0.8, 0.6, 0.5
+
+
+def normalize(value):
+    """Case-folded, accent-free text with single spaces, like a case-insensitive collation"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# =====================================================
+# INDEX
+# =====================================================
+
+class Index:
+    """Immutable trigram index of one kind; ``updated`` returns a new index"""
+
+    __slots__ = ('entries', 'postings')
+
+    def __init__(self, entries, postings):
+        self.entries = entries    # id -> Entry
+        self.postings = postings  # trigram -> frozenset of ids
+
+    @classmethod
+    def build(cls, entries):
+        postings = {}
+        for key, entry in entries.items():
+            for gram in _trigrams(f' {entry.text} '):
+                postings.setdefault(gram, set()).add(key)
+        return cls(entries, {gram: frozenset(ids) for gram, ids in postings.items()})
+
+    def updated(self, entries):
+        """Index of ``entries``, re-indexing only records whose text changed"""
+        changed = [key for key, entry in entries.items()
+                   if key not in self.entries or self.entries[key].text != entry.text]
+        removed = [key for key in self.entries if key not in entries]
+        if not changed and not removed:
+            return Index(entries, self.postings)
+        if len(changed) + len(removed) > len(entries) // 4:
+            return Index.build(entries)
+
+        touched = {}
+        for key in removed + changed:
+            old = self.entries.get(key)
+            if old is not None:
+                for gram in _trigrams(f' {old.text} '):
+                    touched.setdefault(gram, set(self.postings.get(gram, ()))).discard(key)
+        for key in changed:
+            for gram in _trigrams(f' {entries[key].text} '):
+                touched.setdefault(gram, set(self.postings.get(gram, ()))).add(key)
+
+        postings = dict(self.postings)
+        for gram, ids in touched.items():
+            if ids:
+                postings[gram] = frozenset(ids)
+            else:
+                postings.pop(gram, None)
+        return Index(entries, postings)
+
+    def matches(self, text):
+        """Ids whose label contains ``text`` (normalized)"""
+        grams = _trigrams(text)
+        if not grams:
+            return [key for key, entry in self.entries.items() if text in entry.text]
+        candidates = None
+        for postings in sorted((self.postings.get(gram, frozenset()) for gram in grams), key=len):
+            candidates = postings if candidates is None else candidates & postings
+            if not candidates:
+                return []
+        return [key for key in candidates if text in self.entries[key].text]
+
+    def similar(self, text, threshold, exclude=()):
+        """(id, similarity) of labels sharing enough trigrams with ``text``"""
+        grams = _trigrams(f' {text} ')
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        found = []
+        for key, count in shared.items():
+            if key in exclude:
+                continue
+            similarity = count / (len(grams) + self.entries[key].grams - count)
+            if similarity >= threshold:
+                found.append((key, similarity))
+        return found
+
+
+_built = {}  # kind -> last Index, the base for incremental updates
+
+
+def _refresh(kind, records):
+    """Bring ``kind``'s index up to date with (id, label, detail) records"""
+    entries = {}
+    for key, label, detail in records:
+        text = normalize(label)
+        entries[key] = Entry(label, text, detail, len(_trigrams(f' {text} ')))
+    previous = _built.get(kind)
+    index = Index.build(entries) if previous is None else previous.updated(entries)
+    _built[kind] = index
+    return index
+
+
+@cache.reference_cache.loader('search:sensor', 'Sensor', 'SensorType', 'Location')
+def _index_sensors():
+    return _refresh('sensor', (
+        (s.sensor_id, s.model,
+         ' · '.join(part for part in (s.sensor_type and s.sensor_type.name, s.location and s.location.area_name)
+                    if part))
+        for s in cache.sensors()
+    ))
+
+
+@cache.reference_cache.loader('search:location', 'Location')
+def _index_locations():
+    return _refresh('location', ((loc.location_id, loc.area_name, None) for loc in cache.locations()))
+
+
+@cache.reference_cache.loader('search:technician', 'Technician')
+def _index_technicians():
+    return _refresh('technician', ((t.tech_id, t.name, t.specialization) for t in cache.technicians()))
+
+
+@cache.reference_cache.loader('search:sensor_type', 'SensorType')
+def _index_sensor_types():
+    return _refresh('sensor_type', ((t.type_id, t.name, t.description) for t in cache.sensor_types()))
+
+
+def index(kind):
+    return cache.reference_cache.get(f'search:{kind}')
+
+
+# =====================================================
+# QUERIES
+# =====================================================
+
+def matching_ids(kind, term):
+    """Ids of ``kind`` whose label contains ``term``"""
+    return index(kind).matches(normalize(term))
+
+
+def clause(kind, term):
+    """WHERE clause for a list view's ``search`` parameter.
+
+    Large match sets fall back to LIKE, where the scan costs no more than
+    sending thousands of ids.
+    """
+    ids = matching_ids(kind, term)
+    if len(ids) > current_app.config['SEARCH_MAX_FILTER_IDS']:
+        return KINDS[kind].label_column.like(f'%{term}%')
+    return KINDS[kind].id_column.in_(ids)
+
+
+def _score(text, label_text):
+    if label_text == text:
+        return EXACT
+    if label_text.startswith(text):
+        return PREFIX
+    if f' {text}' in f' {label_text}':
+        return WORD_PREFIX
+    return SUBSTRING
+
+
+def parse_kinds(value):
+    """Kinds from a ``types=a,b`` argument; raises ValueError for unknown names"""
+    if not value:
+        return tuple(KINDS)
+    kinds = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in kinds if name not in KINDS]
+    if unknown:
+        raise ValueError(f'Unknown types: {", ".join(unknown)}; expected {", ".join(KINDS)}')
+    return tuple(dict.fromkeys(kinds)) or tuple(KINDS)
+
+
+def suggest(term, kinds=None, limit=10):
+    """Ranked results for autocomplete: exact, prefix, word prefix, substring, then similar labels"""
+    text = normalize(term)
+    if not text:
+        return []
+    threshold = current_app.config['SEARCH_SIMILARITY_THRESHOLD']
+    results = []
+    for kind in kinds or KINDS:
+        kind_index = index(kind)
+        found = kind_index.matches(text)
+        scored = [(key, _score(text, kind_index.entries[key].text)) for key in found]
+        if len(found) < limit and len(text) >= 3:
+            scored.extend((key, SIMILAR * similarity)
+                          for key, similarity in kind_index.similar(text, threshold, exclude=set(found)))
+        for key, score in scored:
+            entry = kind_index.entries[key]
+            results.append(Result(kind, key, entry.label, entry.detail, round(score, 3)))
+    results.sort(key=lambda r: (-r.score, len(r.label), r.label.casefold(), r.kind, r.id))
+    return results[:limit]
+
+
+def to_dict(result):
+    if result.kind == 'sensor':
+        url = url_for('sensor_readings', sensor_id=result.id)
+    else:
+        url = url_for(KINDS[result.kind].endpoint, search=result.label)
+    return {'type': result.kind, 'id': result.id, 'label': result.label,
+            'detail': result.detail, 'score': result.score, 'url': url}
@@ -0,0 +1,208 @@
+"""Time-windowed, cursor-paginated access to one sensor's readings"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, func, select
+
+import chunkstore
+import shards
+from models import db, Reading, SensorLatest
+
+
+def encode_cursor(reading_timestamp, reading_id):
+    """Opaque cursor pointing just past the given reading"""
+    return f'{reading_timestamp.isoformat()}_{reading_id}'
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed input"""
+    timestamp, reading_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(timestamp), int(reading_id)
+
+
+def parse_args(args, config):
+    """Validate window, cursor and page size query arguments.
+
+    ``args`` is any mapping of query parameters (Flask or Starlette).
+    Returns (days, end, cursor, limit); raises ValueError on bad input.
+    """
+    days = int(args.get('days') or config['READINGS_WINDOW_DAYS'])
+    days = max(1, min(days, config['READINGS_MAX_WINDOW_DAYS']))
+    end = args.get('end')
+    end = datetime.fromisoformat(end) if end else None
+    cursor = args.get('before')
+    cursor = decode_cursor(cursor) if cursor else None
+    limit = int(args.get('limit') or config['READINGS_PAGE_SIZE'])
+    limit = max(1, min(limit, config['READINGS_MAX_PAGE_SIZE']))
+    return days, end, cursor, limit
+
+
+def latest_key_query(sensor_id):
+    """(reading_id, reading_timestamp) of the sensor's latest reading; the series validator"""
+    return select(SensorLatest.reading_id, SensorLatest.reading_timestamp).where(
+        SensorLatest.sensor_id == sensor_id
+    )
+
+
+def latest_timestamp_query(sensor_id):
+    return select(SensorLatest.reading_timestamp).where(SensorLatest.sensor_id == sensor_id)
+
+
+def window_bounds(days, end, latest):
+    """(start, end) for ``days`` ending at ``end``, or at ``latest`` if no end is given"""
+    if end is None:
+        end = latest or datetime.utcnow()
+    return end - timedelta(days=days), end
+
+
+def resolve_window(sensor_id, days, end=None):
+    """Return (start, end) for a window of ``days`` ending at ``end``.
+
+    Without an explicit end the window closes at the sensor's latest
+    reading, so quiet sensors still open on their most recent data.
+    """
+    latest = None
+    if end is None:
+        latest = db.session.execute(latest_timestamp_query(sensor_id)).scalar()
+    return window_bounds(days, end, latest)
+
+
+def _in_window(sensor_id, start, end):
+    return and_(
+        Reading.sensor_id == sensor_id,
+        Reading.reading_timestamp >= start,
+        Reading.reading_timestamp <= end
+    )
+
+
+def page_query(sensor_id, start, end, cursor=None, limit=100):
+    """Keyset query for one page; fetches ``limit + 1`` rows to detect a next page"""
+    query = select(
+        Reading.reading_id, Reading.reading_value, Reading.reading_timestamp
+    ).where(_in_window(sensor_id, start, end))
+
+    if cursor is not None:
+        cursor_ts, cursor_id = cursor
+        query = query.where(or_(
+            Reading.reading_timestamp < cursor_ts,
+            and_(Reading.reading_timestamp == cursor_ts, Reading.reading_id < cursor_id)
+        ))
+
+    return query.order_by(
+        Reading.reading_timestamp.desc(), Reading.reading_id.desc()
+    ).limit(limit + 1)
+
+
+def split_page(rows, limit):
+    """Trim the look-ahead row from a page_query result; returns (rows, next_cursor)"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.reading_timestamp, last.reading_id)
+    return rows, next_cursor
+
+
+def merge_chunks(session, sensor_id, start, end, cursor, limit, rows, current_versions=None):
+    """Interleave compacted readings into a page_query result (still ``limit + 1`` rows)"""
+    compacted = chunkstore.window_rows(session, sensor_id, start, end, cursor, limit + 1, current_versions)
+    if not compacted:
+        return rows
+    rows = sorted([*rows, *compacted], key=lambda r: (r.reading_timestamp, r.reading_id), reverse=True)
+    return rows[:limit + 1]
+
+
+def readings_page(sensor_id, start, end, cursor=None, limit=100, current_versions=None):
+    """Newest-first page of (reading_id, reading_value, reading_timestamp) rows.
+
+    Keyset pagination on (reading_timestamp, reading_id) keeps every page
+    a bounded range scan on idx_sensor_timestamp, however deep it is.
+    Readings compacted into chunks are merged in. Returns (rows, next_cursor).
+    """
+    remote = shards.scatter(page_query(sensor_id, start, end, cursor, limit))
+    rows = db.session.execute(page_query(sensor_id, start, end, cursor, limit)).all()
+    rows = merge_chunks(db.session, sensor_id, start, end, cursor, limit, rows, current_versions)
+    if remote:
+        rows = sorted([*rows, *remote.rows()], key=lambda r: (r.reading_timestamp, r.reading_id), reverse=True)
+        rows = rows[:limit + 1]
+    return split_page(rows, limit)
+
+
+def stats_query(sensor_id, start, end):
+    return select(
+        func.count(Reading.reading_id).label('count'),
+        func.min(Reading.reading_value).label('min_value'),
+        func.max(Reading.reading_value).label('max_value'),
+        func.avg(Reading.reading_value).label('avg_value'),
+        func.min(Reading.reading_timestamp).label('first_timestamp'),
+        func.max(Reading.reading_timestamp).label('last_timestamp')
+    ).where(_in_window(sensor_id, start, end))
+
+
+def stats_from_row(row):
+    return {
+        'count': row.count,
+        'min_value': float(row.min_value) if row.min_value is not None else None,
+        'max_value': float(row.max_value) if row.max_value is not None else None,
+        'avg_value': float(row.avg_value) if row.avg_value is not None else None,
+        'first_timestamp': row.first_timestamp,
+        'last_timestamp': row.last_timestamp,
+    }
+
+
+def merge_stats(session, sensor_id, start, end, stats, current_versions=None):
+    """Fold the compacted readings of the window into ``stats``"""
+    compacted = chunkstore.window_stats(session, sensor_id, start, end, current_versions)
+    if compacted is None:
+        return stats
+    count, low, high, total, first, last = compacted
+    raw = stats['count']
+    return {
+        'count': raw + count,
+        'min_value': min(low, stats['min_value']) if raw else low,
+        'max_value': max(high, stats['max_value']) if raw else high,
+        'avg_value': (total + (stats['avg_value'] * raw if raw else 0)) / (raw + count),
+        'first_timestamp': min(first, stats['first_timestamp']) if raw else first,
+        'last_timestamp': max(last, stats['last_timestamp']) if raw else last,
+    }
+
+
+def combine_stats(stats, other):
+    """Stats of two disjoint sets of readings (e.g. two shards) from their own stats"""
+    if not other['count']:
+        return stats
+    if not stats['count']:
+        return other
+    count = stats['count'] + other['count']
+    return {
+        'count': count,
+        'min_value': min(stats['min_value'], other['min_value']),
+        'max_value': max(stats['max_value'], other['max_value']),
+        'avg_value': (stats['avg_value'] * stats['count'] + other['avg_value'] * other['count']) / count,
+        'first_timestamp': min(stats['first_timestamp'], other['first_timestamp']),
+        'last_timestamp': max(stats['last_timestamp'], other['last_timestamp']),
+    }
+
+
+def window_stats(sensor_id, start, end, current_versions=None):
+    """Count, min, max, average and time span of the readings in the window"""
+    remote = shards.scatter(stats_query(sensor_id, start, end))
+    stats = stats_from_row(db.session.execute(stats_query(sensor_id, start, end)).one())
+    for row in remote.rows():
+        stats = combine_stats(stats, stats_from_row(row))
+    return merge_stats(db.session, sensor_id, start, end, stats, current_versions)
+
+
+def payload(sensor_id, start, end, rows, next_cursor, stats=None):
+    """JSON body of the series API; ``stats`` is included on the first page only"""
+    body = {
+        'sensor_id': sensor_id,
+        'window': {'start': start.isoformat(), 'end': end.isoformat()},
+        'readings': [[r.reading_id, float(r.reading_value), r.reading_timestamp.isoformat()] for r in rows],
+        'next_cursor': next_cursor
+    }
+    if stats is not None:
+        stats = dict(stats)
+        for key in ('first_timestamp', 'last_timestamp'):
+            stats[key] = stats[key].isoformat() if stats[key] else None
+        body['stats'] = stats
+    return body
@@ -0,0 +1,325 @@
+"""Location-based sharding of readings across database binds.
+
+``READING_SHARD_URLS`` lists the databases that store readings; the
+entry ``primary`` stands for the main database. Each location's readings
+go to one shard, recorded in ``LocationShard`` the first time the
+location reports, on the shard holding the fewest locations. New shards
+therefore take new locations and existing data never moves; pin
+locations (e.g. a region) with ``flask assign-location-shard``.
+
+Everything except ``Reading`` stays in the primary database. Reads keep
+their primary-database queries and add the partial results of the other
+shards, fetched in parallel on a thread pool while the primary query
+runs: see ``scatter`` and ``fold_totals``.
+
+Shards other than the primary hold only the ``Reading`` table
+(database/shard_schema.sql or ``flask create-shard-tables``). Give each
+MySQL shard its own ``auto_increment_offset`` with a shared
+``auto_increment_increment`` so reading ids stay unique across shards.
+
+Writes to other shards commit before the caller's primary transaction,
+so they must survive a retry of the whole request: a shard's
+``idx_sensor_timestamp`` is unique over (sensor_id, reading_timestamp,
+reading_value) and a reading already stored there is skipped. A request
+that failed after its shards committed (or an edge batch whose
+watermark was rolled back) can then be resent without duplicates.
+"""
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, select
+from sqlalchemy.dialects import mysql, sqlite
+
+import cache
+from models import db, Reading, LocationShard
+
+PRIMARY = 'primary'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def configured():
+    """Shard keys in configuration order (empty when sharding is off)"""
+    return current_app.config['READING_SHARDS']
+
+
+def enabled():
+    return bool(current_app.config['READING_SHARDS'])
+
+
+def _engine(key):
+    return db.engine if key == PRIMARY else db.engines[key]
+
+
+def remote():
+    """Shard keys other than the primary database"""
+    return [key for key in current_app.config['READING_SHARDS'] if key != PRIMARY]
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=current_app.config['SHARD_QUERY_WORKERS'],
+                                               thread_name_prefix='shard')
+    return _executor
+
+
+# =====================================================
+# SCATTER-GATHER READS
+# =====================================================
+
+def _fetch(engine, statement):
+    with engine.connect() as connection:
+        return connection.execute(statement).all()
+
+
+class Scatter:
+    """Rows of one statement from every shard other than the primary database.
+
+    Queries start when the object is created; ``rows()`` waits for them.
+    Falsy when there are no such shards.
+    """
+
+    def __init__(self, statement):
+        engines = [_engine(key) for key in remote()]
+        self._futures = [_pool().submit(_fetch, engine, statement) for engine in engines]
+
+    def __bool__(self):
+        return bool(self._futures)
+
+    def rows(self):
+        return [row for future in self._futures for row in future.result()]
+
+
+def scatter(statement):
+    return Scatter(statement)
+
+
+def _stream(engine, statement, batch):
+    with engine.connect() as connection:
+        yield from connection.execution_options(yield_per=batch).execute(statement)
+
+
+def export_rows(limit, batch=500):
+    """Newest (reading_id, sensor_id, reading_value, reading_timestamp) rows of the other shards.
+
+    Streams up to ``limit`` rows per shard, merged newest first.
+    """
+    statement = select(
+        Reading.reading_id, Reading.sensor_id, Reading.reading_value, Reading.reading_timestamp
+    ).order_by(Reading.reading_timestamp.desc(), Reading.reading_id.desc()).limit(limit)
+    streams = [_stream(_engine(key), statement, batch) for key in remote()]
+    return heapq.merge(*streams, key=lambda row: (row[3], row[0]), reverse=True)
+
+
+def recent_query(limit, sensor_id=None):
+    """Newest (reading_id, sensor_id, reading_value, reading_timestamp) rows, of one sensor if given"""
+    statement = select(
+        Reading.reading_id, Reading.sensor_id, Reading.reading_value, Reading.reading_timestamp
+    ).order_by(Reading.reading_timestamp.desc(), Reading.reading_id.desc()).limit(limit)
+    if sensor_id is not None:
+        statement = statement.where(Reading.sensor_id == sensor_id)
+    return statement
+
+
+SENSOR_TOTALS = select(
+    Reading.sensor_id, func.sum(Reading.reading_value), func.count(Reading.reading_id)
+).group_by(Reading.sensor_id)
+
+READING_COUNT = select(func.count(Reading.reading_id))
+
+
+def fold_totals(rows, partials, key):
+    """Fold per-sensor (sensor_id, sum, count) partials into grouped (key..., avg_value, reading_count) rows.
+
+    ``key`` maps a cached SensorRef to the row's group, like the GROUP BY
+    of the primary query that produced ``rows``. Averages are merged
+    through sums and counts, so they are exact. Sensors whose type or
+    location is missing from the reference cache are left out.
+    """
+    if not partials:
+        return rows
+    sensors = {sensor.sensor_id: sensor for sensor in cache.sensors()}
+    merged = {tuple(row[:-2]): [float(row[-2] or 0) * row[-1], row[-1]] for row in rows}
+    for sensor_id, total, count in partials:
+        sensor = sensors.get(sensor_id)
+        if sensor is None or sensor.sensor_type is None or sensor.location is None or not count:
+            continue
+        entry = merged.setdefault(key(sensor), [0.0, 0])
+        entry[0] += float(total or 0)
+        entry[1] += count
+    return [group + ((total / count if count else None), count) for group, (total, count) in merged.items()]
+
+
+# =====================================================
+# ROUTING AND WRITES
+# =====================================================
+
+@cache.reference_cache.loader('location_shards', 'LocationShard')
+def _load_assignments():
+    return dict(db.session.query(LocationShard.location_id, LocationShard.shard).all())
+
+
+def _assign(location_id, assignments):
+    """Put a new location on the configured shard with the fewest locations"""
+    load = {key: 0 for key in configured()}
+    for shard in assignments.values():
+        if shard in load:
+            load[shard] += 1
+    shard = min(load, key=lambda key: load[key])
+    db.session.add(LocationShard(location_id=location_id, shard=shard))
+    cache.bump_version('LocationShard')
+    assignments[location_id] = shard
+    return shard
+
+
+def route(rows):
+    """Ingest rows grouped by shard key"""
+    assignments = dict(cache.reference_cache.get('location_shards'))
+    locations = {sensor.sensor_id: sensor.location_id for sensor in cache.sensors()}
+    by_shard = {}
+    for row in rows:
+        location_id = locations[row['sensor_id']]
+        shard = assignments.get(location_id)
+        if shard is None:
+            shard = _assign(location_id, assignments)
+        elif shard not in configured():
+            raise RuntimeError(f'Location {location_id} is assigned to shard "{shard}", '
+                               'which is not in READING_SHARD_URLS')
+        by_shard.setdefault(shard, []).append(row)
+    return by_shard
+
+
+def _insert_statement(dialect):
+    """INSERT into Reading that skips rows already stored (see the module docstring)"""
+    table = Reading.__table__
+    if dialect == 'mysql':
+        return mysql.insert(table).on_duplicate_key_update(reading_id=table.c.reading_id)
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return table.insert()
+
+
+def newest_query(sensor_ids):
+    """Newest (sensor_id, reading_id, reading_value, reading_timestamp) of each sensor, ties included"""
+    newest = select(
+        Reading.sensor_id, func.max(Reading.reading_timestamp).label('reading_timestamp')
+    ).where(Reading.sensor_id.in_(sensor_ids)).group_by(Reading.sensor_id).subquery()
+    return select(
+        Reading.sensor_id, Reading.reading_id, Reading.reading_value, Reading.reading_timestamp
+    ).join(newest, (Reading.sensor_id == newest.c.sensor_id) &
+           (Reading.reading_timestamp == newest.c.reading_timestamp))
+
+
+def _insert(engine, rows):
+    """Insert into one shard and return each sensor's newest reading there"""
+    with engine.begin() as connection:
+        connection.execute(_insert_statement(engine.dialect.name), rows)
+        newest = {}
+        for reading in connection.execute(newest_query({row['sensor_id'] for row in rows})):
+            current = newest.get(reading.sensor_id)
+            if current is None or reading.reading_id > current.reading_id:
+                newest[reading.sensor_id] = reading
+    return list(newest.values())
+
+
+def insert_readings(rows):
+    """Write validated ingest rows to their shards; returns the newest reading per sensor stored remotely.
+
+    Rows for other shards are committed there in parallel before this
+    returns; rows for the primary database join the caller's transaction.
+    """
+    by_shard = route(rows)
+    futures = [_pool().submit(_insert, _engine(key), part) for key, part in by_shard.items() if key != PRIMARY]
+    if PRIMARY in by_shard:
+        db.session.execute(Reading.__table__.insert(), by_shard[PRIMARY])
+    return [row for future in futures for row in future.result()]
+
+
+# =====================================================
+# ADMINISTRATION
+# =====================================================
+
+def count_readings(sensor_id, limit):
+    """Readings of ``sensor_id`` on the other shards, counting no further than ``limit``"""
+    found = 0
+    for key in remote():
+        if found >= limit:
+            break
+        with _engine(key).connect() as connection:
+            found += len(connection.execute(select(Reading.reading_id).where(
+                Reading.sensor_id == sensor_id
+            ).limit(limit - found)).all())
+    return found
+
+
+def delete_readings(sensor_id, chunk_size, progress=None):
+    """Delete a sensor's readings from every shard other than the primary database.
+
+    Shards have no foreign key to Sensor, so nothing cascades there. Each
+    chunk of ``chunk_size`` rows is its own transaction; ``progress`` is
+    called with the number of rows of every chunk deleted.
+    """
+    deleted = 0
+    for key in remote():
+        engine = _engine(key)
+        while True:
+            with engine.begin() as connection:
+                ids = connection.execute(select(Reading.reading_id).where(
+                    Reading.sensor_id == sensor_id
+                ).limit(chunk_size)).scalars().all()
+                if ids:
+                    connection.execute(delete(Reading).where(Reading.reading_id.in_(ids)))
+            if not ids:
+                break
+            deleted += len(ids)
+            if progress is not None:
+                progress(len(ids))
+    return deleted
+
+
+def shard_table(metadata=None):
+    """The Reading table as created on a shard: no foreign key to Sensor, and stored readings are unique"""
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                      autoincrement=column.autoincrement) for column in Reading.__table__.columns]
+    return Table('Reading', metadata or MetaData(), *columns,
+                 Index('idx_sensor_timestamp', 'sensor_id', 'reading_timestamp', 'reading_value', unique=True),
+                 Index('idx_reading_timestamp', 'reading_timestamp'),
+                 sqlite_autoincrement=True)
+
+
+def create_tables():
+    """Create the Reading table on every shard other than the primary database"""
+    metadata = MetaData()
+    table = shard_table(metadata)
+    for key in remote():
+        table.create(_engine(key), checkfirst=True)
+    return remote()
+
+
+def assign(location_id, shard):
+    """Pin a location to a shard; only readings stored afterwards go there"""
+    if shard not in configured():
+        raise ValueError(f'Unknown shard "{shard}"; configured: {", ".join(configured())}')
+    assignment = db.session.get(LocationShard, location_id)
+    if assignment is None:
+        db.session.add(LocationShard(location_id=location_id, shard=shard))
+    else:
+        assignment.shard = shard
+    cache.bump_version('LocationShard')
+    db.session.commit()
+
+
+def summary():
+    """(shard, locations, readings) for each configured shard"""
+    assignments = cache.reference_cache.get('location_shards')
+    counts = {}
+    futures = {key: _pool().submit(_fetch, _engine(key), READING_COUNT) for key in configured()}
+    for key in configured():
+        counts[key] = (sum(1 for shard in assignments.values() if shard == key), futures[key].result()[0][0])
+    return [(key, *counts[key]) for key in configured()]
@@ -0,0 +1,290 @@
+"""Precomputed sections of the reports page.
+
+Each section (status distribution, area averages, top technicians...)
+is computed on its own and stored as a ``ReportSnapshot`` row with its
+generation time and the data versions of the tables it read. The page
+shows the newest snapshot of every section and queues a background
+refresh of those that are missing or out of date: their tables changed,
+or, for sections that depend on readings or on the clock, they are
+older than ``REPORT_SNAPSHOT_MAX_AGE`` (ingest does not bump the Reading
+version). No request computes a section itself. Snapshots are
+immutable, so each worker keeps the rendered HTML of a section until a
+newer snapshot replaces it. The dashboard's averages by sensor type are
+summed from the ``areas`` section.
+
+Older snapshots are kept (``REPORT_SNAPSHOT_KEEP`` per section) so the
+page can compare the current figures with an earlier period.
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import render_template
+from markupsafe import Markup
+from sqlalchemy import func
+
+import availability
+import cache
+import chunkstore
+import fastjson
+import procedures
+import shards
+from models import (db, Location, ReadingChunk, Reading, ReportSnapshot, Sensor, SensorStatusLog,
+                    SensorType)
+
+TOP_TECHNICIANS = 10
+RECENT_STATUS_CHANGES = 20
+
+# compute(config) -> JSON-compatible payload; measures(payload) -> {label: {measure: value}}
+# for comparisons (None: not comparable); expires: also recomputed after REPORT_SNAPSHOT_MAX_AGE
+Section = namedtuple('Section', 'title tables expires compute measures')
+
+
+# =====================================================
+# SECTIONS
+# =====================================================
+
+def _status(config):
+    return [list(row) for row in db.session.query(
+        Sensor.status, func.count(Sensor.sensor_id)
+    ).group_by(Sensor.status).all()]
+
+
+def _maintenance(config):
+    return [list(row) for row in procedures.maintenance_summary(db.session)]
+
+
+def _areas(config):
+    shard_totals = shards.scatter(shards.SENSOR_TOTALS)
+    rows = db.session.query(
+        Location.area_name, SensorType.name,
+        func.avg(Reading.reading_value), func.count(Reading.reading_id)
+    ).join(
+        Sensor, Location.location_id == Sensor.location_id
+    ).join(
+        SensorType, Sensor.type_id == SensorType.type_id
+    ).join(
+        Reading, Sensor.sensor_id == Reading.sensor_id
+    ).group_by(
+        Location.area_name, SensorType.name
+    ).all()
+    rows = chunkstore.totals(db.session, db.select(
+        Location.area_name, SensorType.name,
+        func.sum(ReadingChunk.value_sum), func.sum(ReadingChunk.reading_count)
+    ).join(
+        Sensor, Location.location_id == Sensor.location_id
+    ).join(
+        SensorType, Sensor.type_id == SensorType.type_id
+    ).join(
+        ReadingChunk, Sensor.sensor_id == ReadingChunk.sensor_id
+    ).group_by(Location.area_name, SensorType.name), rows)
+    rows = shards.fold_totals(rows, shard_totals.rows(),
+                              lambda sensor: (sensor.location.area_name, sensor.sensor_type.name))
+    return sorted((list(row) for row in rows), key=lambda row: (row[0], row[1]))
+
+
+def _technicians(config):
+    return [list(row) for row in procedures.top_technicians(db.session, TOP_TECHNICIANS)]
+
+
+def _availability(config):
+    days = config['AVAILABILITY_REPORT_DAYS']
+    end = datetime.utcnow()
+    rows, fleet = availability.index.report(end - timedelta(days=days), end, group_by='type')
+    return {'days': days, 'rows': rows, 'fleet': fleet}
+
+
+def _status_changes(config):
+    rows = db.session.query(
+        SensorStatusLog.log_id, Sensor.model, SensorStatusLog.old_status,
+        SensorStatusLog.new_status, SensorStatusLog.change_timestamp
+    ).join(
+        Sensor, SensorStatusLog.sensor_id == Sensor.sensor_id
+    ).order_by(
+        SensorStatusLog.change_timestamp.desc()
+    ).limit(RECENT_STATUS_CHANGES).all()
+    return [{'log_id': log_id, 'model': model, 'old_status': old_status, 'new_status': new_status,
+             'change_timestamp': changed.strftime('%Y-%m-%d %H:%M:%S') if changed else ''}
+            for log_id, model, old_status, new_status, changed in rows]
+
+
+SECTIONS = {
+    'status': Section('Sensor Status Distribution', ('Sensor',), False, _status,
+                      lambda rows: {status: {'Sensors': count} for status, count in rows}),
+    'maintenance': Section('Maintenance Summary', ('MaintenanceEvent',), False, _maintenance,
+                           lambda rows: {row[0]: {'Events': row[1], 'Sensors': row[2]} for row in rows}),
+    'areas': Section('Average Readings by Area & Sensor Type',
+                     ('Reading', 'ReadingChunk', 'Sensor', 'Location', 'SensorType'), True, _areas,
+                     lambda rows: {f'{area} / {sensor_type}': {'Average': avg, 'Readings': count}
+                                   for area, sensor_type, avg, count in rows}),
+    'technicians': Section('Top Technicians', ('MaintenanceEvent', 'Technician'), False, _technicians,
+                           lambda rows: {row[1]: {'Events': row[3]} for row in rows}),
+    'availability': Section('Availability by Sensor Type', ('Sensor',), True, _availability,
+                            lambda data: {row['name']: {'Uptime %': row['uptime_pct'], 'Failures': row['failures']}
+                                          for row in data['rows']}),
+    'status_changes': Section('Recent Sensor Status Changes', ('Sensor',), False, _status_changes, None),
+}
+
+COMPARABLE = tuple(section for section, spec in SECTIONS.items() if spec.measures is not None)
+
+
+# =====================================================
+# GENERATION
+# =====================================================
+
+def _versions(section):
+    versions = cache.current_versions()
+    return {table: versions.get(table, 0) for table in SECTIONS[section].tables}
+
+
+def generate(section, config):
+    """Compute ``section`` and add its snapshot to the session; the caller commits"""
+    # Read the versions first: a change during the computation makes the snapshot stale, not wrong
+    versions = _versions(section)
+    started = time.perf_counter()
+    payload = SECTIONS[section].compute(config)
+    snapshot = ReportSnapshot(
+        section=section,
+        generated_at=datetime.utcnow(),
+        versions=json.dumps(versions, sort_keys=True),
+        duration_ms=(time.perf_counter() - started) * 1000,
+        payload=fastjson.dumps(payload).decode('utf-8')
+    )
+    db.session.add(snapshot)
+    return snapshot
+
+
+def refresh(job, sections, config):
+    """Job entry point: snapshot each of ``sections`` and prune old snapshots"""
+    job.total = len(sections)
+    for section in sections:
+        job.message = f'Computing {SECTIONS[section].title}'
+        generate(section, config)
+        db.session.commit()
+        job.progress += 1
+    pruned = prune(config['REPORT_SNAPSHOT_KEEP'])
+    db.session.commit()
+    job.message = f'Generated {len(sections)} report section(s)'
+    return {'sections': list(sections), 'pruned': pruned}
+
+
+def prune(keep):
+    """Delete all but the newest ``keep`` snapshots of each section; returns the rows deleted"""
+    deleted = 0
+    for section in SECTIONS:
+        cutoff = db.session.query(ReportSnapshot.snapshot_id).filter(
+            ReportSnapshot.section == section
+        ).order_by(ReportSnapshot.snapshot_id.desc()).offset(keep - 1).limit(1).scalar()
+        if cutoff is not None:
+            deleted += ReportSnapshot.query.filter(
+                ReportSnapshot.section == section, ReportSnapshot.snapshot_id < cutoff
+            ).delete(synchronize_session=False)
+    return deleted
+
+
+# =====================================================
+# READING
+# =====================================================
+
+def latest():
+    """{section: newest ReportSnapshot} for the sections that have one"""
+    newest = db.session.query(func.max(ReportSnapshot.snapshot_id)).group_by(ReportSnapshot.section)
+    snapshots = ReportSnapshot.query.filter(ReportSnapshot.snapshot_id.in_(newest.scalar_subquery())).all()
+    return {snapshot.section: snapshot for snapshot in snapshots if snapshot.section in SECTIONS}
+
+
+def newest(section):
+    """Newest snapshot of ``section``, or None"""
+    return ReportSnapshot.query.filter_by(section=section).order_by(ReportSnapshot.snapshot_id.desc()).first()
+
+
+def type_averages(snapshot):
+    """(sensor type, average, readings) of an ``areas`` snapshot, summed over the areas"""
+    totals = {}
+    for _, sensor_type, average, count in json.loads(snapshot.payload):
+        value_sum, readings = totals.get(sensor_type, (0.0, 0))
+        totals[sensor_type] = (value_sum + (average or 0) * count, readings + count)
+    return [(sensor_type, value_sum / readings if readings else None, readings)
+            for sensor_type, (value_sum, readings) in sorted(totals.items())]
+
+
+def is_current(snapshot, config, now=None):
+    if json.loads(snapshot.versions) != _versions(snapshot.section):
+        return False
+    if SECTIONS[snapshot.section].expires:
+        age = ((now or datetime.utcnow()) - snapshot.generated_at).total_seconds()
+        return age <= config['REPORT_SNAPSHOT_MAX_AGE']
+    return True
+
+
+def stale(snapshots, config):
+    """Sections without a snapshot or whose newest one is out of date, in page order"""
+    now = datetime.utcnow()
+    return [section for section in SECTIONS
+            if section not in snapshots or not is_current(snapshots[section], config, now)]
+
+
+def history(limit):
+    """(snapshot_id, section, generated_at) of comparable snapshots, newest first, without payloads"""
+    return db.session.query(
+        ReportSnapshot.snapshot_id, ReportSnapshot.section, ReportSnapshot.generated_at
+    ).filter(ReportSnapshot.section.in_(COMPARABLE)).order_by(
+        ReportSnapshot.generated_at.desc(), ReportSnapshot.snapshot_id.desc()
+    ).limit(limit).all()
+
+
+Change = namedtuple('Change', 'label measure before after change')
+
+
+def compare(earlier, later):
+    """Changed figures between two snapshots of the same section"""
+    measures = SECTIONS[later.section].measures
+    before, after = measures(json.loads(earlier.payload)), measures(json.loads(later.payload))
+    changes = []
+    for label in sorted(set(before) | set(after), key=str):
+        old, new = before.get(label, {}), after.get(label, {})
+        for measure in dict.fromkeys([*old, *new]):
+            a, b = old.get(measure), new.get(measure)
+            if a == b:
+                continue
+            change = b - a if a is not None and b is not None else None
+            changes.append(Change(label, measure, a, b, change))
+    return changes
+
+
+# =====================================================
+# FRAGMENT CACHE
+# =====================================================
+
+class FragmentCache:
+    """Rendered HTML of each section's newest snapshot, per process"""
+
+    def __init__(self):
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def render(self, snapshot):
+        cached = self._fragments.get(snapshot.section)
+        if cached is not None and cached[0] == snapshot.snapshot_id:
+            return cached[1]
+        html = Markup(render_template(f'reports/_{snapshot.section}.html',
+                                      data=json.loads(snapshot.payload), snapshot=snapshot,
+                                      section=SECTIONS[snapshot.section]))
+        with self._lock:
+            current = self._fragments.get(snapshot.section)
+            if current is None or current[0] < snapshot.snapshot_id:
+                self._fragments[snapshot.section] = (snapshot.snapshot_id, html)
+        return html
+
+    def pending(self, section):
+        """Placeholder for a section that has no snapshot yet"""
+        return Markup(render_template('reports/_pending.html', section=SECTIONS[section]))
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+fragments = FragmentCache()
@@ -126,6 +126,68 @@ document.addEventListener('DOMContentLoaded', function() {
         document.body.removeChild(a);
     };
 
+    // Global search autocomplete (/api/search)
+    const globalSearch = document.getElementById('globalSearch');
+    if (globalSearch) {
+        const input = globalSearch.querySelector('input');
+        const menu = document.getElementById('globalSearchResults');
+        const typeLabels = { sensor: 'Sensor', location: 'Location', technician: 'Technician', sensor_type: 'Type' };
+        let timer = null;
+        let pending = null;
+
+        const render = function(results) {
+            menu.innerHTML = '';
+            results.forEach(function(result) {
+                const item = document.createElement('a');
+                item.className = 'dropdown-item';
+                item.href = result.url;
+                const badge = document.createElement('span');
+                badge.className = 'badge bg-secondary me-2';
+                badge.textContent = typeLabels[result.type] || result.type;
+                item.appendChild(badge);
+                item.appendChild(document.createTextNode(result.label));
+                if (result.detail) {
+                    const detail = document.createElement('small');
+                    detail.className = 'text-muted ms-2';
+                    detail.textContent = result.detail;
+                    item.appendChild(detail);
+                }
+                menu.appendChild(item);
+            });
+            menu.classList.toggle('show', results.length > 0);
+        };
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const q = input.value.trim();
+            if (!q) {
+                render([]);
+                return;
+            }
+            timer = setTimeout(function() {
+                if (pending) pending.abort();
+                pending = new AbortController();
+                fetch(globalSearch.dataset.url + '?q=' + encodeURIComponent(q), { signal: pending.signal })
+                    .then(function(response) { return response.ok ? response.json() : { results: [] }; })
+                    .then(function(data) { render(data.results); })
+                    .catch(function() {});
+            }, 150);
+        });
+
+        input.addEventListener('keydown', function(e) {
+            const first = menu.querySelector('.dropdown-item');
+            if (e.key === 'Enter' && first) {
+                window.location = first.href;
+            } else if (e.key === 'Escape') {
+                render([]);
+            }
+        });
+
+        document.addEventListener('click', function(e) {
+            if (!globalSearch.contains(e.target)) menu.classList.remove('show');
+        });
+    }
+
     // Loading indicator for forms
     const submitButtons = document.querySelectorAll('form button[type="submit"]');
     submitButtons.forEach(function(button) {
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Testing app on an empty in-memory SQLite database, inside an app context"""
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,56 @@
+"""Status timelines built incrementally from SensorStatusLog"""
+from datetime import date, datetime
+
+import pytest
+
+from availability import AvailabilityIndex
+from models import db, Location, Sensor, SensorStatusLog, SensorType
+
+
+@pytest.fixture
+def sensor_id(app):
+    sensor_type = SensorType(name='Temperature')
+    location = Location(area_name='Plot 1', latitude=12.97, longitude=77.59)
+    db.session.add_all([sensor_type, location])
+    db.session.flush()
+    sensor = Sensor(model='AV-1', install_date=date(2024, 1, 1), status='ACTIVE',
+                    type_id=sensor_type.type_id, location_id=location.location_id)
+    db.session.add(sensor)
+    db.session.commit()
+    return sensor.sensor_id
+
+
+def log(sensor_id, log_id, old_status, new_status, day):
+    db.session.add(SensorStatusLog(log_id=log_id, sensor_id=sensor_id, old_status=old_status,
+                                   new_status=new_status, change_timestamp=datetime(2024, 2, day)))
+    db.session.commit()
+
+
+def test_refresh_applies_rows_committed_out_of_order(sensor_id):
+    index = AvailabilityIndex()
+    log(sensor_id, 1, 'ACTIVE', 'INACTIVE', 1)
+    log(sensor_id, 3, 'MAINTENANCE', 'ACTIVE', 5)
+    index.refresh()
+
+    # Id 2 was allocated before id 3 but committed after the refresh above
+    log(sensor_id, 2, 'INACTIVE', 'MAINTENANCE', 3)
+    index.refresh()
+    index.refresh()
+
+    assert index.status_at(datetime(2024, 2, 4)) == {sensor_id: 'MAINTENANCE'}
+    rows, fleet = index.report(datetime(2024, 2, 1), datetime(2024, 2, 7))
+    assert fleet['downtime_hours'] == 48
+    assert fleet['maintenance_hours'] == 48
+    assert fleet['uptime_pct'] == pytest.approx(100 / 3, abs=0.01)
+
+
+def test_refresh_stops_rereading_below_the_overlap(app, sensor_id):
+    app.config['AVAILABILITY_LOG_OVERLAP'] = 2
+    index = AvailabilityIndex()
+    for log_id in range(1, 6):
+        log(sensor_id, log_id, 'ACTIVE' if log_id % 2 else 'INACTIVE',
+            'INACTIVE' if log_id % 2 else 'ACTIVE', log_id)
+    index.refresh()
+
+    assert index._watermark == 5
+    assert index._applied == {4, 5}
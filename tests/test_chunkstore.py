@@ -0,0 +1,134 @@
+"""Round trips of the chunk storage codecs"""
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import chunkstore
+from models import ReadingChunk
+
+START = 1_700_000_000  # 2023-11-14 22:13:20 UTC
+
+
+def timestamps_round_trip(seconds):
+    return chunkstore.decode_timestamps(chunkstore.encode_timestamps(seconds), len(seconds))
+
+
+def values_round_trip(values):
+    return chunkstore.decode_values(chunkstore.encode_values(values), len(values))
+
+
+def ids_round_trip(ids):
+    return chunkstore.decode_ids(chunkstore.encode_ids(ids), len(ids))
+
+
+@pytest.mark.parametrize('seconds', [
+    [],
+    [START],
+    [0, 1],
+    [START] * 5,  # duplicate timestamps: zero deltas
+    [START + 60 * i for i in range(100)],  # regular sampling
+    [START, START + 60, START + 120, START + 121, START + 3600, START + 3601],  # jitter
+    [START, START + 1, START + 86400 * 365 * 5, START + 86400 * 365 * 5 + 1],  # multi-year gap
+])
+def test_timestamps_round_trip(seconds):
+    assert timestamps_round_trip(seconds) == seconds
+
+
+@pytest.mark.parametrize('dod', [63, 64, -64, -65, 255, 256, -256, -257, 2047, 2048, -2048, -2049])
+def test_timestamps_round_trip_at_bucket_boundaries(dod):
+    seconds = [START, START + 10, START + 20 + dod]
+    assert timestamps_round_trip(seconds) == seconds
+
+
+def test_timestamps_round_trip_random():
+    rng = random.Random(40)
+    seconds = [START]
+    for _ in range(1000):
+        seconds.append(seconds[-1] + rng.choice([0, 1, 59, 60, 61, rng.randint(0, 10 ** 6)]))
+    assert timestamps_round_trip(seconds) == seconds
+
+
+@pytest.mark.parametrize('values', [
+    [],
+    [0.0],
+    [0.0, 0.0, 0.0],
+    [215000.0] * 10,  # repeated values: one bit each
+    [-1.0, 1.0, -1.0],  # sign flips
+    [9999999999.0, -9999999999.0, 0.0, 1.0],  # DECIMAL(10,4) extremes, scaled
+    [1.0, 2.0 ** 52, 3.0, 2.0 ** 53],
+])
+def test_values_round_trip(values):
+    assert values_round_trip(values) == values
+
+
+def test_values_round_trip_random():
+    rng = random.Random(40)
+    values = [float(rng.randint(-10 ** 10, 10 ** 10)) for _ in range(500)]
+    values += [float(215000 + rng.randint(-5, 5)) for _ in range(500)]
+    assert values_round_trip(values) == values
+
+
+@pytest.mark.parametrize('ids', [
+    [],
+    [1],
+    list(range(1, 101)),
+    [10, 5, 7, 1],  # out of order: negative deltas
+    [1, 2 ** 40, 2 ** 62, 3],
+])
+def test_ids_round_trip(ids):
+    assert ids_round_trip(ids) == ids
+
+
+def test_decode_ids_ignores_trailing_ids():
+    assert chunkstore.decode_ids(chunkstore.encode_ids([1, 2, 3]), 2) == [1, 2]
+
+
+def chunk_round_trip(rows):
+    columns = chunkstore.build_chunk(7, datetime(2024, 1, 1), rows)
+    return columns, chunkstore.decode_chunk(ReadingChunk(**columns))
+
+
+def test_chunk_round_trip():
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    rows = [(100 + i, Decimal('21.5') + Decimal(i) / 10000, base + timedelta(minutes=i)) for i in range(50)]
+    rows.append((200, Decimal('-40.0000'), base + timedelta(hours=3)))
+    rows.append((201, Decimal('999999.9999'), base + timedelta(hours=3)))
+
+    columns, decoded = chunk_round_trip(rows)
+
+    assert [(row.reading_id, row.reading_value, row.reading_timestamp) for row in decoded] == rows
+    assert columns['reading_count'] == len(rows)
+    assert columns['min_value'] == Decimal('-40')
+    assert columns['max_value'] == Decimal('999999.9999')
+    assert columns['value_sum'] == sum(value for _, value, _ in rows)
+    assert columns['first_timestamp'] == base
+    assert columns['last_timestamp'] == base + timedelta(hours=3)
+
+
+def test_chunk_keeps_second_precision():
+    moment = datetime(2024, 1, 1, 12, 0, 5, 999999)
+    rows = [(1, Decimal('1.0001'), moment), (2, Decimal('1.0002'), moment + timedelta(microseconds=1))]
+
+    columns, decoded = chunk_round_trip(rows)
+
+    truncated = moment.replace(microsecond=0)
+    assert [row.reading_timestamp for row in decoded] == [truncated, truncated + timedelta(seconds=1)]
+    assert columns['first_timestamp'] == truncated
+
+
+def test_chunk_sorts_rows_by_timestamp():
+    base = datetime(2024, 1, 1)
+    rows = [(3, Decimal('3'), base + timedelta(seconds=30)), (1, Decimal('1'), base),
+            (2, Decimal('2'), base + timedelta(seconds=10))]
+
+    _, decoded = chunk_round_trip(rows)
+
+    assert [row.reading_id for row in decoded] == [1, 2, 3]
+
+
+def test_chunk_rounds_values_to_column_scale():
+    _, decoded = chunk_round_trip([(1, 21.123456, datetime(2024, 1, 1))])
+
+    assert decoded[0].reading_value == Decimal('21.1235')
@@ -0,0 +1,53 @@
+"""Heatmaps and maintenance scores read compacted readings like live ones"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import chunkstore
+import heatmap
+import scoring
+from jobs import Job
+from models import db, Location, Reading, ReadingChunk, Sensor, SensorType
+
+
+@pytest.fixture
+def now(app):
+    """Two sensors at each of two locations with two days of hourly readings"""
+    sensor_type = SensorType(name='Temperature')
+    locations = [Location(area_name=f'Plot {i}', latitude=12.97 + i / 100, longitude=77.59) for i in range(2)]
+    db.session.add_all([sensor_type] + locations)
+    db.session.flush()
+    sensors = [Sensor(model=f'CMP-{i}', install_date=date(2024, 1, 1), status='ACTIVE',
+                      type_id=sensor_type.type_id, location_id=locations[i % 2].location_id) for i in range(4)]
+    db.session.add_all(sensors)
+    db.session.flush()
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    db.session.add_all(Reading(sensor_id=sensor.sensor_id, reading_value=20 + (i * hour % 17) / 8,
+                               reading_timestamp=now - timedelta(hours=hour))
+                       for i, sensor in enumerate(sensors) for hour in range(48))
+    db.session.commit()
+    return now
+
+
+def snapshot(now):
+    start, end = now - timedelta(hours=40), now - timedelta(hours=14)
+    values = {aggregate: [(point['location_id'], point['value'], point['sensors'])
+                          for point in heatmap.location_values(1, start, end, aggregate)]
+              for aggregate in ('avg', 'latest')}
+    moments = scoring._window_moments(now - timedelta(hours=40), now - timedelta(hours=20))
+    return values, {sensor_id: {name: tuple(float(x) for x in bucket) for name, bucket in buckets.items()}
+                    for sensor_id, buckets in moments.items()}
+
+
+def test_compacted_readings_keep_heatmaps_and_scores(now):
+    before = snapshot(now)
+
+    chunkstore.compact(Job('compact'), db.session, now - timedelta(hours=12), 6)
+    assert db.session.query(ReadingChunk).count()
+
+    after = snapshot(now)
+    assert after[0] == before[0]
+    assert after[1].keys() == before[1].keys()
+    for sensor_id, buckets in before[1].items():
+        for name, bucket in buckets.items():
+            assert after[1][sensor_id][name] == pytest.approx(bucket)
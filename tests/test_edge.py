@@ -0,0 +1,103 @@
+"""Central-side application of edge sync batches"""
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+import edge
+from models import db, Location, Reading, Sensor, SensorType, SyncWatermark
+
+
+@pytest.fixture
+def sensor_ids(app):
+    sensor_type = SensorType(name='Temperature')
+    location = Location(area_name='Plot 1', latitude=12.97, longitude=77.59)
+    db.session.add_all([sensor_type, location])
+    db.session.flush()
+    sensors = [Sensor(model=f'EDGE-{i}', install_date=date(2024, 1, 1), status='ACTIVE',
+                      type_id=sensor_type.type_id, location_id=location.location_id) for i in range(3)]
+    db.session.add_all(sensors)
+    db.session.commit()
+    return [sensor.sensor_id for sensor in sensors]
+
+
+def edge_rows(sensor_ids, count=30):
+    """(edge reading id, sensor id, value, timestamp) rows in id order, one second precision"""
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(hours=2)
+    return [(100 + i, sensor_ids[i % len(sensor_ids)], 20 + i / 8, start + timedelta(seconds=61 * i))
+            for i in range(count)]
+
+
+def stored_rows():
+    return db.session.query(Reading.sensor_id, Reading.reading_value, Reading.reading_timestamp).order_by(
+        Reading.reading_timestamp, Reading.sensor_id).all()
+
+
+def test_apply_batch_stores_readings(app, sensor_ids):
+    rows = edge_rows(sensor_ids)
+
+    result = edge.apply_batch(edge.encode_batch('site-a', 0, rows), set(sensor_ids))
+    db.session.commit()
+
+    assert result['accepted'] == len(rows)
+    assert result['skipped'] == 0
+    assert result['watermark'] == rows[-1][0]
+    assert [(sensor_id, float(value), timestamp) for sensor_id, value, timestamp in stored_rows()] == \
+        [(sensor_id, value, timestamp) for _, sensor_id, value, timestamp in rows]
+
+
+def test_apply_batch_twice_stores_it_once(app, sensor_ids):
+    rows = edge_rows(sensor_ids)
+    payload = edge.encode_batch('site-a', 0, rows)
+    edge.apply_batch(payload, set(sensor_ids))
+    db.session.commit()
+    stored = stored_rows()
+
+    # A retry after the response to the first attempt was lost
+    result = edge.apply_batch(payload, set(sensor_ids))
+    db.session.commit()
+
+    assert result['accepted'] == 0
+    assert result['skipped'] == len(rows)
+    assert result['watermark'] == rows[-1][0]
+    assert stored_rows() == stored
+    assert db.session.query(func.count(Reading.reading_id)).scalar() == len(rows)
+    assert db.session.get(SyncWatermark, 'site-a').last_reading_id == rows[-1][0]
+
+
+def test_apply_batch_skips_rows_of_an_overlapping_batch(app, sensor_ids):
+    rows = edge_rows(sensor_ids)
+    edge.apply_batch(edge.encode_batch('site-a', 0, rows[:20]), set(sensor_ids))
+    db.session.commit()
+
+    result = edge.apply_batch(edge.encode_batch('site-a', 0, rows[10:]), set(sensor_ids))
+    db.session.commit()
+
+    assert result['accepted'] == 10
+    assert result['skipped'] == 10
+    assert db.session.query(func.count(Reading.reading_id)).scalar() == len(rows)
+
+
+def test_apply_batch_rejects_a_gap_after_the_watermark(app, sensor_ids):
+    rows = edge_rows(sensor_ids)
+    edge.apply_batch(edge.encode_batch('site-a', 0, rows[:10]), set(sensor_ids))
+    db.session.commit()
+
+    with pytest.raises(edge.WatermarkMismatch):
+        edge.apply_batch(edge.encode_batch('site-a', rows[15][0], rows[16:]), set(sensor_ids))
+
+
+@pytest.mark.parametrize('change, message', [
+    ({'last_id': None}, 'last_id is required'),
+    ({'last_id': '129'}, 'last_id must be a non-negative integer'),
+    ({'last_id': 110}, 'last_id must be at least'),
+    ({'after': -1}, 'after must be a non-negative integer'),
+    ({'site_id': ''}, 'site_id is required'),
+    ({'sensors': 5}, 'Malformed batch'),
+])
+def test_apply_batch_rejects_a_malformed_batch(app, sensor_ids, change, message):
+    payload = {**edge.encode_batch('site-a', 0, edge_rows(sensor_ids)), **change}
+
+    with pytest.raises(ValueError, match=message):
+        edge.apply_batch(payload, set(sensor_ids))
+    assert db.session.query(func.count(Reading.reading_id)).scalar() == 0
@@ -0,0 +1,42 @@
+"""Heatmap time windows and interpolation limits"""
+import random
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import heatmap
+
+
+@pytest.mark.parametrize('hours', ['0', '-5', '100000000', str(10 ** 30)])
+def test_out_of_range_hours_are_rejected(hours):
+    with pytest.raises(ValueError):
+        heatmap.parse_window(MultiDict({'hours': hours}))
+
+
+def test_dense_networks_are_binned_to_the_limit():
+    rnd = random.Random(1)
+    points = [{'latitude': 12.9 + rnd.random() / 10, 'longitude': 77.5 + rnd.random() / 10,
+               'value': 25.0, 'sensors': 2} for _ in range(2000)]
+    bounds = heatmap.grid_bounds(points)
+
+    binned = heatmap.bin_points(points, bounds, 100)
+
+    assert len(binned) <= 100
+    assert sum(p['sensors'] for p in binned) == 4000
+    assert all(p['value'] == pytest.approx(25.0) for p in binned)
+    assert heatmap.bin_points(points[:50], bounds, 100) == points[:50]
+
+
+def test_idw_uses_cached_weights_for_new_values():
+    heatmap.clear_cache()
+    points = [{'latitude': 12.9 + i / 100, 'longitude': 77.5 + (i * 7 % 10) / 100, 'value': float(i)}
+              for i in range(40)]
+    bounds = heatmap.grid_bounds(points)
+    first = heatmap.idw_grid(points, bounds, 20, neighbours=8)
+
+    doubled = [dict(p, value=p['value'] * 2) for p in points]
+    second = heatmap.idw_grid(doubled, bounds, 20, neighbours=8)
+
+    assert len(heatmap._weights_cache) == 1
+    assert second == [[pytest.approx(v * 2) for v in row] for row in first]
+    heatmap.clear_cache()
@@ -0,0 +1,27 @@
+"""Validation of ingest payloads"""
+from datetime import datetime
+
+import pytest
+
+import ingest
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-01-01T10:00', datetime(2024, 1, 1, 10, 0)),
+    ('2024-01-01T10:00:00Z', datetime(2024, 1, 1, 10, 0)),
+    ('2024-01-01T10:00:00+05:00', datetime(2024, 1, 1, 5, 0)),
+    ('2024-01-01T10:00:00-03:30', datetime(2024, 1, 1, 13, 30)),
+    (1704103200, datetime(2024, 1, 1, 10, 0)),
+    (1704103200.5, datetime(2024, 1, 1, 10, 0, 0, 500000)),
+])
+def test_timestamps_are_stored_as_naive_utc(value, expected):
+    rows = ingest.parse_readings({'sensor_id': 1, 'reading_value': 21.5, 'reading_timestamp': value}, {1})
+
+    assert rows[0]['reading_timestamp'] == expected
+
+
+def test_invalid_timestamp_is_rejected():
+    with pytest.raises(ingest.IngestError) as error:
+        ingest.parse_readings({'sensor_id': 1, 'reading_value': 21.5, 'reading_timestamp': 'yesterday'}, {1})
+
+    assert error.value.errors == ['readings[0]: invalid reading_timestamp']
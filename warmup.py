@@ -0,0 +1,105 @@
+"""Warm a process up before it takes traffic.
+
+The first requests after a start otherwise pay for mapper configuration,
+template compilation, new database connections and empty reference
+caches. ``warm`` does that work up front, phase by phase:
+
+- ``mappers``: configure every SQLAlchemy mapper
+- ``templates``: compile every Jinja template
+- ``connections``: fill each engine's pool up to ``WARMUP_CONNECTIONS``
+- ``caches``: load every reference cache entry (lookup lists, facets,
+  search indexes)
+- ``requests``: GET each of ``WARMUP_PATHS`` as the first active user,
+  which also warms the per-endpoint code paths and user cache
+
+With a preforking server, run the ``MASTER_PHASES`` once before forking
+so workers share the result copy-on-write, then ``release`` the master's
+connections (sockets must not be shared across a fork) and run the
+``WORKER_PHASES`` in each worker before it accepts connections; see
+gunicorn.conf.py. Nothing warm-up does is counted in /metrics.
+"""
+import time
+
+from sqlalchemy.orm import configure_mappers
+
+import cache
+import metrics
+from models import db, User
+
+PHASES = ('mappers', 'templates', 'connections', 'caches', 'requests')
+MASTER_PHASES = ('mappers', 'templates', 'caches')
+WORKER_PHASES = ('connections', 'caches', 'requests')
+
+
+def _mappers(app):
+    configure_mappers()
+
+
+def _templates(app):
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
+
+
+def _connections(app):
+    with app.app_context():
+        for engine in set(db.engines.values()):
+            pool = engine.pool
+            count = min(app.config['WARMUP_CONNECTIONS'], pool.size() if hasattr(pool, 'size') else 1)
+            connections = [engine.connect() for _ in range(count)]
+            for connection in connections:
+                connection.close()
+
+
+def _caches(app):
+    with app.app_context():
+        cache.reference_cache.prime()
+
+
+def _requests(app):
+    with app.app_context():
+        user_id = db.session.query(User.user_id).filter(User.is_active.is_(True)).order_by(User.user_id).scalar()
+    if user_id is None:
+        app.logger.info('Warm-up: no active user, skipping the requests phase')
+        return
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    for path in app.config['WARMUP_PATHS']:
+        response = client.get(path)
+        if response.status_code >= 400:
+            app.logger.warning('Warm-up: GET %s returned %s', path, response.status_code)
+
+
+_RUNNERS = {
+    'mappers': _mappers,
+    'templates': _templates,
+    'connections': _connections,
+    'caches': _caches,
+    'requests': _requests,
+}
+
+
+def warm(app, phases=PHASES):
+    """Run ``phases`` in order; returns {phase: seconds} and warns above ``WARMUP_BUDGET``"""
+    timings = {}
+    for phase in phases:
+        started = time.perf_counter()
+        _RUNNERS[phase](app)
+        timings[phase] = time.perf_counter() - started
+    metrics.reset()
+
+    total = sum(timings.values())
+    summary = ', '.join(f'{phase} {seconds * 1000:.0f} ms' for phase, seconds in timings.items())
+    budget = app.config['WARMUP_BUDGET']
+    if budget and total > budget:
+        app.logger.warning('Warm-up took %.2f s, over the %.2f s budget (%s)', total, budget, summary)
+    else:
+        app.logger.info('Warm-up took %.2f s (%s)', total, summary)
+    return timings
+
+
+def release(app):
+    """Close every pooled connection; call in the master before forking workers"""
+    with app.app_context():
+        for engine in set(db.engines.values()):
+            engine.dispose()